@@ -23,13 +23,8 @@
 
 import flask
 
-from pywps import Service
-
-from processes import processes
+# the wps service is built once, by app_main_page
 from app_main_page import main_page
 
-config_path = 'data/config/'
-service = Service(processes, [config_path+'pywps.cfg'])
-
 app = flask.Flask(__name__)
 app.register_blueprint(main_page)
@@ -1,18 +1,30 @@
 import os
 import sys
+import mimetypes
 import flask
 import pywps
+from pywps import FORMATS
 
 #import set_project_root_dir
 #set_project_root_dir.set_project_root_dir()  # call this before import processes
 
 import processes
+import backend.job_queue
+import backend.metrics
+import backend.warmup
+import processes.ds_pool
+from backend.formats import czml_format, float64_format
+from processes.result_cache import result_cache
 
 # This is, how you start PyWPS instance
 # config_file_path = './data/static/config/'
 config_file_path = ''
-config_files = [config_file_path+'pywps.cfg']
-service = pywps.Service(processes=processes.processes, cfgfiles=config_files)
+# data/config/pywps.cfg overrides ./pywps.cfg, as it did when app.py built a second service
+config_files = [config_file_path+'pywps.cfg', 'data/config/pywps.cfg']
+service = pywps.Service(processes=processes.get_processes(), cfgfiles=config_files)
+job_queue = backend.job_queue.install(service)
+backend.metrics.install()
+processes.ds_pool.install()
 
 main_page = flask.Blueprint('main_page', __name__, template_folder='templates')
 
@@ -27,10 +39,42 @@ def sys_path():
     return str(sys.path)
 
 
+@main_page.route("/ds_pool")
+def ds_pool_stats():
+    return flask.jsonify(processes.ds_pool.ds_pool.stats())
+
+
+@main_page.route("/result_cache")
+def result_cache_stats():
+    return flask.jsonify(result_cache.stats())
+
+
+@main_page.route("/jobs")
+def job_queue_stats():
+    return flask.jsonify(job_queue.stats())
+
+
+@main_page.route("/metrics")
+def metrics():
+    from processes.cutline import cutline_cache
+    gauges = dict(
+        talos_wps_ds_pool=('dataset pool stats', processes.ds_pool.ds_pool.stats()),
+        talos_wps_result_cache=('result cache stats', result_cache.stats()),
+        talos_wps_cutline_cache=('parsed cutlines cache stats', cutline_cache.stats()),
+        talos_wps_warmup=('arrays shared by the pre-fork warm up', backend.warmup.stats()),
+    )
+    return flask.Response(backend.metrics.render(gauges), content_type='text/plain; version=0.0.4')
+
+
 # return 'hello to the WPS server root'
 @main_page.route('/wps', methods=['GET', 'POST'])
 def wps():
-    return service
+    # sync executes run inside from_app, their phases are attached as a Server-Timing header
+    with backend.metrics.request_timings() as timings:
+        response = flask.Response.from_app(service, flask.request.environ)
+    if timings.phases:
+        response.headers['Server-Timing'] = timings.server_timing()
+    return response
 
 
 @main_page.route("/")
@@ -39,34 +83,59 @@ def hello():
     request_url = flask.request.url
     return flask.render_template('home.html', request_url=request_url,
                                  server_url=server_url,
-                                 process_descriptor=processes.process_descriptor)
+                                 process_descriptor=processes.get_process_descriptor())
+
 
+mime_types = {
+    '.tif': FORMATS.GEOTIFF.mime_type,
+    '.tiff': FORMATS.GEOTIFF.mime_type,
+    '.xml': 'text/xml',
+    '.gml': FORMATS.GML.mime_type,
+    czml_format.extension: czml_format.mime_type,
+    float64_format.extension: float64_format.mime_type,
+}
 
-def flask_response(targetfile):
+
+def flask_response(targetfile, base_dir=None):
+    # files are streamed (sendfile when the server supports it) with Range, ETag and Last-Modified support,
+    # so large outputs are never read into memory and /vsicurl/ clients can read windows of them
+    targetfile = os.path.abspath(targetfile)
+    if base_dir is not None and not targetfile.startswith(os.path.abspath(base_dir) + os.sep):
+        flask.abort(404)
     if os.path.isfile(targetfile):
-        with open(targetfile, mode='rb') as f:
-            file_bytes = f.read()
-        file_ext = os.path.splitext(targetfile)[1]
-        mime_type = 'text/xml' if 'xml' in file_ext else None
-        return flask.Response(file_bytes, content_type=mime_type)
+        file_ext = os.path.splitext(targetfile)[1].lower()
+        mime_type = mime_types.get(file_ext) or mimetypes.guess_type(targetfile)[0] or 'application/octet-stream'
+        return flask.send_file(targetfile, mimetype=mime_type, conditional=True)
     else:
         flask.abort(404)
 
 
+@main_page.route('/outputs/<job>/<int:z>/<int:x>/<int:y><ext>')
+def output_tile(job, z, x, y, ext):
+    import backend.tiles
+    try:
+        tile_filename = backend.tiles.render_tile(job, z, x, y, ext)
+    except (IOError, OSError, ValueError):
+        tile_filename = None
+    if tile_filename is None:
+        flask.abort(404)
+    return flask_response(tile_filename)
+
+
 @main_page.route('/outputs/' + '<path:filename>')
 def outputfile(filename):
     targetfile = os.path.join('outputs', filename)
-    return flask_response(targetfile)
+    return flask_response(targetfile, 'outputs')
 
 
 @main_page.route('/data/' + '<path:filename>')
 def datafile(filename):
     targetfile = os.path.join('data', filename)
-    return flask_response(targetfile)
+    return flask_response(targetfile, 'data')
 
 
 # not sure how the static route works. static route doesn't reach this function.
 @main_page.route('/static/' + '<path:filename>')
 def staticfile(filename):
     targetfile = os.path.join('static', filename)
-    return flask_response(targetfile)
+    return flask_response(targetfile, 'static')
@@ -0,0 +1,97 @@
+import json
+import datetime as dt
+from enum import Enum
+
+import attr
+from czml3.base import BaseCZMLObject
+
+NON_DELETE_PROPERTIES = ('id', 'delete')
+ISO8601_FORMAT_Z = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+# json scalars are returned as is
+scalar_types = {str, int, float, bool, type(None)}
+
+# attribute names per czml3 class, or None for the classes that have their own to_json (i.e. the *Value types)
+_property_names = dict()
+
+
+def get_property_names(cls):
+    try:
+        return _property_names[cls]
+    except KeyError:
+        if cls.to_json is BaseCZMLObject.to_json or getattr(cls.to_json, '__name__', None) == '_to_json':
+            names = tuple(a.name for a in attr.fields(cls))
+        else:
+            names = None
+        _property_names[cls] = names
+        return names
+
+
+def to_plain(o):
+    """
+    converts a czml3 object (packet, property, value...) into plain json-able python objects,
+    the same way czml3's CZMLEncoder would, but without attr.asdict and without json encoder callbacks
+    """
+    t = type(o)
+    if t in scalar_types:
+        return o
+    if isinstance(o, BaseCZMLObject):
+        names = get_property_names(t)
+        if names is None:
+            return to_plain(o.to_json())
+        if getattr(o, 'delete', False):
+            names = NON_DELETE_PROPERTIES
+        values = o.__dict__
+        result = dict()
+        for name in names:
+            value = values.get(name)
+            if value is not None:
+                result[name] = value if type(value) in scalar_types else to_plain(value)
+        return result
+    if t in (list, tuple):
+        return [v if type(v) in scalar_types else to_plain(v) for v in o]
+    if t is dict:
+        return {k: to_plain(v) for k, v in o.items()}
+    if isinstance(o, Enum):
+        return o.name
+    if isinstance(o, dt.datetime):
+        return o.astimezone(dt.timezone.utc).strftime(ISO8601_FORMAT_Z)
+    # numpy scalars and others, json would reject them the same as with czml3
+    return o
+
+
+def iter_document(document, buffer_size=1 << 16):
+    """
+    yields the czml document (a czml3 Document or any iterable of packets) as json text, in chunks of about
+    buffer_size, each packet is converted and encoded on its own so the document is never built as a whole
+    """
+    packets = document.packets if hasattr(document, 'packets') else document
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    buffer = ['[']
+    size = 1
+    for i, packet in enumerate(packets):
+        s = (',' if i else '') + encode(packet if type(packet) is dict else to_plain(packet))
+        buffer.append(s)
+        size += len(s)
+        if size >= buffer_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    buffer.append(']')
+    yield ''.join(buffer)
+
+
+def dump(document, fp):
+    """
+    writes the document incrementally to a text file, or to a socket (anything with sendall)
+    """
+    if hasattr(fp, 'sendall'):
+        for chunk in iter_document(document):
+            fp.sendall(chunk.encode('utf-8'))
+    else:
+        for chunk in iter_document(document):
+            fp.write(chunk)
+
+
+def dumps(document):
+    return ''.join(iter_document(document))
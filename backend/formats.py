@@ -2,3 +2,7 @@ from pywps import FORMATS, Format
 
 czml_format = Format('application/czml+json', extension='.czml')
 wkt_format = Format('application/wkt', extension='.wkt')
+csv_format = Format('text/csv', extension='.csv')
+float64_format = Format('application/x-float64', extension='.bin')  # raw little endian float64 array
+flatgeobuf_format = Format('application/flatgeobuf', extension='.fgb')
+gpkg_format = Format('application/geopackage+sqlite3', extension='.gpkg')
@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+
+import gdal
+import osr
+from pywps import configuration
+
+from backend import tiles
+from backend import metrics
+from backend import czml_writer
+
+image_exts = {'.png': 'PNG', '.webp': 'WEBP'}
+image_ofs = {'czml_png': '.png', 'czml_webp': '.webp'}
+
+
+def get_image_ext(of):
+    """
+    returns the sidecar image extension of an `of` that asks for a czml referencing an image, or None
+    """
+    return image_ofs.get(of.lower()) if of is not None else None
+
+
+def write_czml(filename, packets):
+    with open(filename, 'w') as f:
+        czml_writer.dump(packets, f)
+    return filename
+
+
+def get_image_url(job, image_filename):
+    output_url = configuration.get_config_value('server', 'outputurl')
+    return '{}/{}/{}'.format(output_url.rstrip('/'), job, image_filename)
+
+
+def to_wgs84_vrt(ds: gdal.Dataset) -> gdal.Dataset:
+    """
+    czml rectangles are placed in lon/lat, the raster is warped through a vrt so it is only read when it is encoded
+    """
+    srs = osr.SpatialReference(wkt=ds.GetProjection())
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(4326)
+    if srs.IsGeographic() and srs.IsSameGeogCS(wgs84):
+        return ds
+    return gdal.Warp('', ds, format='VRT', dstSRS='EPSG:4326', resampleAlg='near')
+
+
+def encode_image(ds: gdal.Dataset, image_filename, ext='.png'):
+    """
+    writes the raster as a png/webp, paletted rasters keep (png) or expand (webp) their color table,
+    other single band non Byte rasters are scaled to Byte
+    """
+    band: gdal.Band = ds.GetRasterBand(1)
+    kwargs = dict()
+    has_color_table = ds.RasterCount == 1 and band.GetColorTable() is not None
+    if ext == '.webp':
+        if has_color_table:
+            kwargs['rgbExpand'] = 'rgba'
+        elif ds.RasterCount < 3:
+            raise Exception('webp images need a color table or an rgb raster, use czml_png')
+    if band.DataType not in [gdal.GDT_Byte, gdal.GDT_UInt16] and not has_color_table:
+        kwargs.update(outputType=gdal.GDT_Byte, scaleParams=[[]])
+    with metrics.phase('encode_image'):
+        out_ds = gdal.Translate(image_filename, ds, format=image_exts[ext], **kwargs)
+    if out_ds is None:
+        raise Exception('failed to encode {}'.format(image_filename))
+    out_ds = None
+    aux_filename = image_filename + '.aux.xml'
+    if os.path.isfile(aux_filename):
+        os.remove(aux_filename)
+
+
+def make_image_layer(job, src_filename, czml_filename=None, name=None, description=None, ext='.png'):
+    """
+    writes the raster as a png/webp under outputs/<job>/ and a czml that references it by url
+    instead of embedding it as base64, returns the czml filename.
+    the image is served by the /outputs route, so clients fetch it in parallel and cache it.
+    """
+    if ext not in image_exts:
+        raise Exception('unsupported image format {}, supported: {}'.format(ext, list(image_exts)))
+    job_dir = tiles.get_job_dir(job)
+    os.makedirs(job_dir, exist_ok=True)
+    image_filename = 'image' + ext
+
+    src_ds = gdal.Open(str(src_filename))
+    if description is None:
+        description = src_ds.GetMetadataItem('colors')
+    ds = to_wgs84_vrt(src_ds)
+    gt = ds.GetGeoTransform()
+    wsen = [gt[0], gt[3] + ds.RasterYSize * gt[5], gt[0] + ds.RasterXSize * gt[1], gt[3]]
+    # encode to a temp name, a client might already poll the job directory
+    fd, temp_filename = tempfile.mkstemp(suffix=ext, dir=job_dir)
+    os.close(fd)
+    encode_image(ds, temp_filename, ext)
+    ds = src_ds = None
+    shutil.move(temp_filename, os.path.join(job_dir, image_filename))
+
+    packets = [
+        dict(id='document', version='1.0', name='czml', description=description),
+        dict(id='rect', name=name,
+             rectangle=dict(coordinates=dict(wsenDegrees=wsen), fill=True,
+                            material=dict(image=dict(transparent=True, image=get_image_url(job, image_filename))))),
+    ]
+    czml_filename = czml_filename or tempfile.mktemp(suffix='.czml')
+    return write_czml(czml_filename, packets)
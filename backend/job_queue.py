@@ -0,0 +1,255 @@
+import os
+import json
+import logging
+import time
+import sqlite3
+import threading
+import multiprocessing
+from collections import Counter
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from pywps.app import Process
+from pywps.app.WPSRequest import WPSRequest
+from pywps.response.execute import ExecuteResponse
+from pywps.response.status import WPS_STATUS
+
+from processes.process_defaults import process_defaults
+from backend import metrics
+
+LOGGER = logging.getLogger('PYWPS')
+
+# the wps service that the queued jobs are executed by, set by install()
+_service = None
+
+
+class JobQueue:
+    """
+    a persistent queue of async (storeExecuteResponse) executes, backed by sqlite.
+    jobs are started by priority class (lower first) and then by submission time,
+    subject to a global number of workers and to per process concurrency limits.
+    heavy jobs (priority > 0) can never take the last `reserved` workers,
+    so cheap requests (i.e. ras_val, info) do not starve behind long viewsheds.
+    """
+    def __init__(self, db_filename='./logs/talos-jobs.sqlite3', workers=4, reserved=1,
+                 limits=None, priorities=None, default_priority=1):
+        self.db_filename = db_filename
+        self.workers = workers
+        self.reserved = min(reserved, workers - 1)
+        self.limits = limits or dict()
+        self.priorities = priorities or dict()
+        self.default_priority = default_priority
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                         'uuid TEXT PRIMARY KEY, identifier TEXT, priority INTEGER, state TEXT, request TEXT, '
+                         'pid INTEGER, created REAL, started REAL, finished REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, priority, created)')
+
+    @classmethod
+    def from_defaults(cls):
+        return cls(**process_defaults('job_queue'))
+
+    def _connect(self):
+        # autocommit, and closed when the with block ends (a sqlite3 connection as a context manager is not)
+        return closing(sqlite3.connect(self.db_filename, timeout=30, isolation_level=None))
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # the pool is created lazily, so each (forked) server worker gets its own
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('fork'))
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def _drop_executor(self, executor):
+        # a pool worker died (i.e. killed by the oom killer), the pool is unusable from now on
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+
+    def submit(self, uuid, identifier, request_json):
+        priority = self.priorities.get(identifier, self.default_priority)
+        with self._connect() as conn:
+            conn.execute('INSERT INTO jobs (uuid, identifier, priority, state, request, created) '
+                         'VALUES (?, ?, ?, ?, ?, ?)',
+                         (str(uuid), identifier, priority, 'queued', request_json, time.time()))
+        self.dispatch()
+
+    def _reap(self, conn):
+        """
+        fails the jobs owned by a server worker that died, they will never finish.
+        returns the uuids of the reaped jobs
+        """
+        reaped = []
+        for uuid, pid in conn.execute("SELECT uuid, pid FROM jobs WHERE state='running'").fetchall():
+            try:
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                conn.execute("UPDATE jobs SET state='failed', finished=? WHERE uuid=?", (time.time(), uuid))
+                reaped.append(uuid)
+            except PermissionError:
+                pass
+        return reaped
+
+    def _submit(self, uuid):
+        executor = self.executor
+        try:
+            return executor, executor.submit(_run_job, self.db_filename, uuid)
+        except BrokenProcessPool:
+            self._drop_executor(executor)
+            executor = self.executor
+            return executor, executor.submit(_run_job, self.db_filename, uuid)
+
+    def _requeue(self, uuids):
+        with self._connect() as conn:
+            conn.executemany("UPDATE jobs SET state='queued', pid=NULL, started=NULL WHERE uuid=?",
+                             [(uuid,) for uuid in uuids])
+
+    def _fail(self, uuid, message):
+        """
+        marks the job failed, and writes a failed status document for jobs that pywps could not report,
+        so the clients that poll it stop waiting
+        """
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET state='failed', finished=? WHERE uuid=?", (time.time(), uuid))
+            row = conn.execute('SELECT request FROM jobs WHERE uuid=?', (uuid,)).fetchone()
+        if row is not None:
+            try:
+                _write_failed_status(uuid, row[0], message)
+            except Exception:
+                LOGGER.exception('writing the failed status of job {} failed'.format(uuid))
+
+    def dispatch(self):
+        """
+        starts as many queued jobs as the limits allow
+        """
+        to_start = []
+        reaped = []
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    reaped = self._reap(conn)
+                    running = conn.execute("SELECT identifier, priority FROM jobs WHERE state='running'").fetchall()
+                    total = len(running)
+                    heavy = sum(1 for _, priority in running if priority > 0)
+                    per_process = Counter(identifier for identifier, _ in running)
+                    queued = conn.execute("SELECT uuid, identifier, priority FROM jobs WHERE state='queued' "
+                                          "ORDER BY priority, created").fetchall()
+                    for uuid, identifier, priority in queued:
+                        if total >= self.workers:
+                            break
+                        limit = self.limits.get(identifier)
+                        if limit is not None and per_process[identifier] >= limit:
+                            continue
+                        if priority > 0 and heavy >= self.workers - self.reserved:
+                            continue
+                        to_start.append(uuid)
+                        total += 1
+                        heavy += priority > 0
+                        per_process[identifier] += 1
+                    for uuid in to_start:
+                        conn.execute("UPDATE jobs SET state='running', pid=?, started=? WHERE uuid=?",
+                                     (os.getpid(), time.time(), uuid))
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+
+        for uuid in reaped:
+            self._fail(uuid, 'the server worker that ran the job died')
+        # the jobs are marked running before they are submitted, so no other server worker starts them too,
+        # and are put back in the queue if they could not be submitted
+        for i, uuid in enumerate(to_start):
+            try:
+                executor, future = self._submit(uuid)
+            except Exception:
+                self._requeue(to_start[i:])
+                raise
+            future.add_done_callback(partial(self._job_done, uuid, executor))
+
+    def _job_done(self, uuid, executor, future):
+        e = future.exception()
+        if e is None:
+            metrics.record(future.result())
+            with self._connect() as conn:
+                conn.execute("UPDATE jobs SET state='finished', finished=? WHERE uuid=?", (time.time(), uuid))
+        else:
+            if isinstance(e, BrokenProcessPool):
+                self._drop_executor(executor)
+            self._fail(uuid, 'Process error: {}'.format(e))
+        self.dispatch()
+
+    def stats(self):
+        with self._connect() as conn:
+            rows = conn.execute('SELECT identifier, state, COUNT(*) FROM jobs '
+                                "WHERE state IN ('queued', 'running') GROUP BY identifier, state").fetchall()
+        result = dict(workers=self.workers, reserved=self.reserved, queued=dict(), running=dict())
+        for identifier, state, count in rows:
+            result[state][identifier] = count
+        return result
+
+
+def _run_job(db_filename, uuid):
+    """
+    runs a queued job inside a pool worker, the same way pywps runs its own stored requests
+    """
+    with closing(sqlite3.connect(db_filename, timeout=30)) as conn:
+        (request_json,) = conn.execute('SELECT request FROM jobs WHERE uuid=?', (uuid,)).fetchone()
+    wps_request = WPSRequest()
+    wps_request.json = json.loads(request_json)
+    process = _service.prepare_process_for_execution(wps_request.identifier)
+    process._set_uuid(uuid)
+    process._setup_status_storage()
+    process.async_ = True
+    wps_response = ExecuteResponse(wps_request, process=process, uuid=uuid)
+    wps_response.store_status_file = True
+    # failures are reported by pywps in the status document,
+    # the timings are recorded by the server worker that owns the pool
+    with metrics.request_timings(wps_request.identifier, do_record=False) as timings:
+        process._run_process(wps_request, wps_response)
+    return timings.as_dict()
+
+
+def _write_failed_status(uuid, request_json, message):
+    wps_request = WPSRequest()
+    wps_request.json = json.loads(request_json)
+    process = _service.prepare_process_for_execution(wps_request.identifier)
+    process._set_uuid(uuid)
+    process._setup_status_storage()
+    wps_response = ExecuteResponse(wps_request, process=process, uuid=uuid)
+    wps_response.store_status_file = True
+    wps_response._update_status(WPS_STATUS.FAILED, message, 100)
+
+
+job_queue = None
+
+
+def _run_async(self, wps_request, wps_response):
+    job_queue.submit(self.uuid, self.identifier, wps_request.json)
+
+
+def install(service):
+    """
+    routes the async executes of the given service through the job queue instead of a process per request.
+    set parallelprocesses = -1 in pywps.cfg (as data/config/pywps.cfg does),
+    otherwise pywps holds back requests in its own queue first.
+    the jobs that were still queued when the server stopped are started again.
+    """
+    global _service, job_queue
+    _service = service
+    job_queue = JobQueue.from_defaults()
+    Process._run_async = _run_async
+    # a preloading gunicorn loads the app in the master, the workers resume the jobs from post_worker_init instead,
+    # each with its own pool (see gunicorn.conf.py)
+    if not os.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+        job_queue.dispatch()
+    return job_queue
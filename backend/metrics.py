@@ -0,0 +1,164 @@
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+from pywps.app import Process
+
+# upper bounds in seconds, the last bucket is +Inf
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_local = threading.local()
+
+
+class Histogram:
+    """
+    a minimal prometheus histogram with labels
+    """
+    def __init__(self, name, doc, label_names):
+        self.name = name
+        self.doc = doc
+        self.label_names = label_names
+        self._lock = threading.Lock()
+        self._values = dict()
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * (len(buckets) + 1), 0.0))
+            for i, b in enumerate(buckets):
+                if value <= b:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._values[labels] = counts, total + value
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.doc), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                label_str = ','.join('{}="{}"'.format(k, v) for k, v in zip(self.label_names, labels))
+                for b, c in zip(list(buckets) + ['+Inf'], counts):
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, label_str, b, c))
+                lines.append('{}_sum{{{}}} {}'.format(self.name, label_str, total))
+                lines.append('{}_count{{{}}} {}'.format(self.name, label_str, counts[-1]))
+        return lines
+
+
+process_seconds = Histogram('talos_wps_process_seconds', 'process execution time', ('process',))
+phase_seconds = Histogram('talos_wps_phase_seconds', 'process execution time by phase', ('process', 'phase'))
+
+
+class RequestTimings:
+    """
+    collects the phase durations of a single request
+    """
+    def __init__(self, identifier=None):
+        self.identifier = identifier
+        self.phases = []
+
+    def add(self, name, seconds):
+        self.phases.append((name, seconds))
+
+    def as_dict(self):
+        return dict(identifier=self.identifier, phases=self.phases)
+
+    def server_timing(self):
+        # https://www.w3.org/TR/server-timing/
+        return ', '.join('{};dur={:.1f}'.format(name, seconds * 1000) for name, seconds in self.phases)
+
+
+def record(timings: dict):
+    identifier = timings['identifier'] or 'unknown'
+    for name, seconds in timings['phases']:
+        if name == 'execute':
+            process_seconds.observe((identifier,), seconds)
+        else:
+            phase_seconds.observe((identifier, name), seconds)
+
+
+def get_current():
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def request_timings(identifier=None, do_record=True):
+    """
+    starts collecting timings for the current thread, unless a request is already being timed
+    """
+    timings = get_current()
+    if timings is not None:
+        if identifier is not None:
+            timings.identifier = identifier
+        yield timings
+        return
+    timings = RequestTimings(identifier)
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = None
+        if do_record:
+            record(timings.as_dict())
+
+
+@contextmanager
+def phase(name):
+    """
+    times a phase of the current request, does nothing if no request is being timed
+    """
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = get_current()
+        if timings is not None:
+            timings.add(name, time.perf_counter() - t)
+
+
+def timed(name):
+    """
+    a decorator that times every call of the decorated function as a phase
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render(gauges=None):
+    """
+    returns all the metrics in prometheus text format,
+    gauges is a dict of name: (doc, value) or name: (doc, {label: value})
+    """
+    import gdal
+    lines = process_seconds.render() + phase_seconds.render()
+    gauges = dict(gauges or dict())
+    gauges['talos_wps_gdal_cache_used_bytes'] = ('gdal raster block cache used', gdal.GetCacheUsed())
+    gauges['talos_wps_gdal_cache_max_bytes'] = ('gdal raster block cache size', gdal.GetCacheMax())
+    for name, (doc, value) in gauges.items():
+        lines.append('# HELP {} {}'.format(name, doc))
+        lines.append('# TYPE {} gauge'.format(name))
+        if isinstance(value, dict):
+            for label, v in value.items():
+                lines.append('{}{{name="{}"}} {}'.format(name, label, v))
+        else:
+            lines.append('{} {}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+_run_process = Process._run_process
+
+
+def _timed_run_process(self, wps_request, wps_response):
+    with request_timings(self.identifier):
+        with phase('execute'):
+            return _run_process(self, wps_request, wps_response)
+
+
+def install():
+    """
+    times every process execution
+    """
+    Process._run_process = _timed_run_process
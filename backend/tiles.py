@@ -0,0 +1,186 @@
+import os
+import re
+import json
+import math
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import gdal
+import osr
+from pywps import configuration
+
+from processes.ds_pool import ds_pool
+from backend import metrics
+
+outputs_dir = 'outputs'
+tile_size = 256
+web_mercator_half = 20037508.342789244
+tile_exts = {'.png': 'PNG', '.webp': 'WEBP'}
+# levels above min_zoom + prerender_levels are only rendered on demand
+prerender_levels = 2
+# number of zoom levels below the native resolution
+zoom_levels = 8
+job_pattern = re.compile(r'^[\w-]+$')
+
+
+def get_job_dir(job):
+    job = str(job)
+    if not job_pattern.match(job):
+        raise ValueError('invalid tiles job {}'.format(job))
+    return os.path.join(outputs_dir, job)
+
+
+def tile_bounds(z, x, y):
+    """
+    returns (min_x, min_y, max_x, max_y) of an xyz tile in web mercator
+    """
+    size = 2 * web_mercator_half / (1 << z)
+    min_x = -web_mercator_half + x * size
+    max_y = web_mercator_half - y * size
+    return min_x, max_y - size, min_x + size, max_y
+
+
+def get_bounds(ds: gdal.Dataset, epsg):
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    ds_srs = osr.SpatialReference()
+    ds_srs.ImportFromWkt(ds.GetProjection())
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        ds_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    ct = osr.CoordinateTransformation(ds_srs, srs)
+    gt = ds.GetGeoTransform()
+    xs = [gt[0], gt[0] + ds.RasterXSize * gt[1]]
+    ys = [gt[3], gt[3] + ds.RasterYSize * gt[5]]
+    pts = [ct.TransformPoint(x, y)[:2] for x in xs for y in ys]
+    return [min(p[0] for p in pts), min(p[1] for p in pts), max(p[0] for p in pts), max(p[1] for p in pts)]
+
+
+def read_layer_info(job):
+    with open(os.path.join(get_job_dir(job), 'tiles.json'), 'r') as f:
+        return json.load(f)
+
+
+def tile_range(bounds, z):
+    """
+    returns the x, y ranges of the tiles of level z that intersect the given web mercator bounds
+    """
+    n = 1 << z
+    size = 2 * web_mercator_half / n
+    x0 = max(0, int((bounds[0] + web_mercator_half) // size))
+    x1 = min(n - 1, int((bounds[2] + web_mercator_half) // size))
+    y0 = max(0, int((web_mercator_half - bounds[3]) // size))
+    y1 = min(n - 1, int((web_mercator_half - bounds[1]) // size))
+    return range(x0, x1 + 1), range(y0, y1 + 1)
+
+
+def render_tile(job, z, x, y, ext='.png', info=None):
+    """
+    returns the filename of the given tile, rendering it on first use,
+    or None if the tile is outside of the layer
+    """
+    driver_name = tile_exts.get(ext)
+    if driver_name is None:
+        return None
+    job_dir = get_job_dir(job)
+    tile_filename = os.path.join(job_dir, str(z), str(x), str(y) + ext)
+    if os.path.isfile(tile_filename):
+        return tile_filename
+    info = info or read_layer_info(job)
+    if not info['min_zoom'] <= z <= info['max_zoom']:
+        return None
+    xs, ys = tile_range(info['bounds_3857'], z)
+    if x not in xs or y not in ys:
+        return None
+
+    # the tiles are rendered outside of a process execution, the source handle goes back to the pool right after
+    with ds_pool.lease():
+        src_ds = ds_pool.open_ds(os.path.join(job_dir, info['source']))
+        if src_ds.RasterCount == 1 and src_ds.GetRasterBand(1).GetColorTable() is not None:
+            # paletted results (viewshed, calc) are expanded to rgba, WEBP does not take a palette
+            src_ds = gdal.Translate('', src_ds, format='VRT', rgbExpand='rgba')
+        # the pixels outside of the data get a zero alpha, so the tiles are transparent there
+        tile_ds = gdal.Warp('', src_ds, format='MEM', dstSRS='EPSG:3857', outputBounds=tile_bounds(z, x, y),
+                            width=tile_size, height=tile_size, resampleAlg='near', dstAlpha=True, multithread=True)
+        src_ds = None
+    if tile_ds is None:
+        raise Exception('failed to warp tile {}/{}/{} of {}'.format(z, x, y, job))
+    os.makedirs(os.path.dirname(tile_filename), exist_ok=True)
+    # write to a temp name first, the same tile might be requested concurrently
+    fd, temp_filename = tempfile.mkstemp(suffix=ext, dir=os.path.dirname(tile_filename))
+    os.close(fd)
+    out_ds = gdal.GetDriverByName(driver_name).CreateCopy(temp_filename, tile_ds)
+    ok = out_ds is not None
+    out_ds = tile_ds = None
+    aux_filename = temp_filename + '.aux.xml'
+    if os.path.isfile(aux_filename):
+        os.remove(aux_filename)
+    if not ok:
+        # a failed (empty) tile must not be moved into place, it would be served from then on
+        os.remove(temp_filename)
+        raise Exception('failed to write tile {}/{}/{}{} of {}'.format(z, x, y, ext, job))
+    os.replace(temp_filename, tile_filename)
+    return tile_filename
+
+
+def prerender(job, levels=prerender_levels, ext='.png', max_workers=None):
+    """
+    renders the top levels of the pyramid in parallel, deeper levels are rendered on demand
+    """
+    info = read_layer_info(job)
+    tiles = []
+    for z in range(info['min_zoom'], min(info['min_zoom'] + levels, info['max_zoom']) + 1):
+        xs, ys = tile_range(info['bounds_3857'], z)
+        tiles.extend((z, x, y) for x in xs for y in ys)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda t: render_tile(job, *t, ext=ext, info=info), tiles))
+
+
+def get_tiles_url(job, ext='.png'):
+    output_url = configuration.get_config_value('server', 'outputurl')
+    return '{}/{}/{{z}}/{{x}}/{{y}}{}'.format(output_url.rstrip('/'), job, ext)
+
+
+@metrics.timed('tiles')
+def make_tile_layer(job, src_filename, czml_filename=None, name=None, description=None, ext='.png'):
+    """
+    turns a raster into a lazily rendered xyz tile layer under outputs/<job>/
+    and writes a czml document that references the layer instead of embedding the image.
+    returns the czml filename.
+    """
+    job_dir = get_job_dir(job)
+    os.makedirs(job_dir, exist_ok=True)
+    source = 'source' + os.path.splitext(src_filename)[1]
+    shutil.copyfile(src_filename, os.path.join(job_dir, source))
+
+    ds = ds_pool.open_ds(os.path.join(job_dir, source))
+    bounds_3857 = get_bounds(ds, 3857)
+    wsen = get_bounds(ds, 4326)
+    res = abs(ds.GetGeoTransform()[1])
+    if not osr.SpatialReference(wkt=ds.GetProjection()).IsProjected():
+        # degrees to meters at the equator
+        res *= 2 * web_mercator_half / 360
+    max_zoom = max(0, int(math.ceil(math.log2(2 * web_mercator_half / (tile_size * res)))))
+    min_zoom = max(0, max_zoom - zoom_levels)
+    if description is None:
+        description = ds.GetMetadataItem('colors')
+    ds = None
+    url = get_tiles_url(job, ext)
+    info = dict(source=source, bounds_3857=bounds_3857, wsen=wsen, min_zoom=min_zoom, max_zoom=max_zoom, url=url)
+    with open(os.path.join(job_dir, 'tiles.json'), 'w') as f:
+        json.dump(info, f)
+
+    czml_doc = [
+        dict(id='document', version='1.0', name='czml', description=description),
+        dict(id='tiles', name=name,
+             rectangle=dict(coordinates=dict(wsenDegrees=wsen), fill=False),
+             properties=dict(tiles=dict(url=url, tileSize=tile_size, minimumLevel=min_zoom, maximumLevel=max_zoom))),
+    ]
+    czml_filename = czml_filename or tempfile.mktemp(suffix='.czml')
+    with open(czml_filename, 'w') as f:
+        json.dump(czml_doc, f)
+
+    prerender(job, ext=ext)
+    return czml_filename
@@ -0,0 +1,166 @@
+import os
+import gc
+import mmap
+import logging
+import importlib
+
+from processes.process_defaults import process_defaults
+
+# the pywps logger, configured by the [logging] section of pywps.cfg
+LOGGER = logging.getLogger('PYWPS')
+
+# the modules the handlers import on their first execute
+handler_modules = ['gdalos.calc.gdal_calc', 'gdalos.calc.gdal_to_czml', 'gdalos.calc.gdal_dem_color_cutline',
+                   'gdalos.viewshed.viewshed_calc', 'processes.viewshed_batch', 'processes.raster_sample',
+                   'processes.cog', 'backend.tiles', 'backend.image_layer',
+                   'processes.cutline', 'processes.coverage', 'processes.viewshed_multires',
+                   'processes.los_calc']
+
+# arrays read by the gunicorn master before forking, shared copy-on-write by all the workers.
+# key: (abspath, mtime_ns, bi), value: list of (raster_size, window, array)
+_shared = dict()
+
+
+def _file_key(filename, bi):
+    filename = os.path.abspath(filename)
+    return filename, os.stat(filename).st_mtime_ns, bi
+
+
+def get_dtm_filenames(config):
+    """
+    returns the configured dtms: the default input raster of every process and warmup.dtms
+    """
+    filenames = list(config.get('dtms', []))
+    if config.get('defaults', True):
+        process_defaults('warmup')
+        for defaults in process_defaults.d.values():
+            if isinstance(defaults, dict) and isinstance(defaults.get('r'), str):
+                filenames.append(defaults['r'])
+    result = []
+    for filename in filenames:
+        filename = os.path.abspath(filename)
+        if os.path.isfile(filename) and filename not in result:
+            result.append(filename)
+    return result
+
+
+def prefetch_file(filename):
+    """
+    maps the file read-only and asks the kernel to read it ahead.
+    the pages land in the page cache, which every worker shares, so their first reads do not hit the disk
+    """
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if hasattr(mmap, 'MADV_WILLNEED'):
+                m.madvise(mmap.MADV_WILLNEED)
+            else:
+                # touch a byte of each page
+                for i in range(0, size, mmap.PAGESIZE):
+                    m[i]
+        finally:
+            m.close()
+
+
+def load_array(band, win=None):
+    win = win or (0, 0, band.XSize, band.YSize)
+    arr = band.ReadAsArray(*win)
+    # a write from a worker would silently un-share the pages
+    arr.flags.writeable = False
+    return win, arr
+
+
+def get_window(filename, bi, raster_size, win):
+    """
+    returns (array, xoff, yoff) of a shared array of the given raster (or overview) size that covers
+    the (xoff, yoff, xsize, ysize) window, or None
+    """
+    try:
+        key = _file_key(filename, bi)
+    except OSError:
+        return None
+    for size, (xoff, yoff, xsize, ysize), arr in _shared.get(key, []):
+        if size == tuple(raster_size) and xoff <= win[0] and yoff <= win[1] and \
+                win[0] + win[2] <= xoff + xsize and win[1] + win[3] <= yoff + ysize:
+            return arr, xoff, yoff
+    return None
+
+
+def read_window(band, filename, bi, win):
+    """
+    reads the (xoff, yoff, xsize, ysize) window of the band, from the shared arrays if they cover it
+    """
+    shared = get_window(filename, bi, (band.XSize, band.YSize), win)
+    if shared is None:
+        return band.ReadAsArray(*win)
+    arr, xoff, yoff = shared
+    x0, y0 = win[0] - xoff, win[1] - yoff
+    return arr[y0:y0 + win[3], x0:x0 + win[2]]
+
+
+def warm_up_dtm(filename, bi=1, max_ovr_pixels=1 << 24, windows=None):
+    import gdal
+
+    prefetch_file(filename)
+    key = _file_key(filename, bi)
+    shared = _shared.setdefault(key, [])
+    ds = gdal.Open(filename)
+    band = ds.GetRasterBand(bi)
+    for i in range(band.GetOverviewCount()):
+        ovr = band.GetOverview(i)
+        if ovr.XSize * ovr.YSize <= max_ovr_pixels:
+            shared.append(((ovr.XSize, ovr.YSize),) + load_array(ovr))
+    gt = ds.GetGeoTransform()
+    for extent in windows or []:
+        # min_x, min_y, max_x, max_y in the raster crs
+        x0 = max(0, int((extent[0] - gt[0]) / gt[1]))
+        x1 = min(band.XSize, int((extent[2] - gt[0]) / gt[1]) + 1)
+        y0 = max(0, int((extent[3] - gt[3]) / gt[5]))
+        y1 = min(band.YSize, int((extent[1] - gt[3]) / gt[5]) + 1)
+        if x1 > x0 and y1 > y0:
+            shared.append(((band.XSize, band.YSize),) + load_array(band, (x0, y0, x1 - x0, y1 - y0)))
+    band = ds = None
+
+
+def warm_up():
+    """
+    runs in the gunicorn master (preload_app) before the workers are forked:
+    imports the handler modules, prefetches the configured dtms, and reads their overviews
+    and hot windows into arrays that all the workers share.
+    no gdal dataset is left open, gdal handles must not be shared across a fork.
+    """
+    config = process_defaults('warmup')
+    if config.get('imports', True):
+        for module in handler_modules:
+            importlib.import_module(module)
+    # windows: {filename: [[min_x, min_y, max_x, max_y], ...]} in the raster crs
+    windows = {os.path.abspath(k): v for k, v in (config.get('windows') or dict()).items()}
+    for filename in get_dtm_filenames(config):
+        try:
+            warm_up_dtm(filename, max_ovr_pixels=config.get('max_ovr_pixels', 1 << 24),
+                        windows=windows.get(filename))
+        except Exception as e:
+            LOGGER.warning('failed to warm up {}: {}'.format(filename, e))
+    if config.get('dtm_cache', True):
+        # the sidecars are generated (once) and mapped before the fork
+        from processes.dtm_cache import dtm_cache
+        for filename in dtm_cache.dtms:
+            try:
+                dtm_cache.get_array(filename)
+            except Exception as e:
+                LOGGER.warning('failed to map the sidecar of {}: {}'.format(filename, e))
+    # objects that exist before the fork are never collected, so the gc does not touch (and copy) their pages
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def stats():
+    return dict(
+        files=len(_shared),
+        arrays=sum(len(v) for v in _shared.values()),
+        bytes=sum(arr.nbytes for v in _shared.values() for _, _, arr in v),
+    )
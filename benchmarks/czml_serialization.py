@@ -0,0 +1,64 @@
+"""
+compares the serialization of a vector heavy czml document (observer points with labels)
+by stock czml3 (Document.dumps) and by backend.czml_writer, and checks that both produce the same json.
+
+usage: python benchmarks/czml_serialization.py [-n packets] [-r repeats]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from czml3 import Document, Packet, Preamble
+from czml3.properties import Point, Label, Position, Color, Material, SolidColorMaterial
+
+from backend import czml_writer
+
+
+def make_document(n):
+    packets = [Preamble(name='observers')]
+    for i in range(n):
+        packets.append(Packet(
+            id='observer_{}'.format(i),
+            name='observer {}'.format(i),
+            description='observer number {}'.format(i),
+            position=Position(cartographicDegrees=[35 + i * 1e-4, 32 + i * 1e-4, 10.0]),
+            point=Point(color=Color(rgba=[255, 0, 0, 255]), pixelSize=5),
+            label=Label(text='obs {}'.format(i), show=True),
+            properties=dict(index=i),
+        ))
+    return Document(packets)
+
+
+def timeit(f, repeats):
+    best = None
+    for _ in range(repeats):
+        t = time.perf_counter()
+        result = f()
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='czml serialization benchmark')
+    parser.add_argument('-n', '--packets', type=int, default=10000)
+    parser.add_argument('-r', '--repeats', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    document = make_document(args.packets)
+    stock_time, stock = timeit(lambda: document.dumps(), args.repeats)
+    fast_time, fast = timeit(lambda: czml_writer.dumps(document), args.repeats)
+    if json.loads(stock) != json.loads(fast):
+        raise Exception('czml_writer output differs from czml3')
+    print('{} packets, best of {}'.format(args.packets, args.repeats))
+    print('czml3 Document.dumps: {:.3f}s ({:.1f}us/packet)'.format(stock_time, stock_time * 1e6 / args.packets))
+    print('czml_writer.dumps:    {:.3f}s ({:.1f}us/packet)'.format(fast_time, fast_time * 1e6 / args.packets))
+    print('speedup: {:.1f}x'.format(stock_time / fast_time))
+
+
+if __name__ == '__main__':
+    main()
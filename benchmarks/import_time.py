@@ -0,0 +1,68 @@
+"""
+measures the cold start of the server: the import time of `app` (which builds the wps service),
+and reports the slowest modules and the heavy modules that were imported on startup.
+
+usage: python benchmarks/import_time.py [-n runs] [-t top] [module]
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# these should only be imported by the first execute that needs them
+heavy_modules = ['osgeo', 'gdal', 'gdalos.calc', 'gdalos.viewshed.viewshed_calc', 'czml3', 'numpy', 'shapely']
+
+
+def parse_importtime(stderr):
+    """
+    returns a list of (module, self_us, cumulative_us) from the output of python -X importtime
+    """
+    result = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        result.append((module.strip(), int(self_us), int(cumulative_us)))
+    return result
+
+
+def measure(module='app'):
+    t = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module)],
+                          cwd=root_dir, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True)
+    wall = time.perf_counter() - t
+    if proc.returncode != 0:
+        raise Exception('failed to import {}:\n{}'.format(module, proc.stderr[-2000:]))
+    return wall, parse_importtime(proc.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='server cold start benchmark')
+    parser.add_argument('module', nargs='?', default='app')
+    parser.add_argument('-n', '--runs', type=int, default=5)
+    parser.add_argument('-t', '--top', type=int, default=15)
+    args = parser.parse_args(argv)
+
+    walls = []
+    imports = None
+    for _ in range(args.runs):
+        wall, imports = measure(args.module)
+        walls.append(wall)
+    walls.sort()
+    print('import {}: min {:.3f}s, median {:.3f}s, max {:.3f}s ({} runs, including interpreter startup)'.format(
+        args.module, walls[0], walls[len(walls) // 2], walls[-1], args.runs))
+
+    print('\nslowest modules (cumulative, last run):')
+    for module, self_us, cumulative_us in sorted(imports, key=lambda i: -i[2])[:args.top]:
+        print('{:>10.1f}ms {:>10.1f}ms  {}'.format(cumulative_us / 1000, self_us / 1000, module))
+
+    imported = {module for module, _, _ in imports}
+    loaded = [m for m in heavy_modules if m in imported]
+    print('\nheavy modules imported on startup: {}'.format(', '.join(loaded) if loaded else 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+import os
+import multiprocessing
+
+bind = os.environ.get('TALOS_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+timeout = 300
+
+# the app is loaded once in the master and the workers are forked from it,
+# so the imported modules and the warmed up dtm arrays are shared copy-on-write
+preload_app = True
+
+
+def when_ready(server):
+    # called in the master after the app was loaded and before the workers are forked
+    from backend import warmup
+    warmup.warm_up()
+    server.log.info('warm up done: {}'.format(warmup.stats()))
+
+
+def post_worker_init(worker):
+    # resume the jobs that were queued before a restart, from a worker so they run in its own job pool
+    from backend import job_queue
+    if job_queue.job_queue is not None:
+        job_queue.job_queue.dispatch()
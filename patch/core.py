@@ -6,6 +6,22 @@ from .base import BaseCZMLObject
 from .types import Sequence
 
 CZML_VERSION = "1.0"
+NON_DELETE_PROPERTIES = ["id", "delete"]
+
+# attribute names per class, computed once instead of by attr.asdict (which deep copies every value) per packet
+_property_names = dict()
+
+
+def _to_json(self):
+    if getattr(self, "delete", False):
+        names = NON_DELETE_PROPERTIES
+    else:
+        cls = type(self)
+        names = _property_names.get(cls)
+        if names is None:
+            names = _property_names[cls] = tuple(a.name for a in attr.fields(cls))
+    values = self.__dict__
+    return {name: values[name] for name in names if values.get(name) is not None}
 
 
 @attr.s(repr=False, frozen=True, kw_only=True)
@@ -19,6 +35,8 @@ class Preamble(BaseCZMLObject):
     description = attr.ib(default=None)
     clock = attr.ib(default=None)
 
+    to_json = _to_json
+
 
 @attr.s(repr=False, frozen=True, kw_only=True)
 class Packet(BaseCZMLObject):
@@ -54,6 +72,8 @@ class Packet(BaseCZMLObject):
     tileset = attr.ib(default=None)
     wall = attr.ib(default=None)
 
+    to_json = _to_json
+
 
 @attr.s(repr=False, frozen=True)
 class Document(Sequence):
@@ -1,48 +1,57 @@
-from .sayhello import SayHello
-from .ultimate_question import UltimateQuestion
-from .sleep import Sleep
-from .feature_count import FeatureCount
-from .centroids import Centroids
-from .buffer import Buffer
-from .area import Area
-from .bboxinout import Box
-from .jsonprocess import TestJson
-
-from .info import GetInfo
-from .ls import ls
-from .sleep2 import Sleep2
-from .crop_color import GdalDem
-from .rasval import RasterValue
-from .invert import Invert
-from .viewshed import ViewShed
-from .calc import Calc
-
-# For the process list on the home page
-processes = [
-    SayHello(),
-    UltimateQuestion(),
-    Sleep(),
-    FeatureCount(),
-    Centroids(),
-    Buffer(),
-    Area(),
-    Box(),
-    TestJson(),
-
-    GetInfo(),
-    ls(),
-    GdalDem(),
-    RasterValue(),
-    Invert(),
-    ViewShed(),
-    Calc(),
+import importlib
+
+# the process registry: (module, class) in the order of the process list on the home page.
+# the process modules only import pywps at module level, gdal/gdalos/numpy etc. are imported by the handlers
+# on the first execute, so building the service (and booting a server worker) stays cheap.
+process_classes = [
+    ('sayhello', 'SayHello'),
+    ('ultimate_question', 'UltimateQuestion'),
+    ('sleep', 'Sleep'),
+    ('feature_count', 'FeatureCount'),
+    ('centroids', 'Centroids'),
+    ('buffer', 'Buffer'),
+    ('area', 'Area'),
+    ('bboxinout', 'Box'),
+    ('jsonprocess', 'TestJson'),
+
+    ('info', 'GetInfo'),
+    ('ls', 'ls'),
+    ('crop_color', 'GdalDem'),
+    ('rasval', 'RasterValue'),
+    ('invert', 'Invert'),
+    ('viewshed', 'ViewShed'),
+    ('site_selection', 'SiteSelection'),
+    ('los', 'LineOfSight'),
+    ('calc', 'Calc'),
 ]
 
-# For the process list on the home page
+_processes = None
+
+
+def get_process_class(module_name, class_name):
+    module = importlib.import_module('.' + module_name, __name__)
+    return getattr(module, class_name)
+
+
+def get_processes():
+    """
+    returns the process instances, they are created once on first use
+    """
+    global _processes
+    if _processes is None:
+        _processes = [get_process_class(module_name, class_name)() for module_name, class_name in process_classes]
+    return _processes
+
+
+def get_process_descriptor():
+    # For the process list on the home page
+    return {process.identifier: process.abstract for process in get_processes()}
 
-process_descriptor = {}
-for process in processes:
-    abstract = process.abstract
-    identifier = process.identifier
-    process_descriptor[identifier] = abstract
 
+def __getattr__(name):
+    # `processes.processes` and `processes.process_descriptor` are kept for the existing callers
+    if name == 'processes':
+        return get_processes()
+    if name == 'process_descriptor':
+        return get_process_descriptor()
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
@@ -1,9 +1,5 @@
 
-import json
-import os
-import subprocess
 from pywps import Process, ComplexInput, LiteralOutput, Format
-from pywps.wpsserver import temp_dir
 
 __author__ = 'matteo'
 
@@ -29,18 +25,12 @@ class Area(Process):
         )
 
     def _handler(self, request, response):
-        # ogr2ogr requires gdal-bin
-        from shapely.geometry import shape
-        with temp_dir() as tmp:
-            input_gml = request.inputs['layer'][0].file
-            input_geojson = os.path.join(tmp, 'input.geojson')
-            subprocess.check_call(['ogr2ogr', '-f', 'geojson',
-                                   str(input_geojson), input_gml])
-            with open(input_geojson, 'rb') as f:
-                data = json.loads(f.read())
-            for feature in data['features']:
-                geom = shape(feature['geometry'])
-                feature['area'] = geom.area
-            response.outputs['area'].data = [feature['area']
-                                             for feature in data['features']]
-            return response
+        import numpy as np
+        import shapely
+        from processes.vector_io import VectorReader
+
+        # read in-process with ogr, the areas are computed a batch at a time with the vectorized shapely functions
+        with VectorReader(request.inputs['layer'][0].file) as reader:
+            areas = [shapely.area(batch.geometries) for batch in reader]
+        response.outputs['area'].data = np.concatenate(areas).tolist() if areas else []
+        return response
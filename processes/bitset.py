@@ -0,0 +1,107 @@
+import numpy as np
+
+# packed windows start on a whole byte of the packed rows (8 pixels)
+bits_align = 8
+
+# popcount of packed uint8 arrays, numpy>=2 has it built in
+_popcount_table = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+_bitwise_count = getattr(np, 'bitwise_count', None)
+
+
+def popcount(bits) -> int:
+    if _bitwise_count is not None:
+        return int(_bitwise_count(bits).sum(dtype=np.int64))
+    return int(_popcount_table[bits].sum(dtype=np.int64))
+
+
+def packed_width(width):
+    return -(-width // 8)
+
+
+def align_window(win, raster_size):
+    """
+    extends the (xoff, yoff, xsize, ysize) window to start on a whole byte of the packed rows
+    """
+    xoff, yoff, xsize, ysize = win
+    x0 = xoff - xoff % bits_align
+    x1 = min(-(-(xoff + xsize) // bits_align) * bits_align, raster_size[0])
+    return x0, yoff, x1 - x0, ysize
+
+
+def packed_slice(xoff, yoff, bits):
+    """
+    the slice of a packed array covered by a packed window at pixel offset (xoff, yoff), xoff is byte aligned
+    """
+    x0 = xoff // 8
+    return np.s_[yoff:yoff + bits.shape[0], x0:x0 + bits.shape[1]]
+
+
+def pack(mask):
+    return np.packbits(mask, axis=1)
+
+
+def unpack(bits, width):
+    return np.unpackbits(bits, axis=1, count=width)
+
+
+class BitCounter:
+    """
+    a per pixel counter kept as packed bit planes (bit-sliced), adding a packed bitset is a ripple carry
+    over the planes, 8 pixels per byte op. the counts saturate: a carry out of the last plane marks the pixel as full,
+    and to_array returns the limit for it instead of wrapping as an uint8 counter would at 256.
+    """
+    def __init__(self, shape, max_count=255):
+        self.planes = [np.zeros(shape, dtype=np.uint8) for _ in range(min(8, max(1, int(max_count).bit_length())))]
+        self.full = np.zeros(shape, dtype=np.uint8)
+
+    def add(self, s, bits):
+        carry = bits
+        for plane in self.planes:
+            p = plane[s]
+            new_carry = p & carry
+            p ^= carry
+            carry = new_carry
+            if not carry.any():
+                break
+        else:
+            self.full[s] |= carry
+
+    def to_array(self, width, limit=255):
+        """
+        the counts as an uint8 array, counts above limit are limit
+        """
+        result = np.zeros((self.planes[0].shape[0], width), dtype=np.uint8)
+        for b, plane in enumerate(self.planes):
+            result |= unpack(plane, width) << b
+        if limit < 255:
+            np.minimum(result, limit, out=result)
+        result[unpack(self.full, width).astype(bool)] = limit
+        return result
+
+
+class IndexPlanes:
+    """
+    the index of the single bitset that covers each pixel, kept as packed bit planes:
+    seen once / seen more than once, and the index bits OR-ed into 8 planes (exact where a pixel was seen once).
+    10 bits per pixel instead of an uint8 index and an uint8 count.
+    """
+    def __init__(self, shape):
+        self.once = np.zeros(shape, dtype=np.uint8)
+        self.many = np.zeros(shape, dtype=np.uint8)
+        self.planes = [np.zeros(shape, dtype=np.uint8) for _ in range(8)]
+
+    def add(self, s, bits, index):
+        once = self.once[s]
+        self.many[s] |= once & bits
+        once |= bits
+        for b, plane in enumerate(self.planes):
+            if index >> b & 1:
+                plane[s] |= bits
+
+    def to_array(self, width, ndv, multi_val):
+        index = np.zeros((self.once.shape[0], width), dtype=np.uint8)
+        for b, plane in enumerate(self.planes):
+            index |= unpack(plane, width) << b
+        index[unpack(self.many, width).astype(bool)] = multi_val
+        index[~unpack(self.once, width).astype(bool)] = ndv
+        return index
@@ -0,0 +1,65 @@
+import gdal
+import numpy as np
+
+tiled_co = ['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=DEFLATE', 'PREDICTOR=2',
+            'BIGTIFF=IF_SAFER', 'NUM_THREADS=ALL_CPUS']
+
+# striped sources (i.e. blocks of a single row) are read several rows at a time
+min_window_rows = 256
+
+
+def iter_windows(band: gdal.Band):
+    """
+    yields (xoff, yoff, xsize, ysize) windows that follow the block size of the given band
+    """
+    block_x, block_y = band.GetBlockSize()
+    if block_y < min_window_rows and block_x == band.XSize:
+        block_y *= (min_window_rows + block_y - 1) // block_y
+    for yoff in range(0, band.YSize, block_y):
+        ysize = min(block_y, band.YSize - yoff)
+        for xoff in range(0, band.XSize, block_x):
+            xsize = min(block_x, band.XSize - xoff)
+            yield xoff, yoff, xsize, ysize
+
+
+def block_process(s_ds: gdal.Dataset, d_path, func, bi=1, data_type=None, ndv=..., co=None, of='GTiff'):
+    """
+    applies func(array, ndv) -> array to the given band of s_ds block by block
+    and streams the results into a new raster at d_path,
+    so peak memory depends on the block size and not on the raster size.
+    """
+    s_band: gdal.Band = s_ds.GetRasterBand(bi)
+    s_ndv = s_band.GetNoDataValue()
+    if ndv is ...:
+        ndv = s_ndv
+    if data_type is None:
+        data_type = s_band.DataType
+    if co is None:
+        co = tiled_co if of.lower() == 'gtiff' else []
+
+    d_ds: gdal.Dataset = gdal.GetDriverByName(of).Create(
+        str(d_path), s_ds.RasterXSize, s_ds.RasterYSize, 1, data_type, options=co)
+    d_ds.SetProjection(s_ds.GetProjection())
+    d_ds.SetGeoTransform(s_ds.GetGeoTransform())
+    d_band: gdal.Band = d_ds.GetRasterBand(1)
+    if ndv is not None:
+        d_band.SetNoDataValue(ndv)
+
+    for xoff, yoff, xsize, ysize in iter_windows(s_band):
+        s_array = s_band.ReadAsArray(xoff, yoff, xsize, ysize)
+        d_array = func(s_array, s_ndv)
+        d_band.WriteArray(d_array, xoff, yoff)
+
+    d_band.FlushCache()
+    del d_band
+    del d_ds
+    return d_path
+
+
+def invert_func(s_min, s_max):
+    def f(s_array, s_ndv):
+        d_array = s_max + s_min - s_array.astype(np.float64)
+        if s_ndv is not None:
+            d_array[s_array == s_ndv] = s_ndv
+        return d_array
+    return f
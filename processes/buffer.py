@@ -6,6 +6,14 @@ from pywps import Process, LiteralInput, \
 
 from pywps.validator.mode import MODE
 
+from backend.formats import flatgeobuf_format, gpkg_format
+from backend import metrics
+
+# features per buffered batch, small enough to keep all the workers busy on mid sized layers
+buffer_batch_size = 4096
+# ogr Geometry.Buffer default, so the buffers keep their previous shape
+buffer_quad_segs = 30
+
 __author__ = 'Brauni'
 
 
@@ -15,10 +23,15 @@ class Buffer(Process):
                   supported_formats=[Format('application/gml+xml')],
                   mode=MODE.STRICT),
                   LiteralInput('buffer', 'Buffer size', data_type='float',
-                  allowed_values=(0, 1, 10, (10, 10, 100), (100, 100, 1000)))]
+                  allowed_values=(0, 1, 10, (10, 10, 100), (100, 100, 1000))),
+                  LiteralInput('of', 'output format (gml, fgb, gpkg, geojson)', data_type='string',
+                               min_occurs=0, max_occurs=1, default='gml')]
         outputs = [ComplexOutput('buff_out', 'Buffered file',
                                  supported_formats=[
-                                            Format('application/gml+xml')
+                                            Format('application/gml+xml'),
+                                            flatgeobuf_format,
+                                            gpkg_format,
+                                            Format('application/json'),
                                             ]
                                  )]
 
@@ -37,46 +50,30 @@ class Buffer(Process):
         )
 
     def _handler(self, request, response):
-        from osgeo import ogr
-
-        inSource = ogr.Open(request.inputs['poly_in'][0].file)
-
-        inLayer = inSource.GetLayer()
-        layerName = inLayer.GetName() + '_buffer'
-        out_filename = tempfile.mktemp()
-
-        # create output file
-        driver = ogr.GetDriverByName('GML')
-        outSource = driver.CreateDataSource(
-                                out_filename,
-                                ["XSISCHEMAURI=\
-                            http://schemas.opengis.net/gml/2.1.2/feature.xsd"])
-        outLayer = outSource.CreateLayer(layerName, None, ogr.wkbUnknown)
-
-        # for each feature
-        featureCount = inLayer.GetFeatureCount()
-        index = 0
-
-        while index < featureCount:
-            # get the geometry
-            inFeature = inLayer.GetNextFeature()
-            inGeometry = inFeature.GetGeometryRef()
-
-            # make the buffer
-            buff = inGeometry.Buffer(float(request.inputs['buffer'][0].data))
-
-            # create output feature to the file
-            outFeature = ogr.Feature(feature_def=outLayer.GetLayerDefn())
-            outFeature.SetGeometryDirectly(buff)
-            outLayer.CreateFeature(outFeature)
-            outFeature.Destroy()  # makes it crash when using debug
-            index += 1
-
-            response.update_status('Buffering', 100*(index/featureCount))
-
-        outSource.Destroy()
-
-        response.outputs['buff_out'].output_format = FORMATS.GML
+        import shapely
+        from processes import vector_io, process_helper
+
+        distance = float(request.inputs['buffer'][0].data)
+        of, ext = vector_io.get_vector_format(
+            request.inputs['of'][0].data if 'of' in request.inputs else 'gml')
+        out_filename = tempfile.mktemp(suffix=ext)
+        options = ["XSISCHEMAURI=http://schemas.opengis.net/gml/2.1.2/feature.xsd"] if of == 'gml' else None
+        status = process_helper.StatusThrottle(response)
+
+        def buffer(geometries):
+            return shapely.buffer(geometries, distance, quad_segs=buffer_quad_segs)
+
+        with metrics.phase('buffer'):
+            with vector_io.VectorReader(request.inputs['poly_in'][0].file, batch_size=buffer_batch_size) as reader:
+                feature_count = max(1, reader.get_feature_count())
+                with vector_io.open_writer(out_filename, of, name=reader.name + '_buffer', wkt=reader.wkt,
+                                           fields=reader.fields, options=options) as writer:
+                    for batch, buffers in vector_io.map_batches(buffer, reader):
+                        writer.write(buffers, batch.properties)
+                        status.update('Buffering', 100 * writer.count / feature_count)
+
+        output_formats = dict(gml=FORMATS.GML, fgb=flatgeobuf_format, gpkg=gpkg_format, geojson=FORMATS.JSON)
+        response.outputs['buff_out'].output_format = output_formats[of]
         response.outputs['buff_out'].file = out_filename
 
         return response
@@ -7,11 +7,9 @@ from pywps.response.execute import ExecuteResponse
 
 from .process_defaults import process_defaults, LiteralInputD, ComplexInputD, BoundingBoxInputD
 from processes import process_helper
-
-from gdalos.rectangle import GeoRectangle
-from gdalos.calc import gdal_calc, gdal_to_czml, gdalos_combine
+from processes.result_cache import result_cache
+from backend import metrics
 from backend.formats import czml_format
-from gdalos import gdalos_util
 
 
 class Calc(Process):
@@ -19,6 +17,10 @@ class Calc(Process):
         process_id = 'calc'
         defaults = process_defaults(process_id)
         inputs = [
+            LiteralInputD(defaults, 'of', 'output format (czml, czml_png, czml_webp, gtiff, cog)', data_type='string',
+                          min_occurs=0, max_occurs=1, default='gtiff'),
+            LiteralInputD(defaults, 'compress', 'cog compression (DEFLATE, ZSTD, LERC...)', data_type='string',
+                          min_occurs=0, max_occurs=1, default='DEFLATE'),
             LiteralInputD(defaults, 'output_czml', 'make output as czml', data_type='boolean',
                          min_occurs=0, max_occurs=1, default=False),
             LiteralInputD(defaults, 'output_tif', 'make output as tif', data_type='boolean',
@@ -40,6 +42,8 @@ class Calc(Process):
                           min_occurs=1, max_occurs=1, default=2),
             LiteralInputD(defaults, 'h', 'hide Nodata', data_type='boolean',
                           min_occurs=0, max_occurs=1, default=True),
+            LiteralInputD(defaults, 'parallel', 'evaluate aligned inputs in chunks over a process pool',
+                          data_type='boolean', min_occurs=0, max_occurs=1, default=True),
             ComplexInputD(defaults, 'color_palette', 'color palette', supported_formats=[FORMATS.TEXT],
                          min_occurs=0, max_occurs=1, default=None),
             # ComplexInputD(defaults, 'cutline', 'input vector cutline',
@@ -71,6 +75,12 @@ class Calc(Process):
         )
 
     def _handler(self, request, response: ExecuteResponse):
+        from gdalos.rectangle import GeoRectangle
+        from gdalos.calc import gdal_calc, gdal_to_czml, gdalos_combine
+        from gdalos import gdalos_util
+        from processes import cog, calc_engine, calc_expr
+        from backend import image_layer
+
         calc = process_helper.get_request_data(request.inputs, 'c')
         func = process_helper.get_request_data(request.inputs, 'f')
         operand = process_helper.get_request_data(request.inputs, 'o')
@@ -79,8 +89,24 @@ class Calc(Process):
             raise Exception('Please provide one of: calc, func, operand')
 
         of: str = process_helper.get_request_data(request.inputs, 'of')
+        is_cog = cog.is_cog(of)
+        image_ext = image_layer.get_image_ext(of)
+        if is_cog or image_ext:
+            # the result is converted to cog / encoded as a czml referenced image from a GeoTIFF
+            of = 'GTiff'
         ext = gdalos_util.get_ext_by_of(of)
         is_czml = ext == '.czml'
+        output_format = czml_format if is_czml or image_ext else FORMATS.GEOTIFF
+        output_ext = czml_format.extension if image_ext else ext
+
+        # an image czml references the outputs/<job> dir of the request, which the cache does not own
+        cache_key = None if image_ext else \
+            result_cache.make_key(self.identifier, request.inputs, exclude=('output_czml', 'output_tif'))
+        cached_filename = result_cache.get(cache_key, output_ext)
+        if cached_filename:
+            response.outputs['output'].output_format = output_format
+            response.outputs['output'].file = cached_filename
+            return response
 
         # process_palette = request.inputs['process_palette'][0].data if output_czml else 0
         # cutline = process_helper.get_request_data(request.inputs, 'cutline')
@@ -99,9 +125,11 @@ class Calc(Process):
         gdal_out_format = 'MEM' if is_czml else 'GTiff'
 
         files = []
+        filenames = dict()
         for r in request.inputs['r']:
-            _, src_ds = process_helper.open_ds_from_wps_input(r)
+            filename, src_ds = process_helper.open_ds_from_wps_input(r)
             files.append(src_ds)
+            filenames[id(src_ds)] = filename
 
         kwargs = dict()
         if calc is None:
@@ -109,19 +137,42 @@ class Calc(Process):
                 calc, kwargs = gdalos_combine.make_calc_with_func(files, alpha_pattern, func, **kwargs)
             else:
                 calc, kwargs = gdalos_combine.make_calc_with_operand(files, alpha_pattern, operand, **kwargs)
+        # rejects anything but the allowed operators and functions before gdal_calc or the engine evaluate it
+        calc_expr.compile_expression(calc)
         color_table = process_helper.get_color_table(request.inputs, 'color_palette')
-        dst_ds = gdal_calc.Calc(
-            calc, outfile=output_filename, extent=extent, format=gdal_out_format,
-            color_table=color_table, hideNodata=hide_nodata, return_ds=gdal_out_format == 'MEM', **kwargs)
+        parallel = process_helper.get_request_data(request.inputs, 'parallel')
+        with metrics.phase('calc'):
+            dst_ds = None
+            inputs = calc_engine.get_inputs(kwargs, filenames) if parallel else None
+            if inputs:
+                dst_ds = calc_engine.calc_chunked(
+                    calc, inputs, output_filename if gdal_out_format != 'MEM' else '', extent=extent,
+                    of=gdal_out_format, color_table=color_table, hide_nodata=hide_nodata)
+            if dst_ds is None:
+                dst_ds = gdal_calc.Calc(
+                    calc, outfile=output_filename, extent=extent, format=gdal_out_format,
+                    color_table=color_table, hideNodata=hide_nodata, return_ds=gdal_out_format == 'MEM',
+                    user_namespace=calc_expr.gdal_calc_namespace(), **kwargs)
+            elif gdal_out_format != 'MEM':
+                dst_ds = None  # close ds, only a MEM result is converted to czml
 
         if output_filename is not None and dst_ds is not None:
-            gdal_to_czml.gdal_to_czml(dst_ds, name=output_filename, out_filename=output_filename)
+            with metrics.phase('czml'):
+                gdal_to_czml.gdal_to_czml(dst_ds, name=output_filename, out_filename=output_filename)
 
         dst_ds = None  # close ds
         for i in range(len(files)):
             files[i] = None
 
-        response.outputs['output'].output_format = czml_format if is_czml else FORMATS.GEOTIFF
+        if is_cog:
+            compress = process_helper.get_request_data(request.inputs, 'compress')
+            output_filename = cog.make_cog_from_temp(output_filename, tempfile.mktemp(suffix=ext), compress)
+        elif image_ext:
+            output_filename = image_layer.make_image_layer(self.uuid, output_filename, name='calc', ext=image_ext)
+
+        result_cache.put(cache_key, output_ext, output_filename)
+
+        response.outputs['output'].output_format = output_format
         response.outputs['output'].file = output_filename
 
         return response
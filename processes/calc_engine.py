@@ -0,0 +1,231 @@
+import os
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import gdal
+import osr
+import numpy as np
+
+from processes import calc_expr
+
+# output chunks are about this many pixels, rounded to whole block rows of the first input
+chunk_pixels = 1 << 22
+
+# the same defaults gdal_calc uses for the output nodata value
+default_ndv = {
+    gdal.GDT_Byte: 255,
+    gdal.GDT_UInt16: 65535,
+    gdal.GDT_Int16: -32767,
+    gdal.GDT_UInt32: 4294967293,
+    gdal.GDT_Int32: -2147483647,
+    gdal.GDT_Float32: 3.402823466E+38,
+    gdal.GDT_Float64: 1.7976931348623158E+308,
+}
+
+# the state of the current forked pool worker, set once per worker by _init_worker (not used in-process)
+_worker = None
+
+
+class CalcInput:
+    def __init__(self, name, filename, ds: gdal.Dataset, bi=1, index=None):
+        band: gdal.Band = ds.GetRasterBand(bi)
+        self.name = name
+        self.filename = filename
+        self.bi = bi
+        # the position in a list input (a=[ds, ds, ...]), None for a single dataset input
+        self.index = index
+        self.gt = ds.GetGeoTransform()
+        self.wkt = ds.GetProjection()
+        self.size = ds.RasterXSize, ds.RasterYSize
+        self.ndv = band.GetNoDataValue()
+        self.data_type = band.DataType
+        self.block_size = band.GetBlockSize()
+        # pixel offset in the grid of the first input, set by get_grid
+        self.xoff = self.yoff = 0
+
+
+def _is_int(x, eps=1e-6):
+    return abs(x - round(x)) < eps
+
+
+def get_grid(inputs, extent):
+    """
+    checks that all the inputs are on the grid of the first one (same crs, resolution, whole pixel offsets)
+    and returns the output window (xoff, yoff, xsize, ysize) in that grid for extent 2 (union) or 3 (intersection),
+    or None if the inputs are not aligned
+    """
+    if extent not in [2, 3]:
+        return None
+    base = inputs[0]
+    gt0 = base.gt
+    if gt0[2] or gt0[4]:
+        return None
+    srs0 = osr.SpatialReference(wkt=base.wkt)
+    for i in inputs:
+        gt = i.gt
+        if gt[2] or gt[4] or not math.isclose(gt[1], gt0[1], rel_tol=1e-9) or \
+                not math.isclose(gt[5], gt0[5], rel_tol=1e-9):
+            return None
+        if i.wkt != base.wkt and not srs0.IsSame(osr.SpatialReference(wkt=i.wkt)):
+            return None
+        xoff = (gt[0] - gt0[0]) / gt0[1]
+        yoff = (gt[3] - gt0[3]) / gt0[5]
+        if not (_is_int(xoff) and _is_int(yoff)):
+            return None
+        i.xoff, i.yoff = int(round(xoff)), int(round(yoff))
+    f = min if extent == 2 else max
+    g = max if extent == 2 else min
+    x0 = f(i.xoff for i in inputs)
+    y0 = f(i.yoff for i in inputs)
+    x1 = g(i.xoff + i.size[0] for i in inputs)
+    y1 = g(i.yoff + i.size[1] for i in inputs)
+    if x1 <= x0 or y1 <= y0:
+        raise Exception('the input rasters have no intersection')
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def get_chunks(inputs, win):
+    """
+    splits the output window into row chunks, aligned to the block rows of the first input
+    """
+    block_y = max(1, inputs[0].block_size[1])
+    rows = max(block_y, chunk_pixels // max(1, win[2]) // block_y * block_y)
+    # the first chunk ends on a block boundary of the first input
+    first = rows - (win[1] - inputs[0].yoff) % block_y
+    chunks = []
+    row = 0
+    while row < win[3]:
+        n = min(first if row == 0 else rows, win[3] - row)
+        chunks.append((row, n))
+        row += n
+    return chunks
+
+
+def _make_state(inputs, win, calc, data_type, ndv, hide_nodata):
+    datasets = [gdal.Open(i.filename) for i in inputs]
+    return dict(inputs=inputs, datasets=datasets, win=win, expr=calc_expr.compile_expression(calc),
+                dtype=gdal_array_dtype(data_type), ndv=ndv, hide_nodata=hide_nodata)
+
+
+def _init_worker(*args):
+    global _worker
+    _worker = _make_state(*args)
+
+
+def gdal_array_dtype(data_type):
+    name = gdal.GetDataTypeName(data_type)
+    return np.dtype('uint8' if name == 'Byte' else name.lower())
+
+
+def _calc_chunk(chunk):
+    return _calc_chunk_with(_worker, chunk)
+
+
+def _calc_chunk_with(w, chunk):
+    """
+    reads the window of each input that overlaps the chunk exactly once and evaluates the expression on them
+    """
+    row, rows = chunk
+    x0, y0, xsize, _ = w['win']
+    cy0 = y0 + row
+    names = dict()
+    invalid = None
+    for i, ds in zip(w['inputs'], w['datasets']):
+        band: gdal.Band = ds.GetRasterBand(i.bi)
+        fill = i.ndv if i.ndv is not None else 0
+        arr = np.full((rows, xsize), fill, dtype=gdal_array_dtype(i.data_type))
+        ix0, ix1 = max(x0, i.xoff), min(x0 + xsize, i.xoff + i.size[0])
+        iy0, iy1 = max(cy0, i.yoff), min(cy0 + rows, i.yoff + i.size[1])
+        if ix1 > ix0 and iy1 > iy0:
+            arr[iy0 - cy0:iy1 - cy0, ix0 - x0:ix1 - x0] = \
+                band.ReadAsArray(ix0 - i.xoff, iy0 - i.yoff, ix1 - ix0, iy1 - iy0)
+        if not w['hide_nodata'] and i.ndv is not None:
+            mask = arr == i.ndv
+            invalid = mask if invalid is None else invalid | mask
+        if i.index is None:
+            names[i.name] = arr
+        else:
+            # the inputs of a list are in list order
+            names.setdefault(i.name, []).append(arr)
+    result = w['expr'].evaluate(names)
+    result = np.broadcast_to(result, (rows, xsize)).astype(w['dtype'])
+    if invalid is not None:
+        result[invalid] = w['ndv']
+    return row, result
+
+
+def calc_chunked(calc, inputs, output_filename, extent=2, of='GTiff', co=None,
+                 color_table=None, hide_nodata=True, data_type=None, max_workers=None):
+    """
+    evaluates a gdal_calc expression chunk by chunk over a process pool.
+    inputs is a list of CalcInput named by the expression variables (A, B, ...),
+    all of them on the same grid. the chunks are written to the output in order.
+    returns the output ds, or None if the inputs are not supported (not aligned) and gdal_calc should be used.
+    """
+    win = get_grid(inputs, extent)
+    if win is None:
+        return None
+    if data_type is None:
+        data_type = max(i.data_type for i in inputs)
+    ndv = None if hide_nodata else default_ndv.get(data_type)
+
+    gt0 = inputs[0].gt
+    gt = (gt0[0] + win[0] * gt0[1], gt0[1], 0, gt0[3] + win[1] * gt0[5], 0, gt0[5])
+    if co is None:
+        co = ['TILED=YES', 'BIGTIFF=IF_SAFER'] if of.lower() == 'gtiff' else []
+    ds: gdal.Dataset = gdal.GetDriverByName(of).Create(
+        str(output_filename or ''), win[2], win[3], 1, data_type, options=co)
+    ds.SetGeoTransform(gt)
+    ds.SetProjection(inputs[0].wkt)
+    band: gdal.Band = ds.GetRasterBand(1)
+    if ndv is not None:
+        band.SetNoDataValue(ndv)
+    if color_table:
+        band.SetRasterColorTable(color_table)
+        band.SetRasterColorInterpretation(gdal.GCI_PaletteIndex)
+
+    # compiled before the fork, the workers get it from the cache
+    calc_expr.compile_expression(calc)
+    chunks = get_chunks(inputs, win)
+    initargs = (inputs, win, calc, data_type, ndv, hide_nodata)
+    max_workers = min(max_workers or os.cpu_count(), len(chunks))
+    if max_workers <= 1:
+        # in-process the state is passed to each chunk, concurrent requests in other threads never share it
+        state = _make_state(*initargs)
+        for chunk in chunks:
+            row, arr = _calc_chunk_with(state, chunk)
+            band.WriteArray(arr, 0, row)
+        state = None
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('fork'),
+                                 initializer=_init_worker, initargs=initargs) as executor:
+            # map yields in order, so the output is written sequentially while the next chunks are computed
+            for row, arr in executor.map(_calc_chunk, chunks):
+                band.WriteArray(arr, 0, row)
+    band.FlushCache()
+    band = None
+    return ds
+
+
+def get_inputs(kwargs, filenames=None):
+    """
+    returns the CalcInputs of the gdal_calc kwargs (A=ds, B=ds, ..., or a=[ds, ds, ...] as gdalos
+    make_calc_with_func builds them), or None if there are other kwargs (i.e. per input band selection)
+    that only gdal_calc handles
+    """
+    filenames = filenames or dict()
+    inputs = []
+    for name, value in sorted(kwargs.items()):
+        if len(name) != 1 or not name.isalpha():
+            return None
+        values = enumerate(value) if isinstance(value, (list, tuple)) else [(None, value)]
+        for index, value in values:
+            if isinstance(value, str):
+                filename, ds = value, gdal.Open(value)
+            else:
+                filename, ds = filenames.get(id(value)) or value.GetDescription(), value
+            if not filename or not os.path.isfile(filename):
+                return None
+            inputs.append(CalcInput(name, filename, ds, index=index))
+    return inputs or None
@@ -0,0 +1,364 @@
+import ast
+import operator
+import functools
+import types
+
+import numpy as np
+
+# the functions a calc expression may call, as name or as numpy.name / np.name
+allowed_functions = {
+    'abs', 'absolute', 'sqrt', 'exp', 'log', 'log10', 'log2', 'floor', 'ceil', 'rint', 'round', 'trunc',
+    'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2', 'hypot', 'power', 'sign',
+    'where', 'clip', 'isnan', 'nan_to_num', 'maximum', 'minimum', 'fmax', 'fmin',
+    'logical_and', 'logical_or', 'logical_not', 'logical_xor',
+    'sum', 'prod', 'max', 'min', 'amax', 'amin', 'mean', 'median', 'std', 'var', 'any', 'all', 'count_nonzero',
+}
+allowed_keywords = {'axis'}
+allowed_constants = {'nan': np.nan, 'pi': np.pi, 'e': np.e, 'inf': np.inf, 'True': True, 'False': False}
+numpy_modules = {'numpy', 'np'}
+
+binary_operators = {
+    ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.true_divide,
+    ast.FloorDiv: np.floor_divide, ast.Mod: np.mod, ast.Pow: np.power,
+    ast.BitAnd: np.bitwise_and, ast.BitOr: np.bitwise_or, ast.BitXor: np.bitwise_xor,
+}
+unary_operators = {ast.USub: np.negative, ast.UAdd: np.positive, ast.Invert: np.invert, ast.Not: np.logical_not}
+compare_operators = {
+    ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater, ast.GtE: np.greater_equal,
+    ast.Eq: np.equal, ast.NotEq: np.not_equal,
+}
+bool_operators = {ast.And: np.logical_and, ast.Or: np.logical_or}
+# constants are folded with the python operators, the same as eval would compute them
+constant_operators = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: operator.pow,
+    ast.BitAnd: operator.and_, ast.BitOr: operator.or_, ast.BitXor: operator.xor,
+    ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Not: operator.not_,
+}
+# folded integer constants are capped, numpy can't hold wider ones and 9**9**9 would never finish folding
+max_constant_bits = 128
+# ufuncs whose result type is the numpy result type of their inputs, so a temporary input can take the result
+inplace_ufuncs = {np.add, np.subtract, np.multiply, np.bitwise_and, np.bitwise_or, np.bitwise_xor,
+                  np.logical_and, np.logical_or, np.maximum, np.minimum}
+# reductions over a list of layers (axis=0) that are accumulated layer by layer instead of stacking the layers
+fused_reductions = {
+    'sum': np.add, 'prod': np.multiply, 'max': np.maximum, 'amax': np.maximum, 'min': np.minimum,
+    'amin': np.minimum, 'any': np.logical_or, 'all': np.logical_and, 'mean': np.add,
+}
+
+
+class CalcExpression:
+    """
+    a calc expression compiled once into a plan of numpy ufunc calls.
+    each node of the plan returns (value, owned), owned values are temporaries that the next op may overwrite,
+    so chains like A+B+C or sum([1*(A>3), 1*(B>3), ...], axis=0) allocate a single result array.
+    """
+    def __init__(self, text, plan, names):
+        self.text = text
+        self._plan = plan
+        self.names = names
+
+    def evaluate(self, arrays: dict):
+        value, _ = self._plan(arrays)
+        return value
+
+
+def _function_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id in numpy_modules:
+        return node.attr
+    return None
+
+
+def _is_constant(node):
+    return isinstance(node, ast.Constant) and isinstance(node.value, (int, float, bool))
+
+
+def _check_constant(value):
+    if isinstance(value, int) and value.bit_length() > max_constant_bits:
+        raise Exception('constant too large in calc expression: over {} bits'.format(max_constant_bits))
+    return value
+
+
+def _fold_binary(op, left, right):
+    """
+    folds left op right, refusing results over max_constant_bits before computing them
+    """
+    if op is ast.Pow and isinstance(left, int) and isinstance(right, int) and abs(left) > 1 and \
+            right > 0 and (abs(left).bit_length() - 1) * right > max_constant_bits:
+        raise Exception('constant too large in calc expression: over {} bits'.format(max_constant_bits))
+    try:
+        return _check_constant(constant_operators[op](left, right))
+    except OverflowError:
+        raise Exception('constant overflow in calc expression')
+
+
+class Folder(ast.NodeTransformer):
+    """
+    validates the expression against the allow lists and folds the constant sub expressions
+    """
+    def generic_visit(self, node):
+        if not isinstance(node, (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare, ast.BoolOp, ast.Call,
+                                 ast.Name, ast.Attribute, ast.Constant, ast.List, ast.Tuple, ast.keyword,
+                                 ast.IfExp, ast.Load, ast.operator, ast.unaryop, ast.cmpop, ast.boolop)):
+            raise Exception('unsupported syntax in calc expression: {}'.format(type(node).__name__))
+        return super().generic_visit(node)
+
+    def visit_Constant(self, node):
+        if not isinstance(node.value, (int, float, bool)):
+            raise Exception('unsupported constant in calc expression: {!r}'.format(node.value))
+        _check_constant(node.value)
+        return node
+
+    def visit_Name(self, node):
+        if node.id in allowed_constants:
+            return ast.copy_location(ast.Constant(value=allowed_constants[node.id]), node)
+        if not (node.id.isidentifier() and node.id.isalpha() and len(node.id) == 1):
+            raise Exception('unknown name in calc expression: {}'.format(node.id))
+        return node
+
+    def visit_Attribute(self, node):
+        raise Exception('unsupported attribute in calc expression: {}'.format(ast.dump(node)))
+
+    def visit_GeneratorExp(self, node):
+        # gdalos make_calc_with_func builds f(<alpha pattern of x> for x in a), where a is the list of the inputs
+        gen = node.generators[0]
+        if len(node.generators) != 1 or gen.ifs or gen.is_async or not isinstance(gen.target, ast.Name) or \
+                not isinstance(gen.iter, ast.Name) or gen.target.id in allowed_constants or \
+                gen.iter.id in allowed_constants:
+            raise Exception('unsupported comprehension in calc expression, only f(... for x in a) is supported')
+        self.visit(gen.target)
+        self.visit(gen.iter)
+        node.elt = self.visit(node.elt)
+        return node
+
+    def visit_IfExp(self, node):
+        raise Exception('unsupported syntax in calc expression: IfExp, use where()')
+
+    def visit_Call(self, node):
+        name = _function_name(node.func)
+        if name not in allowed_functions:
+            raise Exception('unsupported function in calc expression: {}'.format(name or ast.dump(node.func)))
+        for k in node.keywords:
+            if k.arg not in allowed_keywords:
+                raise Exception('unsupported keyword in calc expression: {}'.format(k.arg))
+        if any(isinstance(a, ast.GeneratorExp) for a in node.args) and \
+                (name not in fused_reductions or len(node.args) != 1 or node.keywords):
+            raise Exception('only {}(... for x in a) may take a comprehension in calc expression'.format(
+                '/'.join(sorted(fused_reductions))))
+        node.args = [self.visit(a) for a in node.args]
+        node.keywords = [ast.keyword(arg=k.arg, value=self.visit(k.value)) for k in node.keywords]
+        node.func = ast.Name(id=name, ctx=ast.Load())
+        return node
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if type(node.op) not in binary_operators:
+            raise Exception('unsupported operator in calc expression: {}'.format(type(node.op).__name__))
+        if _is_constant(node.left) and _is_constant(node.right):
+            value = _fold_binary(type(node.op), node.left.value, node.right.value)
+            return ast.copy_location(ast.Constant(value=value), node)
+        return node
+
+    def visit_UnaryOp(self, node):
+        self.generic_visit(node)
+        if type(node.op) not in unary_operators:
+            raise Exception('unsupported operator in calc expression: {}'.format(type(node.op).__name__))
+        if _is_constant(node.operand) and not isinstance(node.op, ast.Invert):
+            value = constant_operators[type(node.op)](node.operand.value)
+            return ast.copy_location(ast.Constant(value=value), node)
+        return node
+
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        for op in node.ops:
+            if type(op) not in compare_operators:
+                raise Exception('unsupported comparison in calc expression: {}'.format(type(op).__name__))
+        return node
+
+
+def _inplace(ufunc, a, b, a_owned):
+    """
+    applies the ufunc into a when a is a temporary of the result type and shape, otherwise into a new array
+    """
+    if ufunc in inplace_ufuncs and a_owned and isinstance(a, np.ndarray) and np.result_type(a, b) == a.dtype and \
+            np.broadcast(a, b).shape == a.shape:
+        return ufunc(a, b, out=a), True
+    return ufunc(a, b), True
+
+
+def _build(node, names):
+    if isinstance(node, ast.Expression):
+        return _build(node.body, names)
+
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return lambda env: (value, False)
+
+    if isinstance(node, ast.Name):
+        names.add(node.id)
+        name = node.id
+        return lambda env: (env[name], False)
+
+    if isinstance(node, (ast.List, ast.Tuple)):
+        items = [_build(e, names) for e in node.elts]
+        return lambda env: ([f(env)[0] for f in items], False)
+
+    if isinstance(node, ast.BinOp):
+        ufunc = binary_operators[type(node.op)]
+        left, right = _build(node.left, names), _build(node.right, names)
+        commutative = ufunc in (np.add, np.multiply, np.bitwise_and, np.bitwise_or, np.bitwise_xor)
+
+        def binop(env):
+            a, a_owned = left(env)
+            b, b_owned = right(env)
+            if commutative and not a_owned and b_owned:
+                a, b, a_owned = b, a, b_owned
+            return _inplace(ufunc, a, b, a_owned)
+        return binop
+
+    if isinstance(node, ast.UnaryOp):
+        ufunc = unary_operators[type(node.op)]
+        operand = _build(node.operand, names)
+
+        def unaryop(env):
+            a, owned = operand(env)
+            if owned and isinstance(a, np.ndarray) and ufunc is not np.logical_not:
+                return ufunc(a, out=a), True
+            return ufunc(a), True
+        return unaryop
+
+    if isinstance(node, ast.Compare):
+        left = _build(node.left, names)
+        ops = [compare_operators[type(op)] for op in node.ops]
+        rights = [_build(c, names) for c in node.comparators]
+
+        def compare(env):
+            a, _ = left(env)
+            result = None
+            for ufunc, right in zip(ops, rights):
+                b, _ = right(env)
+                r = ufunc(a, b)
+                result = r if result is None else np.logical_and(result, r, out=result)
+                a = b
+            return result, True
+        return compare
+
+    if isinstance(node, ast.BoolOp):
+        ufunc = bool_operators[type(node.op)]
+        values = [_build(v, names) for v in node.values]
+
+        def boolop(env):
+            result, owned = values[0](env)
+            for f in values[1:]:
+                result, owned = _inplace(ufunc, result, f(env)[0], owned and result.dtype == bool)
+            return result, owned
+        return boolop
+
+    if isinstance(node, ast.Call):
+        name = node.func.id
+        if len(node.args) == 1 and isinstance(node.args[0], ast.GeneratorExp):
+            # f(... for x in a) is evaluated as f([... for each x of a], axis=0)
+            return _build_reduction(name, _build_comprehension(node.args[0], names))
+        args = [_build(a, names) for a in node.args]
+        kwargs = {k.arg: _build(k.value, names) for k in node.keywords}
+        axis = node.keywords[0].value.value \
+            if len(node.keywords) == 1 and _is_constant(node.keywords[0].value) else None
+        if name in fused_reductions and axis == 0 and len(args) == 1 and isinstance(node.args[0], (ast.List, ast.Tuple)):
+            items = [_build(e, names) for e in node.args[0].elts]
+            return _build_reduction(name, lambda env: (f(env) for f in items))
+        ufunc = getattr(np, name)
+
+        def call(env):
+            return ufunc(*[f(env)[0] for f in args], **{k: f(env)[0] for k, f in kwargs.items()}), True
+        return call
+
+    raise Exception('unsupported syntax in calc expression: {}'.format(type(node).__name__))
+
+
+def _build_comprehension(node, names):
+    """
+    the items of (elt for x in a), a is a list of layers and elt is evaluated with x bound to each of them
+    """
+    gen = node.generators[0]
+    var, seq = gen.target.id, gen.iter.id
+    elt_names = set()
+    elt = _build(node.elt, elt_names)
+    names.update(elt_names - {var})
+    names.add(seq)
+
+    def items(env):
+        local = dict(env)
+        for value in env[seq]:
+            local[var] = value
+            yield elt(local)
+    return items
+
+
+def _build_reduction(name, items):
+    """
+    numpy.<name>([x1, x2, ...], axis=0) computed as a running accumulation, without stacking the layers.
+    items(env) yields the (value, owned) of each layer.
+    """
+    ufunc = fused_reductions[name]
+
+    def reduction(env):
+        acc = None
+        count = 0
+        for value, owned in items(env):
+            count += 1
+            value = np.asarray(value)
+            if acc is None:
+                dtype = value.dtype
+                if name in ['sum', 'prod'] and dtype.kind in 'biu' and dtype.itemsize < np.dtype(np.int_).itemsize:
+                    # numpy sums small ints and bools in the platform int
+                    dtype = np.dtype(np.uint if dtype.kind == 'u' else np.int_)
+                elif name == 'mean' and dtype.kind in 'biu':
+                    dtype = np.dtype(np.float64)
+                elif name in ['any', 'all']:
+                    dtype = np.dtype(bool)
+                acc = value.astype(dtype, copy=not owned or dtype != value.dtype)
+                continue
+            dtype = np.result_type(acc, value) if name not in ['any', 'all'] else acc.dtype
+            if dtype != acc.dtype:
+                acc = acc.astype(dtype)
+            acc = ufunc(acc, value, out=acc) if np.broadcast(acc, value).shape == acc.shape else ufunc(acc, value)
+        if acc is None:
+            raise Exception('{}() of an empty list in calc expression'.format(name))
+        if name == 'mean':
+            acc = np.true_divide(acc, count, out=acc)
+        return acc, True
+    return reduction
+
+
+def _list_reduction(f):
+    @functools.wraps(f)
+    def reduction(a, *args, **kwargs):
+        if isinstance(a, types.GeneratorType):
+            return f(list(a), *args, axis=0, **kwargs)
+        return f(a, *args, **kwargs)
+    return reduction
+
+
+def gdal_calc_namespace():
+    """
+    the reductions for the gdal_calc eval namespace, taking f(... for x in a) as f([... for x in a], axis=0)
+    the same as compiled expressions do (numpy refuses reducing a generator)
+    """
+    return {name: _list_reduction(getattr(np, name)) for name in fused_reductions}
+
+
+@functools.lru_cache(maxsize=256)
+def compile_expression(text: str) -> CalcExpression:
+    """
+    parses, validates and compiles a calc expression once, the compiled expressions are cached by text
+    """
+    try:
+        tree = ast.parse(text.strip(), mode='eval')
+    except SyntaxError as e:
+        raise Exception('invalid calc expression {}: {}'.format(text, e))
+    tree = Folder().visit(tree)
+    names = set()
+    plan = _build(tree, names)
+    return CalcExpression(text, plan, frozenset(names))
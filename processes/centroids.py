@@ -18,9 +18,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import json
-import subprocess
-from pywps import Process, ComplexInput, ComplexOutput, Format, FORMATS
+import tempfile
+from pywps import Process, ComplexInput, ComplexOutput, LiteralInput, Format, FORMATS
+
+from backend.formats import flatgeobuf_format, gpkg_format
 
 
 class Centroids(Process):
@@ -28,10 +29,15 @@ class Centroids(Process):
         inputs = [ComplexInput('layer', 'Layer',
                                supported_formats=[
                                                   Format('application/gml+xml')
-                                                  ])]
+                                                  ]),
+                  LiteralInput('of', 'output format (geojson, fgb, gpkg, gml)', data_type='string',
+                               min_occurs=0, max_occurs=1, default='geojson')]
         outputs = [ComplexOutput('out', 'Referenced Output',
                                  supported_formats=[
-                                                    Format('application/json')
+                                                    Format('application/json'),
+                                                    flatgeobuf_format,
+                                                    gpkg_format,
+                                                    Format('application/gml+xml'),
                                                     ])]
 
         super(Centroids, self).__init__(
@@ -47,19 +53,19 @@ class Centroids(Process):
         )
 
     def _handler(self, request, response):
-        # ogr2ogr requires gdal-bin
-        from shapely.geometry import shape, mapping
+        import shapely
+        from processes import vector_io
 
-        input_gml = request.inputs['layer'][0].file
-        input_geojson = 'input.geojson'
-        subprocess.check_call(['ogr2ogr', '-f', 'geojson',
-                               input_geojson, input_gml])
-        with open(input_geojson, 'rb') as f:
-            data = json.loads(f.read())
-        for feature in data['features']:
-            geom = shape(feature['geometry'])
-            feature['geometry'] = mapping(geom.centroid)
-        out_bytes = json.dumps(data, indent=2)
-        response.outputs['out'].output_format = Format(FORMATS['JSON'])
-        response.outputs['out'].data = out_bytes
+        of, ext = vector_io.get_vector_format(request.inputs['of'][0].data if 'of' in request.inputs else None)
+        output_filename = tempfile.mktemp(suffix=ext)
+        options = ["XSISCHEMAURI=http://schemas.opengis.net/gml/2.1.2/feature.xsd"] if of == 'gml' else None
+        # read in-process with ogr and written a batch at a time, the collection is never held as json in memory
+        with vector_io.VectorReader(request.inputs['layer'][0].file) as reader:
+            with vector_io.open_writer(output_filename, of, name=reader.name, wkt=reader.wkt,
+                                       fields=reader.fields, options=options) as writer:
+                for batch in reader:
+                    writer.write(shapely.centroid(batch.geometries), batch.properties)
+        output_formats = dict(geojson=Format(FORMATS['JSON']), fgb=flatgeobuf_format, gpkg=gpkg_format, gml=FORMATS.GML)
+        response.outputs['out'].output_format = output_formats[of]
+        response.outputs['out'].file = output_filename
         return response
@@ -0,0 +1,83 @@
+import os
+import tempfile
+
+import gdal
+
+from backend import metrics
+
+cog_compressions = ['DEFLATE', 'ZSTD', 'LERC', 'LERC_DEFLATE', 'LERC_ZSTD', 'LZW', 'NONE']
+cog_block_size = 512
+
+
+def is_cog(of):
+    return of is not None and of.lower() == 'cog'
+
+
+def get_cog_co(compress='DEFLATE', level=None, predictor=True, driver='COG'):
+    compress = (compress or 'DEFLATE').upper()
+    if compress not in cog_compressions:
+        raise Exception('unsupported compression {}, supported: {}'.format(compress, cog_compressions))
+    co = ['COMPRESS={}'.format(compress), 'NUM_THREADS=ALL_CPUS', 'BIGTIFF=IF_SAFER']
+    if driver == 'COG':
+        co.extend(['BLOCKSIZE={}'.format(cog_block_size), 'OVERVIEWS=AUTO'])
+        if predictor and compress in ['DEFLATE', 'ZSTD', 'LZW']:
+            co.append('PREDICTOR=YES')
+    else:
+        co.extend(['TILED=YES', 'BLOCKXSIZE={}'.format(cog_block_size), 'BLOCKYSIZE={}'.format(cog_block_size),
+                   'COPY_SRC_OVERVIEWS=YES'])
+        if predictor and compress in ['DEFLATE', 'ZSTD', 'LZW']:
+            co.append('PREDICTOR=2')
+    if level is not None and compress in ['DEFLATE', 'ZSTD']:
+        co.append('LEVEL={}'.format(level))
+    return co
+
+
+def get_overview_levels(ds: gdal.Dataset, min_size=cog_block_size):
+    levels = []
+    level = 2
+    while max(ds.RasterXSize, ds.RasterYSize) / level >= min_size / 2:
+        levels.append(level)
+        level *= 2
+    return levels
+
+
+def make_cog(src, out_filename, compress='DEFLATE', level=None, resampling='NEAREST'):
+    """
+    writes the given raster (filename or ds) as a Cloud Optimized GeoTIFF:
+    tiled, compressed, with internal overviews, and with the overviews and tiles ordered for partial http reads.
+    uses the COG driver when available (gdal >= 3.1), otherwise builds the same layout with the GTiff driver.
+    """
+    src_ds = gdal.Open(str(src)) if isinstance(src, str) else src
+    if gdal.GetDriverByName('COG') is not None:
+        co = get_cog_co(compress, level, driver='COG') + ['RESAMPLING={}'.format(resampling)]
+        ds = gdal.Translate(str(out_filename), src_ds, format='COG', creationOptions=co)
+    else:
+        # overviews are built on a temp tiled copy and then copied in front of the full resolution tiles
+        temp_filename = tempfile.mktemp(suffix='.tif')
+        temp_ds = gdal.Translate(temp_filename, src_ds, format='GTiff',
+                                 creationOptions=['TILED=YES', 'BIGTIFF=IF_SAFER'])
+        levels = get_overview_levels(temp_ds)
+        if levels:
+            temp_ds.BuildOverviews(resampling, levels)
+        co = get_cog_co(compress, level, driver='GTiff')
+        ds = gdal.GetDriverByName('GTiff').CreateCopy(str(out_filename), temp_ds, options=co)
+        temp_ds = None
+        gdal.GetDriverByName('GTiff').Delete(temp_filename)
+    if ds is None:
+        raise Exception('failed to create cog {}'.format(out_filename))
+    return ds
+
+
+def make_cog_from_temp(temp_filename, out_filename, compress='DEFLATE', remove_temp=True):
+    """
+    converts a temporary GTiff result into a cog and removes the temp file
+    """
+    with metrics.phase('cog'):
+        ds = make_cog(temp_filename, out_filename, compress)
+        ds = None
+    if remove_temp:
+        try:
+            os.remove(temp_filename)
+        except OSError:
+            pass
+    return out_filename
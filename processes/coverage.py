@@ -0,0 +1,116 @@
+import gdal
+import osr
+import numpy as np
+
+from gdalos import projdef
+from gdalos.viewshed import viewshed_params
+from gdalos.viewshed.viewshed_params import ViewshedParams
+from processes import viewshed_batch, bitset
+from processes.bitset import align_window
+from processes.coverage_select import Candidate, Coverage, select_observers
+from processes.dtm_cache import dtm_cache
+from processes.cutline import transform_bounds
+from backend import warmup
+
+# max number of candidate observers of a single request
+max_candidates = 4096
+
+
+def _calc_bits(dtm: viewshed_batch.DtmWindow, task):
+    """
+    runs a candidate viewshed on the shared dtm window and returns its visible pixels packed into bits
+    """
+    index, win, arr = viewshed_batch._calc_one(dtm, task)
+    return index, win, bitset.pack(arr > viewshed_params.viewshed_thresh)
+
+
+def is_inside(vp: ViewshedParams, gt, raster_size):
+    px = (vp.ox - gt[0]) / gt[1]
+    py = (vp.oy - gt[3]) / gt[5]
+    return 0 <= px < raster_size[0] and 0 <= py < raster_size[1]
+
+
+def get_candidates(input_ds: gdal.Dataset, vp_array, bi=1, in_coords_crs_pj=None, max_workers=None):
+    """
+    computes the viewshed of each candidate observer over a single shared read of the dtm, as packed bitsets.
+    candidates outside of the raster are skipped.
+    """
+    input_band: gdal.Band = input_ds.GetRasterBand(bi)
+    if input_band is None:
+        raise Exception('band number out of range')
+    if len(vp_array) > max_candidates:
+        raise Exception('too many candidates {}, max is {}'.format(len(vp_array), max_candidates))
+    gt = input_ds.GetGeoTransform()
+    if gt[2] or gt[4]:
+        raise Exception('rotated rasters are not supported')
+    raster_size = input_ds.RasterXSize, input_ds.RasterYSize
+
+    if in_coords_crs_pj is not None:
+        in_raster_srs = osr.SpatialReference()
+        in_raster_srs.ImportFromWkt(input_ds.GetProjection())
+        transform = projdef.get_transform(projdef.get_proj_string(in_coords_crs_pj), in_raster_srs)
+        if transform:
+            for vp in vp_array:
+                vp.ox, vp.oy, _ = transform.TransformPoint(vp.ox, vp.oy)
+
+    tasks = []
+    for i, vp in enumerate(vp_array):
+        # gdal.ViewshedGenerate fails on an observer outside of the dtm, grids usually overhang the raster
+        if not is_inside(vp, gt, raster_size):
+            continue
+        win = viewshed_batch.get_observer_window(vp, gt, raster_size)
+        if win is None:
+            continue
+        tasks.append((i, align_window(win, raster_size), vp.get_as_gdal_params()))
+    if not tasks:
+        raise Exception('all the candidates are outside of the input raster')
+
+    read_win = viewshed_batch.combine_windows([t[1] for t in tasks], 2)
+    dtm_array = dtm_cache.read_window(input_band, input_ds.GetDescription(), bi, read_win)
+    if dtm_array is None:
+        dtm_array = warmup.read_window(input_band, input_ds.GetDescription(), bi, read_win)
+    dtm = viewshed_batch.DtmWindow(dtm_array, read_win[0], read_win[1], gt,
+                                   input_ds.GetProjection(), input_band.GetNoDataValue(), input_band.DataType)
+
+    results = list(viewshed_batch.map_tasks(_calc_bits, (dtm,), tasks, max_workers))
+    return [Candidate(index, vp_array[index], win, bits) for index, win, bits in results]
+
+
+def get_grid_bounds(grid, tgt_wkt):
+    """
+    returns the (min_x, min_y, max_x, max_y) envelope in tgt_wkt of a grid extent given in EPSG:4326
+    """
+    wgs84 = osr.SpatialReference()
+    wgs84.ImportFromEPSG(4326)
+    return transform_bounds(grid, wgs84.ExportToWkt(), tgt_wkt)
+
+
+def get_grid_points(min_x, min_y, max_x, max_y, step):
+    """
+    returns the x, y lists of a regular grid of candidates over the extent, at the centers of the grid cells
+    """
+    if step <= 0:
+        raise Exception('grid step must be positive')
+    xs = np.arange(min_x + step / 2, max_x, step)
+    ys = np.arange(max_y - step / 2, min_y, -step)
+    if len(xs) * len(ys) > max_candidates:
+        raise Exception('the grid has {} candidates, max is {}, use a larger step'.format(
+            len(xs) * len(ys), max_candidates))
+    gx, gy = np.meshgrid(xs, ys)
+    return gx.ravel().tolist(), gy.ravel().tolist()
+
+
+def write_coverage(coverage: Coverage, input_ds: gdal.Dataset, output_filename, of='GTiff', co=None):
+    """
+    writes the union coverage of the selected observers, 1 for visible and 0 for not visible pixels
+    """
+    gt = input_ds.GetGeoTransform()
+    read_win = coverage.read_win
+    ds: gdal.Dataset = gdal.GetDriverByName(of).Create(
+        str(output_filename), read_win[2], read_win[3], 1, gdal.GDT_Byte, options=co or [])
+    ds.SetGeoTransform((gt[0] + read_win[0] * gt[1], gt[1], 0, gt[3] + read_win[1] * gt[5], 0, gt[5]))
+    ds.SetProjection(input_ds.GetProjection())
+    bnd: gdal.Band = ds.GetRasterBand(1)
+    bnd.WriteArray(coverage.to_array())
+    bnd = None
+    return ds
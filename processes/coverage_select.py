@@ -0,0 +1,86 @@
+import heapq
+
+import numpy as np
+
+from processes import bitset
+from processes.bitset import popcount, packed_slice, packed_width
+
+# the greedy selection of the site_selection process works on numpy bitsets only, without gdal,
+# the candidates viewsheds are computed by processes.coverage
+
+
+class Candidate:
+    """
+    the viewshed of a candidate observer (its ViewshedParams) as a packed bitset (np.packbits of visible pixels)
+    over its own window
+    """
+    def __init__(self, index, vp, win, bits):
+        self.index = index
+        self.vp = vp
+        self.win = win
+        self.bits = bits
+        self.gain = popcount(bits)
+
+
+class Coverage:
+    """
+    the union of the viewsheds of the selected observers, packed into bits over the read window
+    """
+    def __init__(self, read_win):
+        self.read_win = read_win
+        self.bits = np.zeros((read_win[3], packed_width(read_win[2])), dtype=np.uint8)
+        self.pixels = 0
+
+    def _slice(self, c: Candidate):
+        return packed_slice(c.win[0] - self.read_win[0], c.win[1] - self.read_win[1], c.bits)
+
+    def gain(self, c: Candidate) -> int:
+        """
+        the number of pixels the candidate would add to the coverage
+        """
+        return popcount(c.bits & ~self.bits[self._slice(c)])
+
+    def add(self, c: Candidate):
+        self.bits[self._slice(c)] |= c.bits
+        self.pixels += c.gain
+
+    def to_array(self):
+        return bitset.unpack(self.bits, self.read_win[2])
+
+
+def select_observers(candidates, k, min_gain=1):
+    """
+    greedily selects up to k candidates, each one adds the most pixels not yet covered by the previous ones.
+    the coverage is submodular (a candidate gain can only drop as observers are added),
+    so the last computed gains are upper bounds and only the candidates at the top of the heap are re-evaluated
+    (lazy greedy).
+    returns (selected candidates with their marginal gain set, coverage)
+    """
+    coverage = Coverage(combine_candidates_windows(candidates))
+    heap = [(-c.gain, c.index, 0, c) for c in candidates]
+    heapq.heapify(heap)
+    selected = []
+    while heap and len(selected) < k:
+        neg_gain, index, step, c = heapq.heappop(heap)
+        if step != len(selected):
+            # stale upper bound, re-evaluate against the current coverage
+            c.gain = coverage.gain(c)
+            if c.gain >= min_gain:
+                heapq.heappush(heap, (-c.gain, index, len(selected), c))
+            continue
+        if c.gain < min_gain:
+            break
+        coverage.add(c)
+        selected.append(c)
+    return selected, coverage
+
+
+def combine_candidates_windows(candidates):
+    """
+    the union of the candidates windows, the same as viewshed_batch.combine_windows(windows, 2)
+    """
+    x0 = min(c.win[0] for c in candidates)
+    y0 = min(c.win[1] for c in candidates)
+    x1 = max(c.win[0] + c.win[2] for c in candidates)
+    y1 = max(c.win[1] + c.win[3] for c in candidates)
+    return x0, y0, x1 - x0, y1 - y0
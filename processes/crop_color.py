@@ -11,13 +11,10 @@ from pywps.app.Common import Metadata
 from pywps.inout import ComplexOutput, LiteralOutput
 from pywps.response.execute import ExecuteResponse
 
-from gdalos.calc import gdal_dem_color_cutline
 from backend.formats import czml_format
-from gdalos import gdalos_util
-from gdalos.rectangle import GeoRectangle
+from backend import metrics
 from .process_defaults import process_defaults, LiteralInputD, ComplexInputD, BoundingBoxInputD
 from processes import process_helper
-from gdalos.gdalos_color import ColorPalette
 
 
 class GdalDem(Process):
@@ -25,8 +22,10 @@ class GdalDem(Process):
         process_id = 'crop_color'
         defaults = process_defaults(process_id)
         inputs = [
-            LiteralInputD(defaults, 'of', 'output format (czml, gtiff)', data_type='string',
+            LiteralInputD(defaults, 'of', 'output format (czml, czml_png, czml_webp, gtiff, cog, tiles)', data_type='string',
                           min_occurs=0, max_occurs=1, default='gtiff'),
+            LiteralInputD(defaults, 'compress', 'cog compression (DEFLATE, ZSTD, LERC...)', data_type='string',
+                          min_occurs=0, max_occurs=1, default='DEFLATE'),
             LiteralInputD(defaults, 'output_czml', 'make output as czml', data_type='boolean',
                          min_occurs=0, max_occurs=1, default=None),
             LiteralInputD(defaults, 'output_tif', 'make output as tif', data_type='boolean',
@@ -68,11 +67,26 @@ class GdalDem(Process):
         )
 
     def _handler(self, request, response: ExecuteResponse):
+        from gdalos.calc import gdal_dem_color_cutline
+        from gdalos import gdalos_util
+        from gdalos.rectangle import GeoRectangle
+        from gdalos.gdalos_color import ColorPalette
+        from processes import cog
+        from backend import tiles, image_layer
+        from processes.cutline import cutline_cache
+
         output_czml = process_helper.get_request_data(request.inputs, 'output_czml')
         output_tif = process_helper.get_request_data(request.inputs, 'output_tif')
         of: str = process_helper.get_request_data(request.inputs, 'of')
         if output_czml:
             of = 'czml'
+        is_tiles = of is not None and of.lower() == 'tiles'
+        is_cog = cog.is_cog(of)
+        image_ext = image_layer.get_image_ext(of)
+        if is_tiles or is_cog or image_ext:
+            # the result is rendered as a tile layer / converted to cog / encoded as a czml referenced image
+            # from a GeoTIFF
+            of = 'GTiff'
         ext = gdalos_util.get_ext_by_of(of)
         is_czml = ext == '.czml'
         output_czml = is_czml
@@ -99,15 +113,31 @@ class GdalDem(Process):
             gdal_out_format = 'GTiff' if output_tif else 'MEM'
 
             raster_filename, ds = process_helper.open_ds_from_wps_input(request.inputs['r'][0])
+            cutline = cutline_cache.prepare(cutline, ds, extent)
+
+            with metrics.phase('crop_color'):
+                gdal_dem_color_cutline.czml_gdaldem_crop_and_color(
+                    ds=ds,
+                    czml_output_filename=czml_output_filename,
+                    out_filename=tif_output_filename,
+                    extent=extent, cutline=cutline,
+                    color_palette=color_palette,
+                    process_palette=process_palette,
+                    output_format=gdal_out_format)
 
-            gdal_dem_color_cutline.czml_gdaldem_crop_and_color(
-                ds=ds,
-                czml_output_filename=czml_output_filename,
-                out_filename=tif_output_filename,
-                extent=extent, cutline=cutline,
-                color_palette=color_palette,
-                process_palette=process_palette,
-                output_format=gdal_out_format)
+            if is_tiles or image_ext:
+                if is_tiles:
+                    czml_output_filename = tiles.make_tile_layer(self.uuid, tif_output_filename, name='crop_color')
+                else:
+                    czml_output_filename = image_layer.make_image_layer(
+                        self.uuid, tif_output_filename, name='crop_color', ext=image_ext)
+                output_filename = czml_output_filename
+                is_czml = output_czml = True
+            elif is_cog:
+                compress = process_helper.get_request_data(request.inputs, 'compress')
+                tif_output_filename = cog.make_cog_from_temp(
+                    tif_output_filename, tempfile.mktemp(suffix=FORMATS.GEOTIFF.extension), compress)
+                output_filename = tif_output_filename
 
             response.outputs['output'].output_format = czml_format if is_czml else FORMATS.GEOTIFF
             response.outputs['output'].file = output_filename
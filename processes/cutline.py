@@ -0,0 +1,273 @@
+import os
+import glob
+import shutil
+import hashlib
+import threading
+import tempfile
+from collections import OrderedDict
+
+import gdal
+import ogr
+import osr
+
+from processes.process_defaults import process_defaults
+from processes.result_cache import file_content_hash
+from backend import metrics
+
+# the extent a cutline is clipped to is padded by this number of output pixels,
+# so the clipping edges are always outside of the rasterized output
+clip_pad_pixels = 2
+# max number of memoized content hashes of cutline files (uploaded cutlines get a new temp path each request)
+max_keys = 1024
+
+
+def _srs(wkt):
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(wkt)
+    if hasattr(srs, 'SetAxisMappingStrategy'):
+        # x, y = lon, lat regardless of the crs axis order (gdal>=3)
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def transform_bounds(bounds, src_wkt, tgt_wkt, densify=21):
+    """
+    returns the (min_x, min_y, max_x, max_y) envelope of the bounds transformed from src_wkt to tgt_wkt,
+    the edges are densified so curved edges in the target crs are covered
+    """
+    if not src_wkt or not tgt_wkt or src_wkt == tgt_wkt:
+        return bounds
+    src_srs, tgt_srs = _srs(src_wkt), _srs(tgt_wkt)
+    if src_srs.IsSame(tgt_srs):
+        return bounds
+    min_x, min_y, max_x, max_y = bounds
+    ring = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in [(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y), (min_x, min_y)]:
+        ring.AddPoint_2D(x, y)
+    ring.Segmentize(max(max_x - min_x, max_y - min_y) / (densify - 1))
+    geom = ogr.Geometry(ogr.wkbPolygon)
+    geom.AddGeometry(ring)
+    geom.AssignSpatialReference(src_srs)
+    if geom.TransformTo(tgt_srs) != 0:
+        raise Exception('failed to transform the extent to the cutline crs')
+    min_x, max_x, min_y, max_y = geom.GetEnvelope()
+    return min_x, min_y, max_x, max_y
+
+
+def get_ds_bounds(ds: gdal.Dataset):
+    gt = ds.GetGeoTransform()
+    xs = [gt[0], gt[0] + ds.RasterXSize * gt[1]]
+    ys = [gt[3], gt[3] + ds.RasterYSize * gt[5]]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+class Cutline:
+    """
+    the polygons of a parsed cutline, exploded to single parts and indexed by a shapely STRtree
+    """
+    def __init__(self, key, parts, wkt):
+        import shapely
+        self.key = key
+        self.parts = parts
+        self.wkt = wkt
+        self.tree = shapely.STRtree(parts)
+        self.vertices = int(shapely.get_num_coordinates(parts).sum())
+
+    @classmethod
+    def from_file(cls, filename, key):
+        import numpy as np
+        import shapely
+        ds = ogr.Open(str(filename))
+        if ds is None:
+            raise Exception('cannot open cutline {}'.format(filename))
+        wkbs = []
+        wkt = None
+        for i in range(ds.GetLayerCount()):
+            layer: ogr.Layer = ds.GetLayer(i)
+            srs = layer.GetSpatialRef()
+            if wkt is None and srs is not None:
+                wkt = srs.ExportToWkt()
+            for feature in layer:
+                geom = feature.GetGeometryRef()
+                if geom is not None:
+                    wkbs.append(bytes(geom.ExportToWkb()))
+        ds = None
+        parts = shapely.get_parts(shapely.from_wkb(np.array(wkbs, dtype=object)))
+        parts = parts[shapely.get_type_id(parts) == shapely.GeometryType.POLYGON]
+        if not len(parts):
+            raise Exception('the cutline {} has no polygons'.format(filename))
+        return cls(key, parts, wkt)
+
+    def clip(self, bounds, tolerance=0):
+        """
+        returns the polygons of the cutline inside the bounds, simplified to the tolerance,
+        only the parts that cross the bounds are intersected, or None if no part intersects the bounds
+        """
+        import shapely
+        box = shapely.box(*bounds)
+        parts = self.parts[self.tree.query(box, predicate='intersects')]
+        if not len(parts):
+            return None
+        crossing = ~shapely.contains(box, parts)
+        if crossing.any():
+            parts[crossing] = shapely.intersection(parts[crossing], box)
+            parts = shapely.get_parts(parts)
+            parts = parts[shapely.get_type_id(parts) == shapely.GeometryType.POLYGON]
+        if tolerance > 0:
+            parts = shapely.simplify(parts, tolerance, preserve_topology=True)
+        parts = parts[~shapely.is_empty(parts)]
+        return parts if len(parts) else None
+
+
+class CutlineCache:
+    """
+    parses every cutline once and keeps the parsed polygons in memory by content hash.
+    for each request the cutline is clipped to the output extent and simplified to the output pixel size,
+    so the warper only rasterizes the few relevant vertices instead of re-parsing the whole gml.
+    the clipped cutlines are written as GeoPackages to cache_dir and reused by (content hash, extent, tolerance).
+    """
+    def __init__(self, cache_dir='./workdir/cutline_cache', max_entries=16, simplify=0.5, enabled=True):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        # the simplification tolerance in output pixels, 0 to only clip
+        self.simplify = simplify
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.clip_hits = 0
+        self.clip_misses = 0
+        self._lock = threading.Lock()
+        self._cutlines = OrderedDict()
+        # (path, mtime, size) -> content hash of the local (default) cutlines, so they are not hashed every request
+        self._keys = dict()
+
+    @classmethod
+    def from_defaults(cls):
+        return cls(**process_defaults('cutline_cache'))
+
+    def _get_key(self, filename):
+        st = os.stat(filename)
+        stat_key = os.path.abspath(filename), st.st_mtime_ns, st.st_size
+        with self._lock:
+            key = self._keys.get(stat_key)
+        if key is None:
+            key = file_content_hash(filename)
+            with self._lock:
+                if len(self._keys) >= max_keys:
+                    self._keys.clear()
+                self._keys[stat_key] = key
+        return key
+
+    def _clip_prefix(self, key):
+        return os.path.join(self.cache_dir, key[:16] + '_')
+
+    def _remove_clips(self, key):
+        # the clipped cutlines of an evicted cutline would otherwise stay in cache_dir forever
+        for path in glob.glob(glob.escape(self._clip_prefix(key)) + '*.gpkg'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, filename) -> Cutline:
+        key = self._get_key(filename)
+        with self._lock:
+            cutline = self._cutlines.get(key)
+            if cutline is not None:
+                self._cutlines.move_to_end(key)
+                self.hits += 1
+                return cutline
+            self.misses += 1
+        cutline = Cutline.from_file(filename, key)
+        evicted = []
+        with self._lock:
+            self._cutlines[key] = cutline
+            while len(self._cutlines) > self.max_entries:
+                evicted.append(self._cutlines.popitem(last=False)[0])
+        for evicted_key in evicted:
+            self._remove_clips(evicted_key)
+        return cutline
+
+    def prepare(self, filename, ds: gdal.Dataset, extent=None):
+        """
+        returns the filename of the cutline clipped to the extent of ds (and to the given extent, in EPSG:4326)
+        and simplified to the ds pixel size, to be used as the warp cutline of an output on the grid of ds.
+        returns the given filename itself if the cache is disabled or if the cutline does not intersect the extent,
+        in which case gdal handles it as before.
+        """
+        if not filename or not self.enabled or ds is None:
+            return filename
+        with metrics.phase('cutline'):
+            cutline = self.get(filename)
+            ds_wkt = ds.GetProjection()
+            wkt = cutline.wkt or ds_wkt
+            # a cutline without a crs is taken by the warper in the crs of the raster
+            bounds = transform_bounds(get_ds_bounds(ds), ds_wkt, wkt)
+            pixel_size = min((bounds[2] - bounds[0]) / ds.RasterXSize, (bounds[3] - bounds[1]) / ds.RasterYSize)
+            if extent is not None:
+                wgs84 = osr.SpatialReference()
+                wgs84.ImportFromEPSG(4326)
+                ext_bounds = transform_bounds((extent.min_x, extent.min_y, extent.max_x, extent.max_y),
+                                              wgs84.ExportToWkt(), wkt)
+                bounds = max(bounds[0], ext_bounds[0]), max(bounds[1], ext_bounds[1]), \
+                    min(bounds[2], ext_bounds[2]), min(bounds[3], ext_bounds[3])
+                if bounds[2] <= bounds[0] or bounds[3] <= bounds[1]:
+                    return filename
+            pad = clip_pad_pixels * pixel_size
+            bounds = bounds[0] - pad, bounds[1] - pad, bounds[2] + pad, bounds[3] + pad
+            tolerance = self.simplify * pixel_size
+
+            # the clip key is rounded to the tolerance, so nearby extents share the clipped cutline
+            q = pixel_size / 8
+            clip_key = '{}_{}'.format(cutline.key, [round(b / q) for b in bounds + (tolerance,)])
+            path = self._clip_prefix(cutline.key) + hashlib.sha1(clip_key.encode('utf-8')).hexdigest() + '.gpkg'
+            is_hit = os.path.isfile(path)
+            with self._lock:
+                if is_hit:
+                    self.clip_hits += 1
+                else:
+                    self.clip_misses += 1
+            if is_hit:
+                return path
+            parts = cutline.clip(bounds, tolerance)
+            if parts is None:
+                return filename
+            return self.write(path, parts, wkt)
+
+    def write(self, path, parts, wkt=None):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # written to a private temp dir first so a concurrent request would never open a partial file,
+        # the GPKG driver does not create over an existing (i.e. mkstemp) file
+        temp_dir = tempfile.mkdtemp(dir=self.cache_dir)
+        temp_path = os.path.join(temp_dir, 'cutline.gpkg')
+        try:
+            self._write_gpkg(temp_path, parts, wkt)
+            os.replace(temp_path, path)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        return path
+
+    @staticmethod
+    def _write_gpkg(filename, parts, wkt):
+        import shapely
+        ds = ogr.GetDriverByName('GPKG').CreateDataSource(filename)
+        if ds is None:
+            raise Exception('cannot create {}'.format(filename))
+        layer: ogr.Layer = ds.CreateLayer('cutline', _srs(wkt) if wkt else None, ogr.wkbPolygon)
+        defn = layer.GetLayerDefn()
+        layer.StartTransaction()
+        for wkb in shapely.to_wkb(parts):
+            feature = ogr.Feature(defn)
+            feature.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+            layer.CreateFeature(feature)
+        layer.CommitTransaction()
+        layer = ds = None
+
+    def stats(self):
+        with self._lock:
+            return dict(cutlines=len(self._cutlines),
+                        vertices=sum(c.vertices for c in self._cutlines.values()),
+                        hits=self.hits, misses=self.misses, clip_hits=self.clip_hits, clip_misses=self.clip_misses)
+
+
+cutline_cache = CutlineCache.from_defaults()
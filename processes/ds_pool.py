@@ -0,0 +1,137 @@
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class DatasetPool:
+    """
+    a bounded pool of open read-only gdal datasets.
+    datasets are keyed by (path, open kwargs (i.e. src_ovr), mtime),
+    so a file that was replaced on disk gets a fresh handle.
+    gdal datasets are not thread safe, so a handle is leased to the thread that opened or checked it out,
+    until the thread's lease ends (see lease), and only then it can be checked out by another thread.
+    the least recently used idle handles are dropped once the pool grows over max_size.
+    """
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # key -> list of the idle handles of this key, by least recent use of the keys
+        self._pool = OrderedDict()
+        self._idle = 0
+        # the handles leased to the current thread by key, dropped with the thread
+        self._local = threading.local()
+
+    @staticmethod
+    def _get_mtime(filename):
+        try:
+            return os.stat(filename).st_mtime_ns
+        except OSError:
+            # not a local file (i.e. /vsicurl/)
+            return None
+
+    def make_key(self, filename, **kwargs):
+        filename = str(filename)
+        if os.path.isfile(filename):
+            filename = os.path.abspath(filename)
+        return filename, tuple(sorted(kwargs.items())), self._get_mtime(filename)
+
+    def _get_leases(self) -> dict:
+        leases = getattr(self._local, 'leases', None)
+        if leases is None:
+            leases = self._local.leases = dict()
+        return leases
+
+    def open_ds(self, filename, **kwargs):
+        key = self.make_key(filename, **kwargs)
+        leases = self._get_leases()
+        ds = leases.get(key)
+        if ds is not None:
+            with self._lock:
+                self.hits += 1
+            return ds
+        with self._lock:
+            idle = self._pool.get(key)
+            if idle:
+                ds = idle.pop()
+                if not idle:
+                    del self._pool[key]
+                self._idle -= 1
+                self.hits += 1
+                leases[key] = ds
+                return ds
+            self.misses += 1
+
+        # open outside of the lock, opening a large raster might take a while
+        from gdalos import gdalos_util
+        ds = gdalos_util.open_ds(key[0], **kwargs)
+        if ds is not None:
+            leases[key] = ds
+        return ds
+
+    def release(self):
+        """
+        returns the handles leased to the current thread to the pool
+        """
+        leases = self._get_leases()
+        with self._lock:
+            for key, ds in leases.items():
+                self._pool.setdefault(key, []).append(ds)
+                self._pool.move_to_end(key)
+                self._idle += 1
+            while self._idle > self.max_size:
+                # the handle is closed once the last reference to it is dropped
+                key, idle = next(iter(self._pool.items()))
+                idle.pop(0)
+                if not idle:
+                    del self._pool[key]
+                self._idle -= 1
+                self.evictions += 1
+        leases.clear()
+
+    @contextmanager
+    def lease(self):
+        """
+        the handles opened by the current thread inside the block are released when it ends,
+        nested blocks are released with the outermost one
+        """
+        if getattr(self._local, 'in_lease', False):
+            yield
+            return
+        self._local.in_lease = True
+        try:
+            yield
+        finally:
+            self._local.in_lease = False
+            self.release()
+
+    def clear(self):
+        with self._lock:
+            self._pool.clear()
+            self._idle = 0
+
+    def stats(self):
+        with self._lock:
+            # the idle handles, the leased ones are owned by their threads
+            return dict(size=self._idle, max_size=self.max_size,
+                        hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+ds_pool = DatasetPool()
+
+
+def install():
+    """
+    releases the datasets of every process execution when it ends
+    """
+    from pywps.app import Process
+    run_process = Process._run_process
+
+    def _leased_run_process(self, wps_request, wps_response):
+        with ds_pool.lease():
+            return run_process(self, wps_request, wps_response)
+
+    Process._run_process = _leased_run_process
@@ -0,0 +1,138 @@
+import os
+import sys
+import glob
+import hashlib
+import tempfile
+import threading
+
+import gdal
+import numpy as np
+
+from processes import block_process
+from processes.process_defaults import process_defaults
+
+
+class DtmCache:
+    """
+    an opt-in cache of uncompressed .npy sidecars of hot dtms, mapped with numpy.memmap,
+    so elevation lookups and window reads are slices of the page cache without any gdal decoding.
+    a sidecar belongs to a (path, band, mtime) of the source, a source that was replaced on disk gets a new sidecar.
+    """
+    def __init__(self, cache_dir='./workdir/dtm_cache', dtms=None):
+        self.cache_dir = cache_dir
+        self.dtms = {os.path.abspath(f) for f in dtms or []}
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self._lock = threading.Lock()
+        self._arrays = dict()
+        # a lock per (path, band), so generating a sidecar only blocks the requests for the same dtm
+        self._file_locks = dict()
+
+    @classmethod
+    def from_defaults(cls):
+        return cls(**process_defaults('dtm_cache'))
+
+    def is_enabled(self, filename):
+        return os.path.abspath(str(filename)) in self.dtms
+
+    def _prefix(self, filename, bi):
+        name = hashlib.sha1(filename.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, '{}_{}_b{}_'.format(os.path.basename(filename), name, bi))
+
+    def make_sidecar(self, filename, bi=1):
+        """
+        writes the band as a row major .npy next to the other sidecars and removes the stale ones of the same source
+        """
+        filename = os.path.abspath(filename)
+        mtime = os.stat(filename).st_mtime_ns
+        prefix = self._prefix(filename, bi)
+        path = '{}{}.npy'.format(prefix, mtime)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        ds = gdal.Open(filename)
+        band: gdal.Band = ds.GetRasterBand(bi)
+        if band is None:
+            raise Exception('band number out of range')
+        dtype = gdal.GetDataTypeName(band.DataType)
+        dtype = np.dtype(dtype.lower() if dtype != 'Byte' else 'uint8')
+        fd, temp_path = tempfile.mkstemp(suffix='.npy', dir=self.cache_dir)
+        os.close(fd)
+        arr = np.lib.format.open_memmap(temp_path, mode='w+', dtype=dtype, shape=(band.YSize, band.XSize))
+        for xoff, yoff, xsize, ysize in block_process.iter_windows(band):
+            arr[yoff:yoff + ysize, xoff:xoff + xsize] = band.ReadAsArray(xoff, yoff, xsize, ysize)
+        arr.flush()
+        del arr
+        band = ds = None
+        os.replace(temp_path, path)
+
+        for stale in glob.glob(glob.escape(prefix) + '*.npy'):
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        with self._lock:
+            self.generated += 1
+        return path
+
+    def get_array(self, filename, bi=1, raster_size=None):
+        """
+        returns a read-only memmap of the band, generating the sidecar on first use,
+        or None if the file is not one of the cached dtms (or if raster_size, i.e. of an overview, does not match)
+        """
+        if not self.is_enabled(filename):
+            return None
+        filename = os.path.abspath(str(filename))
+        try:
+            mtime = os.stat(filename).st_mtime_ns
+        except OSError:
+            return None
+        key = filename, bi, mtime
+        with self._lock:
+            arr = self._arrays.get(key)
+            if arr is not None:
+                self.hits += 1
+            file_lock = self._file_locks.setdefault(key[:2], threading.Lock())
+        if arr is None:
+            with file_lock:
+                with self._lock:
+                    arr = self._arrays.get(key)
+                if arr is None:
+                    # the sidecar is written to a temp file and renamed, outside of the global lock
+                    path = '{}{}.npy'.format(self._prefix(filename, bi), mtime)
+                    if not os.path.isfile(path):
+                        path = self.make_sidecar(filename, bi)
+                    arr = np.load(path, mmap_mode='r')
+                    with self._lock:
+                        self.misses += 1
+                        for k in [k for k in self._arrays if k[:2] == key[:2]]:
+                            del self._arrays[k]
+                        self._arrays[key] = arr
+        if raster_size is not None and tuple(raster_size) != (arr.shape[1], arr.shape[0]):
+            return None
+        return arr
+
+    def read_window(self, band: gdal.Band, filename, bi, win):
+        """
+        returns the (xoff, yoff, xsize, ysize) window of the band as a zero copy slice of the sidecar, or None
+        """
+        arr = self.get_array(filename, bi, (band.XSize, band.YSize))
+        if arr is None:
+            return None
+        xoff, yoff, xsize, ysize = win
+        return arr[yoff:yoff + ysize, xoff:xoff + xsize]
+
+    def stats(self):
+        with self._lock:
+            return dict(dtms=len(self.dtms), mapped=len(self._arrays), hits=self.hits, misses=self.misses,
+                        generated=self.generated)
+
+
+dtm_cache = DtmCache.from_defaults()
+
+
+if __name__ == '__main__':
+    # generates the sidecars ahead of time: python -m processes.dtm_cache [dtm.tif ...]
+    for f in sys.argv[1:] or sorted(dtm_cache.dtms):
+        print(dtm_cache.make_sidecar(f))
@@ -21,12 +21,15 @@
 from pywps import Process, ComplexInput, Format, LiteralOutput
 from pywps.app.Common import Metadata
 
+from backend import metrics
+
 
 class FeatureCount(Process):
     def __init__(self):
         inputs = [ComplexInput('layer', 'Layer',
                                [Format('application/gml+xml')])]
-        outputs = [LiteralOutput('count', 'Count', data_type='integer')]
+        outputs = [LiteralOutput('count', 'Count', data_type='integer'),
+                   LiteralOutput('rate', 'Features per second', data_type='float')]
 
         super(FeatureCount, self).__init__(
             self._handler,
@@ -44,11 +47,16 @@ class FeatureCount(Process):
         )
 
     def _handler(self, request, response):
-        import lxml.etree
-        from pywps.app.basic import xpath_ns
-        doc = lxml.etree.parse(request.inputs['layer'][0].file)
-        feature_elements = xpath_ns(doc, '//gml:featureMember')
-        response.outputs['count'].data = len(feature_elements)
+        from processes import gml_reader
+
+        def progress(count):
+            response.update_status('Counted {} features'.format(count))
+
+        # streamed with iterparse, the memory use does not depend on the size of the gml
+        with metrics.phase('gml'):
+            throughput = gml_reader.count_features(request.inputs['layer'][0].file, progress)
+        response.outputs['count'].data = throughput.count
+        response.outputs['rate'].data = throughput.rate
         return response
     
     
@@ -0,0 +1,78 @@
+import time
+
+from lxml import etree
+
+gml_namespaces = ['http://www.opengis.net/gml', 'http://www.opengis.net/gml/3.2']
+wfs_namespaces = ['http://www.opengis.net/wfs/2.0']
+
+# the elements whose children are features:
+# gml:featureMember (one feature each), gml:featureMembers (many features) and wfs:member (wfs 2.0)
+member_tags = frozenset(
+    ['{{{}}}featureMember'.format(ns) for ns in gml_namespaces] +
+    ['{{{}}}featureMembers'.format(ns) for ns in gml_namespaces] +
+    ['{{{}}}member'.format(ns) for ns in wfs_namespaces])
+
+# the features between two progress callbacks
+progress_every = 10000
+
+
+def _clear(elem):
+    """
+    frees an element that was already handled, with its handled previous siblings, so the tree never grows
+    """
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    while elem.getprevious() is not None:
+        del parent[0]
+
+
+def iter_features(source, progress=None):
+    """
+    yields the feature elements of a gml feature collection one by one, using iterparse.
+    each feature is cleared once the consumer asks for the next one, so the memory use is of a single feature
+    regardless of the file size. progress(count) is called every progress_every features.
+    """
+    count = 0
+    for _, elem in etree.iterparse(str(source), events=('end',), huge_tree=True, remove_comments=True):
+        parent = elem.getparent()
+        if parent is None:
+            continue
+        if parent.tag in member_tags:
+            yield elem
+            _clear(elem)
+            count += 1
+            if progress is not None and count % progress_every == 0:
+                progress(count)
+        elif elem.tag in member_tags:
+            _clear(elem)
+
+
+class Throughput:
+    """
+    counts the features read by a streaming reader and reports them as features per second
+    """
+    def __init__(self):
+        self.count = 0
+        self.start = time.perf_counter()
+        self.seconds = 0
+
+    def stop(self):
+        self.seconds = time.perf_counter() - self.start
+        return self
+
+    @property
+    def rate(self):
+        return self.count / self.seconds if self.seconds > 0 else 0
+
+    def __str__(self):
+        return '{} features in {:.3f}s ({:.0f} features/s)'.format(self.count, self.seconds, self.rate)
+
+
+def count_features(source, progress=None) -> Throughput:
+    """
+    counts the features of a gml in constant memory, returns a stopped Throughput
+    """
+    t = Throughput()
+    for _ in iter_features(source, progress):
+        t.count += 1
+    return t.stop()
@@ -1,4 +1,3 @@
-import osgeo.gdal
 from pywps import Process, LiteralInput, LiteralOutput, UOM
 from .process_defaults import process_defaults, LiteralInputD
 
@@ -23,6 +22,7 @@ class GetInfo(Process):
         )
 
     def _handler(self, request, response):
+        import osgeo.gdal
         response.outputs['output'].data = 'Gdal version: {}'.format(osgeo.gdal.__version__)
         response.outputs['output'].uom = UOM('unity')
         return response
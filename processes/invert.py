@@ -1,11 +1,11 @@
-import gdal
+import tempfile
 from pywps import FORMATS
 from pywps.app import Process
 from pywps.inout import ComplexInput, ComplexOutput
 from .process_defaults import process_defaults, LiteralInputD, ComplexInputD, BoundingBoxInputD
 from pywps.app.Common import Metadata
-import numpy as np
 from pywps.response.execute import ExecuteResponse
+from processes import process_helper
 
 
 class Invert(Process):
@@ -13,7 +13,11 @@ class Invert(Process):
         process_id = 'invert'
         defaults = process_defaults(process_id)
         inputs = [
-            ComplexInputD(defaults, 'A', 'input_raster', supported_formats=[FORMATS.GEOTIFF])
+            ComplexInputD(defaults, 'A', 'input_raster', supported_formats=[FORMATS.GEOTIFF]),
+            LiteralInputD(defaults, 'of', 'output format (gtiff, cog)', data_type='string',
+                          min_occurs=0, max_occurs=1, default='gtiff'),
+            LiteralInputD(defaults, 'compress', 'cog compression (DEFLATE, ZSTD, LERC...)', data_type='string',
+                          min_occurs=0, max_occurs=1, default='DEFLATE'),
         ]
         outputs = [
             ComplexOutput('output', 'result raster', supported_formats=[FORMATS.GEOTIFF])
@@ -34,31 +38,22 @@ class Invert(Process):
         )
 
     def _handler(self, request, response: ExecuteResponse):
-        raster_filename = request.inputs['A'][0].file
+        import gdal
+        from processes import block_process, cog
+
+        raster_filename, s_ds = process_helper.open_ds_from_wps_input(request.inputs['A'][0])
 
-        s_ds: gdal.Dataset = gdal.Open(raster_filename, gdal.GA_ReadOnly)
         s_band: gdal.Band = s_ds.GetRasterBand(1)
         (s_min, s_max, *_) = s_band.GetStatistics(False, True)
-        # todo GetVirtualMemArray
-        s_ndv = s_band.GetNoDataValue()
-        s_array = s_band.ReadAsArray()
-        s_array = np.ma.masked_equal(s_array, s_ndv)
-
-        d_array = s_max + s_min - s_array
-
-        d_path = raster_filename + '_inverse'
-        d_ds: gdal.Dataset = gdal.GetDriverByName('GTIFF').Create(d_path, s_ds.RasterXSize, s_ds.RasterYSize, 1,
-                                                                  s_band.DataType)
-        d_ds.SetProjection(s_ds.GetProjection())
-        d_ds.SetGeoTransform(s_ds.GetGeoTransform())
 
-        d_band = d_ds.GetRasterBand(1)
-        d_band.SetNoDataValue(s_ndv)
-        d_band.WriteArray(d_array)
-        d_band.FlushCache()
+        d_path = tempfile.mktemp(suffix=FORMATS.GEOTIFF.extension)
+        block_process.block_process(s_ds, d_path, block_process.invert_func(s_min, s_max))
+        del s_band
+        del s_ds
 
-        del d_band
-        del d_ds
+        if cog.is_cog(process_helper.get_request_data(request.inputs, 'of')):
+            compress = process_helper.get_request_data(request.inputs, 'compress')
+            d_path = cog.make_cog_from_temp(d_path, tempfile.mktemp(suffix=FORMATS.GEOTIFF.extension), compress)
 
         response.outputs['output'].output_format = FORMATS.GEOTIFF
         response.outputs['output'].file = d_path
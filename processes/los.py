@@ -0,0 +1,117 @@
+import json
+import tempfile
+
+from pywps import FORMATS, UOM
+from pywps.app import Process
+from pywps.inout import LiteralOutput, ComplexOutput
+from .process_defaults import process_defaults, LiteralInputD, ComplexInputD
+from pywps.app.Common import Metadata
+from pywps.response.execute import ExecuteResponse
+from processes import process_helper
+from backend import metrics
+from backend.formats import csv_format, float64_format
+from processes.viewshed_consts import atmospheric_refraction_coeff
+
+
+class LineOfSight(Process):
+    def __init__(self):
+        process_id = 'los'
+
+        defaults = process_defaults(process_id)
+        mm = dict(min_occurs=1, max_occurs=10000)
+        mm0 = dict(min_occurs=0, max_occurs=10000)
+        mmm = dict(data_type='float', uoms=[UOM('metre')], **mm)
+        mmm0 = dict(data_type='float', uoms=[UOM('metre')], **mm0)
+        inputs = [
+            ComplexInputD(defaults, 'r', 'input raster', supported_formats=[FORMATS.GEOTIFF], min_occurs=1, max_occurs=1),
+            LiteralInputD(defaults, 'bi', 'band index', data_type='positiveInteger', default=1, min_occurs=0, max_occurs=1),
+
+            # observer and target x,y in the given CRS, as literals and/or as a bulk pairs file
+            LiteralInputD(defaults, 'in_crs', 'observers and targets input crs', data_type='string', default=None,
+                          min_occurs=0, max_occurs=1),
+            LiteralInputD(defaults, 'ox', 'observer X/longitude', **mmm0),
+            LiteralInputD(defaults, 'oy', 'observer Y/latitude', **mmm0),
+            LiteralInputD(defaults, 'tx', 'target X/longitude', **mmm0),
+            LiteralInputD(defaults, 'ty', 'target Y/latitude', **mmm0),
+            ComplexInputD(defaults, 'pairs', 'bulk pairs file (csv ox,oy,tx,ty / raw float64 ox,oy,tx,ty)',
+                          supported_formats=[csv_format, float64_format], min_occurs=0, max_occurs=1),
+
+            # observer and target height/altitude/elevation, per pair or carried over to the rest of the pairs
+            LiteralInputD(defaults, 'oz', 'observer height/altitude/elevation', **mmm),
+            LiteralInputD(defaults, 'tz', 'target height/altitude/elevation', **mmm),
+            LiteralInputD(defaults, 'omsl', 'observer height mode MSL(True) / AGL(False)', default=False, data_type='boolean', **mm),
+            LiteralInputD(defaults, 'tmsl', 'target height mode MSL(True) / AGL(False)', default=False, data_type='boolean', **mm),
+            LiteralInputD(defaults, 'refraction_coeff', 'atmospheric refraction correction coefficient',
+                          default=atmospheric_refraction_coeff, data_type='float', **mm),
+
+            LiteralInputD(defaults, 'step', 'distance between the samples along the rays, in pixels', data_type='float',
+                          default=1, min_occurs=0, max_occurs=1),
+            LiteralInputD(defaults, 'interpolate', 'interpolate the terrain between the pixel centers',
+                          data_type='boolean', default=True, min_occurs=0, max_occurs=1),
+            LiteralInputD(defaults, 'profile', 'also return the terrain profile of each pair', data_type='boolean',
+                          default=False, min_occurs=0, max_occurs=1),
+        ]
+        outputs = [
+            LiteralOutput('r', 'input raster name', data_type='string'),
+            LiteralOutput('visible', 'number of visible pairs', data_type='integer'),
+            ComplexOutput('output', 'the pairs as lines with their visibility, distance and first obstruction',
+                          supported_formats=[FORMATS.JSON]),
+            ComplexOutput('profiles', 'the terrain profile (distance, z) of each pair', supported_formats=[FORMATS.JSON]),
+        ]
+
+        super().__init__(
+            self._handler,
+            identifier=process_id,
+            version='1.0',
+            title='line of sight',
+            abstract='computes the line of sight and the terrain profile between observer/target pairs',
+            profile='',
+            metadata=[Metadata('raster')],
+            inputs=inputs,
+            outputs=outputs,
+            store_supported=True,
+            status_supported=True
+        )
+
+    def _handler(self, request, response: ExecuteResponse):
+        import numpy as np
+        from processes import los_calc
+
+        raster_filename, input_ds = process_helper.open_ds_from_wps_input(request.inputs['r'][0])
+        response.outputs['r'].data = raster_filename
+        bi = request.inputs['bi'][0].data
+
+        xy = [process_helper.get_input_data_array(request.inputs[k]) if k in request.inputs else []
+              for k in ['ox', 'oy', 'tx', 'ty']]
+        if len(set(len(v) for v in xy)) != 1:
+            raise Exception('ox, oy, tx, ty should have the same length, got {}'.format([len(v) for v in xy]))
+        pairs = np.array(xy, dtype=np.float64).T.reshape(-1, 4)
+        if 'pairs' in request.inputs:
+            pairs_input = request.inputs['pairs'][0]
+            pairs = np.concatenate((pairs, los_calc.read_pairs(pairs_input.file, pairs_input.data_format.mime_type)))
+        if not len(pairs):
+            raise Exception('no pairs, give ox, oy, tx, ty and/or pairs')
+
+        params = ['oz', 'tz', 'omsl', 'tmsl', 'refraction_coeff']
+        kwargs = {k: process_helper.get_input_data_array(request.inputs[k]) for k in params if k in request.inputs}
+        profiles = process_helper.get_request_data(request.inputs, 'profile')
+        with metrics.phase('los'):
+            result = los_calc.los_calc(
+                input_ds, pairs, bi=bi, in_coords_crs_pj=process_helper.get_request_data(request.inputs, 'in_crs'),
+                step=process_helper.get_request_data(request.inputs, 'step') or 1,
+                interpolate=process_helper.get_request_data(request.inputs, 'interpolate'),
+                profiles=profiles, **kwargs)
+
+        response.outputs['visible'].data = int(result.visible.sum())
+        output_filename = tempfile.mktemp(suffix='.json')
+        with open(output_filename, 'w') as f:
+            json.dump(los_calc.get_features(pairs, result), f)
+        response.outputs['output'].output_format = FORMATS.JSON
+        response.outputs['output'].file = output_filename
+        if profiles:
+            profiles_filename = tempfile.mktemp(suffix='.json')
+            with open(profiles_filename, 'w') as f:
+                json.dump(los_calc.get_profiles(result), f)
+            response.outputs['profiles'].output_format = FORMATS.JSON
+            response.outputs['profiles'].file = profiles_filename
+        return response
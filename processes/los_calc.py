@@ -0,0 +1,267 @@
+import math
+
+import gdal
+import osr
+import numpy as np
+
+from gdalos import projdef
+from gdalos.viewshed.viewshed_params import atmospheric_refraction_coeff
+from processes import raster_sample
+from processes.dtm_cache import dtm_cache
+from backend import warmup
+
+# the samples of the pairs that are computed at once, bounds the memory of the (pairs, samples) arrays
+chunk_samples = 1 << 22
+# the largest dtm window that is read at once, the dtm window of all the pairs is read once up to this size,
+# larger requests are read chunk by chunk, and the points of a larger chunk are split into smaller windows
+max_window_pixels = 1 << 26
+
+
+def read_pairs(filename, mime_type=None) -> np.ndarray:
+    """
+    reads an observer/target pairs file into an (n, 4) float64 array of ox, oy, tx, ty.
+    supported formats: csv/text (ox,oy,tx,ty per line, with an optional header), raw float64 ox,oy,tx,ty
+    """
+    mime_type = mime_type or ''
+    if 'csv' in mime_type or 'text' in mime_type:
+        with open(filename, 'r') as f:
+            first_line = f.readline()
+        try:
+            float(first_line.split(',')[0])
+            skip_header = 0
+        except ValueError:
+            skip_header = 1
+        return np.loadtxt(filename, delimiter=',', skiprows=skip_header, usecols=(0, 1, 2, 3),
+                          dtype=np.float64, ndmin=2)
+    return np.fromfile(filename, dtype='<f8').reshape(-1, 4)
+
+
+def broadcast(values, n, dtype=np.float64) -> np.ndarray:
+    """
+    returns n values, the last given value is carried over to the rest, as ViewshedParams.get_list_from_lists_dict does
+    """
+    arr = np.asarray(values, dtype=dtype).ravel()
+    if len(arr) == 0:
+        raise Exception('no values given')
+    if len(arr) >= n:
+        return arr[:n]
+    return np.concatenate((arr, np.full(n - len(arr), arr[-1], dtype=dtype)))
+
+
+class LosResult:
+    """
+    the line of sight of each pair: visibility, ground distance, and the first obstruction (x, y, z, distance)
+    in the input crs, nan for the visible pairs. profiles is a list of (distance, z) arrays if they were asked for.
+    """
+    def __init__(self, n, profiles=False):
+        self.visible = np.zeros(n, dtype=bool)
+        self.distance = np.full(n, np.nan)
+        self.obstruction = np.full((n, 4), np.nan)
+        self.profiles = [None] * n if profiles else None
+
+
+def _get_metric_scale(srs: osr.SpatialReference, y):
+    """
+    returns the metres per crs unit along x and y, for geographic crs at the given latitudes
+    """
+    if srs.IsGeographic():
+        m_per_deg = srs.GetSemiMajor() * math.pi / 180
+        return m_per_deg * np.cos(np.radians(y)), np.full_like(y, m_per_deg)
+    unit = srs.GetLinearUnits() or 1
+    return np.full_like(y, unit), np.full_like(y, unit)
+
+
+def _transform(transform, x, y):
+    if transform is None:
+        return x, y
+    points = np.array(transform.TransformPoints(np.stack((x, y), axis=1).tolist()), dtype=np.float64)
+    return points[:, 0], points[:, 1]
+
+
+class DtmSampler:
+    """
+    samples a band over windows that are read (or sliced from the dtm_cache / warm up arrays) once
+    """
+    def __init__(self, band: gdal.Band, filename, bi, interpolate=True):
+        self.band = band
+        self.filename = filename
+        self.bi = bi
+        self.interpolate = interpolate
+        self.ndv = band.GetNoDataValue()
+        self.array = dtm_cache.get_array(filename, bi, (band.XSize, band.YSize))
+        self.win = None
+        self.win_array = None
+
+    def get_window(self, px, py):
+        """
+        the (xoff, yoff, xsize, ysize) window that covers the pixels with their interpolation neighbours
+        """
+        x0 = max(int(math.floor(np.nanmin(px))) - 1, 0)
+        y0 = max(int(math.floor(np.nanmin(py))) - 1, 0)
+        x1 = min(int(math.ceil(np.nanmax(px))) + 1, self.band.XSize)
+        y1 = min(int(math.ceil(np.nanmax(py))) + 1, self.band.YSize)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1 - x0, y1 - y0
+
+    def read(self, win):
+        if win is None:
+            self.win = self.win_array = None
+        elif self.array is not None:
+            # the whole mapped sidecar, nothing is copied
+            self.win = 0, 0, self.band.XSize, self.band.YSize
+            self.win_array = self.array
+        else:
+            self.win = win
+            # sample_array gathers from the flat array, a slice of a shared array is copied once here
+            self.win_array = np.ascontiguousarray(warmup.read_window(self.band, self.filename, self.bi, win))
+
+    def covers(self, win):
+        w = self.win
+        return win is None or w is not None and w[0] <= win[0] and w[1] <= win[1] and \
+            win[0] + win[2] <= w[0] + w[2] and win[1] + win[3] <= w[1] + w[3]
+
+    def sample(self, px, py):
+        win = self.get_window(px, py)
+        if self.array is None and win is not None and win[2] * win[3] > max_window_pixels:
+            # the points are split between the two halves of the window (recursively), each is read on its own
+            if win[2] >= win[3]:
+                first = px < win[0] + win[2] / 2
+            else:
+                first = py < win[1] + win[3] / 2
+            result = np.empty(np.shape(px))
+            for part in (first, ~first):
+                result[part] = self.sample(px[part], py[part])
+            return result
+        if not self.covers(win):
+            self.read(win)
+        if self.win_array is None:
+            return np.full(np.shape(px), np.nan)
+        return raster_sample.sample_array(self.win_array, np.stack((px, py), axis=-1), self.interpolate, self.ndv,
+                                          self.win[0], self.win[1])
+
+
+def los_calc(input_ds: gdal.Dataset, pairs: np.ndarray, oz, tz, omsl=False, tmsl=False,
+             refraction_coeff=atmospheric_refraction_coeff, bi=1, in_coords_crs_pj=None,
+             step=1.0, interpolate=True, profiles=False) -> LosResult:
+    """
+    computes the line of sight of n observer/target pairs ((n, 4) array of ox, oy, tx, ty in in_coords_crs_pj).
+    oz, tz, omsl, tmsl and refraction_coeff have the viewshed semantics and are given per pair or carried over.
+    each ray is sampled every step pixels, all the rays of a chunk at once over a shared window of the dtm.
+    a pair is visible if the terrain, lowered by the earth curvature (corrected by refraction),
+    does not rise above the straight line from the observer to the target at any sample between them.
+    """
+    band: gdal.Band = input_ds.GetRasterBand(bi)
+    if band is None:
+        raise Exception('band number out of range')
+    gt = input_ds.GetGeoTransform()
+    if gt[2] or gt[4]:
+        raise Exception('rotated rasters are not supported')
+    if step <= 0:
+        raise Exception('step must be positive')
+    pairs = np.asarray(pairs, dtype=np.float64).reshape(-1, 4)
+    n = len(pairs)
+    result = LosResult(n, profiles)
+    if n == 0:
+        return result
+
+    raster_srs = osr.SpatialReference()
+    raster_srs.ImportFromWkt(input_ds.GetProjection())
+    transform = inv_transform = None
+    if in_coords_crs_pj is not None:
+        in_pj = projdef.get_proj_string(in_coords_crs_pj)
+        transform = projdef.get_transform(in_pj, raster_srs)
+        if transform is not None:
+            inv_transform = projdef.get_transform(raster_srs, in_pj)
+    ox, oy = _transform(transform, pairs[:, 0], pairs[:, 1])
+    tx, ty = _transform(transform, pairs[:, 2], pairs[:, 3])
+
+    oz, tz = broadcast(oz, n), broadcast(tz, n)
+    omsl, tmsl = broadcast(omsl, n, bool), broadcast(tmsl, n, bool)
+    # the earth curvature drop at distance d is curv_coeff * d^2 / (2 * r), same as gdal.ViewshedGenerate
+    curv_coeff = 1 - broadcast(refraction_coeff, n)
+    earth_diameter = 2 * raster_srs.GetSemiMajor()
+
+    sx, sy = _get_metric_scale(raster_srs, (oy + ty) / 2)
+    result.distance = np.hypot((tx - ox) * sx, (ty - oy) * sy)
+    opx, opy = (ox - gt[0]) / gt[1], (oy - gt[3]) / gt[5]
+    tpx, tpy = (tx - gt[0]) / gt[1], (ty - gt[3]) / gt[5]
+    samples = np.maximum(np.ceil(np.hypot(tpx - opx, tpy - opy) / step).astype(np.int64) + 1, 2)
+
+    sampler = DtmSampler(band, input_ds.GetDescription(), bi, interpolate)
+    all_win = sampler.get_window(np.concatenate((opx, tpx)), np.concatenate((opy, tpy)))
+    if all_win is not None and all_win[2] * all_win[3] <= max_window_pixels:
+        sampler.read(all_win)
+
+    oz = oz + np.where(omsl, 0, np.nan_to_num(sampler.sample(opx, opy)))
+    tz = tz + np.where(tmsl, 0, np.nan_to_num(sampler.sample(tpx, tpy)))
+    tz -= curv_coeff * result.distance ** 2 / earth_diameter
+
+    # the samples of all the rays are kept flat (ragged, without padding), a chunk of whole rays at a time
+    offsets = np.concatenate(([0], np.cumsum(samples)))
+    dpx, dpy = tpx - opx, tpy - opy
+    result.visible[:] = True
+    start = 0
+    while start < n:
+        end = max(int(np.searchsorted(offsets, offsets[start] + chunk_samples, side='right')) - 1, start + 1)
+        counts = samples[start:end]
+        pair = np.repeat(np.arange(start, end), counts)
+        i = np.arange(offsets[end] - offsets[start]) - (offsets[pair] - offsets[start])
+        last = samples[pair] - 1
+        t = i / last
+        z = sampler.sample(opx[pair] + t * dpx[pair], opy[pair] + t * dpy[pair])
+        d = t * result.distance[pair]
+        terrain = z - curv_coeff[pair] * d ** 2 / earth_diameter
+        los = oz[pair] + t * (tz - oz)[pair]
+        # the observer and the target samples are never obstructions, nan (nodata) terrain never blocks
+        hits = np.flatnonzero((i > 0) & (i < last) & (terrain > los))
+        if len(hits):
+            hit_pairs = pair[hits]
+            # the samples are ordered by pair and by distance, the first hit of each pair is its first obstruction
+            first = hits[np.concatenate(([True], hit_pairs[1:] != hit_pairs[:-1]))]
+            pi = pair[first]
+            result.visible[pi] = False
+            result.obstruction[pi, 0] = ox[pi] + t[first] * (tx - ox)[pi]
+            result.obstruction[pi, 1] = oy[pi] + t[first] * (ty - oy)[pi]
+            result.obstruction[pi, 2] = z[first]
+            result.obstruction[pi, 3] = d[first]
+        if profiles:
+            splits = np.cumsum(counts)[:-1]
+            result.profiles[start:end] = zip(np.split(d, splits), np.split(z, splits))
+        start = end
+
+    obstructed = ~result.visible
+    if inv_transform is not None and obstructed.any():
+        x, y = _transform(inv_transform, result.obstruction[obstructed, 0], result.obstruction[obstructed, 1])
+        result.obstruction[obstructed, 0] = x
+        result.obstruction[obstructed, 1] = y
+    return result
+
+
+def _nan_to_none(values):
+    return [None if v != v else v for v in values.tolist()]
+
+
+def get_features(pairs: np.ndarray, result: LosResult):
+    """
+    returns the pairs as geojson line features from the observer to the target, with their line of sight
+    """
+    features = []
+    for i, (ox, oy, tx, ty) in enumerate(pairs.tolist()):
+        obstruction = None
+        if not result.visible[i]:
+            x, y, z, d = result.obstruction[i].tolist()
+            obstruction = dict(x=x, y=y, z=None if z != z else z, distance=d)
+        features.append(dict(
+            type='Feature',
+            geometry=dict(type='LineString', coordinates=[[ox, oy], [tx, ty]]),
+            properties=dict(index=i, visible=bool(result.visible[i]), distance=float(result.distance[i]),
+                            obstruction=obstruction)))
+    return dict(type='FeatureCollection', features=features)
+
+
+def get_profiles(result: LosResult):
+    """
+    returns the profile of each pair as distance and terrain z lists, null for nodata
+    """
+    return [dict(index=i, distance=d.tolist(), z=_nan_to_none(z)) for i, (d, z) in enumerate(result.profiles)]
@@ -1,6 +1,7 @@
 import os
-from gdalos import gdalos_util
-from gdalos import gdalos_color
+import time
+from processes.ds_pool import ds_pool
+from backend import metrics
 
 
 def get_request_data(request_input, name, get_file: bool = False, index=0):
@@ -14,22 +15,53 @@ def get_request_data(request_input, name, get_file: bool = False, index=0):
     return result
 
 
+def get_color_table(request_input, name):
+    color_palette = get_request_data(request_input, name, True)
+    if color_palette is None:
+        return None
+    from gdalos import gdalos_color
+    return gdalos_color.get_color_table(color_palette)
+
+
 def get_input_data_array(request_input):
     return [x.data for x in request_input]
 
 
+def get_input_filename(request_input):
+    # a default input from process_defaults is given as a path in the data field,
+    # in this case calling .file would dump the path string itself into a temp file.
+    if getattr(request_input, 'prop', None) == 'data':
+        data = request_input.data
+        if isinstance(data, str) and os.path.isfile(data):
+            return data
+    return request_input.file
+
+
 def open_ds_from_wps_input(request_input, **kwargs):
     # ds: gdal.Dataset
-    raster_filename = request_input.file
+    raster_filename = get_input_filename(request_input)
     try:
-        ds = gdalos_util.open_ds(raster_filename, **kwargs)
-    except:
+        with metrics.phase('open_ds'):
+            ds = ds_pool.open_ds(raster_filename, **kwargs)
+    except IOError:
         ds = None
-    if ds is None:
-        raster_filename = request_input.data
-        ds = gdalos_util.open_ds(raster_filename, **kwargs)
     if ds is None:
         raise Exception('cannot open file {}'.format(raster_filename))
     return raster_filename, ds
 
 
+class StatusThrottle:
+    """
+    forwards response.update_status at most once per interval seconds,
+    every status update rewrites the status document of an async execute on disk
+    """
+    def __init__(self, response, interval=1.0):
+        self.response = response
+        self.interval = interval
+        self._last = None
+
+    def update(self, message, percentage=None, force=False):
+        now = time.monotonic()
+        if force or self._last is None or now - self._last >= self.interval:
+            self._last = now
+            self.response.update_status(message, None if percentage is None else int(percentage))
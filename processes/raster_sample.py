@@ -0,0 +1,203 @@
+import json
+
+import gdal
+import osr
+import numpy as np
+
+
+def read_points(filename, mime_type=None) -> np.ndarray:
+    """
+    reads a point file into an (n, 2) float64 array of x, y.
+    supported formats: csv/text (x,y per line), geojson (Point/MultiPoint geometries), raw float64 x,y pairs
+    """
+    mime_type = mime_type or ''
+    if 'json' in mime_type:
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        features = data['features'] if 'features' in data else [data]
+        coords = []
+        for feature in features:
+            geom = feature.get('geometry', feature)
+            if geom['type'] == 'Point':
+                coords.append(geom['coordinates'][:2])
+            elif geom['type'] == 'MultiPoint':
+                coords.extend(c[:2] for c in geom['coordinates'])
+            else:
+                raise Exception('unsupported geometry type for point sampling: {}'.format(geom['type']))
+        return np.array(coords, dtype=np.float64).reshape(-1, 2)
+    elif 'csv' in mime_type or 'text' in mime_type:
+        with open(filename, 'r') as f:
+            first_line = f.readline()
+        # skip a header line if there is one
+        try:
+            float(first_line.split(',')[0])
+            skip_header = 0
+        except ValueError:
+            skip_header = 1
+        arr = np.loadtxt(filename, delimiter=',', skiprows=skip_header, usecols=(0, 1), dtype=np.float64, ndmin=2)
+        return arr
+    else:
+        return np.fromfile(filename, dtype='<f8').reshape(-1, 2)
+
+
+def transform_points(points: np.ndarray, src_srs: osr.SpatialReference, tgt_srs: osr.SpatialReference):
+    """
+    transforms an (n, 2) array of points in a single call
+    """
+    if src_srs.IsSame(tgt_srs):
+        return points
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        src_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        tgt_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    ct = osr.CoordinateTransformation(src_srs, tgt_srs)
+    transformed = ct.TransformPoints(points.tolist())
+    return np.array(transformed, dtype=np.float64)[:, :2]
+
+
+def points_to_pixels(ds: gdal.Dataset, points: np.ndarray, srs=True) -> np.ndarray:
+    """
+    srs == None : points are pixel/line
+    srs == False : points are in the raster srs
+    srs == True : points are lon/lat (EPSG:4326)
+    returns an (n, 2) float64 array of pixel/line coordinates
+    """
+    if srs is None:
+        return points.astype(np.float64)
+    if srs is True:
+        src_srs = osr.SpatialReference()
+        src_srs.ImportFromEPSG(4326)
+        ds_srs = osr.SpatialReference()
+        ds_srs.ImportFromWkt(ds.GetProjection())
+        points = transform_points(points, src_srs, ds_srs)
+    inv_gt = gdal.InvGeoTransform(ds.GetGeoTransform())
+    if inv_gt is None:
+        raise Exception("Failed InvGeoTransform()")
+    x, y = points[:, 0], points[:, 1]
+    px = inv_gt[0] + inv_gt[1] * x + inv_gt[2] * y
+    py = inv_gt[3] + inv_gt[4] * x + inv_gt[5] * y
+    return np.stack((px, py), axis=1)
+
+
+def bilinear(top_left, top_right, bottom_left, bottom_right, wx, wy) -> np.ndarray:
+    """
+    interpolates the four corners with the x, y weights of the right and bottom corners.
+    a nan (nodata) corner only makes the result nan if its weight is not zero,
+    so points on a pixel center or on the line between two pixels next to nodata keep their value.
+    """
+    result = np.zeros(np.shape(wx), dtype=np.float64)
+    for corner, w in ((top_left, (1 - wx) * (1 - wy)), (top_right, wx * (1 - wy)),
+                      (bottom_left, (1 - wx) * wy), (bottom_right, wx * wy)):
+        result += np.where(w != 0, corner * w, 0)
+    return result
+
+
+def sample_pixels(band: gdal.Band, pixels: np.ndarray, interpolate=True, array=None) -> np.ndarray:
+    """
+    samples the band at the given (n, 2) pixel/line coordinates.
+    points are grouped by raster block so each block is read once.
+    array is an optional in memory (or memory mapped) copy of the band to read the blocks from.
+    returns a float64 array, points outside of the raster or over nodata get nan.
+    """
+    n = len(pixels)
+    result = np.full(n, np.nan, dtype=np.float64)
+    if n == 0:
+        return result
+    x_size, y_size = band.XSize, band.YSize
+    ndv = band.GetNoDataValue()
+    block_x, block_y = band.GetBlockSize()
+
+    if interpolate:
+        # pixel centers are at .5
+        fx = pixels[:, 0] - 0.5
+        fy = pixels[:, 1] - 0.5
+        x0 = np.floor(fx).astype(np.int64)
+        y0 = np.floor(fy).astype(np.int64)
+        # clamp the 2x2 neighbourhood to the raster edges
+        valid = (pixels[:, 0] >= 0) & (pixels[:, 0] <= x_size) & (pixels[:, 1] >= 0) & (pixels[:, 1] <= y_size)
+        x0 = np.clip(x0, 0, x_size - 1)
+        y0 = np.clip(y0, 0, y_size - 1)
+        x1 = np.minimum(x0 + 1, x_size - 1)
+        y1 = np.minimum(y0 + 1, y_size - 1)
+        wx = np.clip(fx - x0, 0, 1)
+        wy = np.clip(fy - y0, 0, 1)
+    else:
+        x0 = np.floor(pixels[:, 0]).astype(np.int64)
+        y0 = np.floor(pixels[:, 1]).astype(np.int64)
+        valid = (x0 >= 0) & (x0 < x_size) & (y0 >= 0) & (y0 < y_size)
+
+    idx = np.nonzero(valid)[0]
+    if len(idx) == 0:
+        return result
+    block_ids = (y0[idx] // block_y) * ((x_size + block_x - 1) // block_x) + (x0[idx] // block_x)
+    _, inverse = np.unique(block_ids, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    splits = np.cumsum(np.bincount(inverse))[:-1]
+    for block_points in np.split(idx[order], splits):
+        # read the block plus one pixel to the right and bottom for the interpolation neighbours
+        bx0 = int(x0[block_points].min())
+        by0 = int(y0[block_points].min())
+        bx1 = int((x1 if interpolate else x0)[block_points].max()) + 1
+        by1 = int((y1 if interpolate else y0)[block_points].max()) + 1
+        if array is not None:
+            arr = array[by0:by1, bx0:bx1].astype(np.float64)
+        else:
+            arr = band.ReadAsArray(bx0, by0, bx1 - bx0, by1 - by0).astype(np.float64)
+        if ndv is not None:
+            arr[arr == ndv] = np.nan
+        if interpolate:
+            a, b = x0[block_points] - bx0, x1[block_points] - bx0
+            c, d = y0[block_points] - by0, y1[block_points] - by0
+            result[block_points] = bilinear(arr[c, a], arr[c, b], arr[d, a], arr[d, b],
+                                            wx[block_points], wy[block_points])
+        else:
+            result[block_points] = arr[y0[block_points] - by0, x0[block_points] - bx0]
+    return result
+
+
+def sample_array(arr: np.ndarray, pixels: np.ndarray, interpolate=True, ndv=None, xoff=0, yoff=0) -> np.ndarray:
+    """
+    samples an in memory window of the band, whose top left pixel is (xoff, yoff),
+    at the given (..., 2) pixel/line coordinates, all at once without grouping them by block.
+    returns a float64 array of the points shape, points outside of the window or over nodata get nan.
+    """
+    px = pixels[..., 0] - xoff
+    py = pixels[..., 1] - yoff
+    y_size, x_size = arr.shape
+    if interpolate:
+        # pixel centers are at .5
+        fx, fy = px - 0.5, py - 0.5
+        valid = (px >= 0) & (px <= x_size) & (py >= 0) & (py <= y_size)
+        x0 = np.clip(np.floor(fx).astype(np.int64), 0, x_size - 1)
+        y0 = np.clip(np.floor(fy).astype(np.int64), 0, y_size - 1)
+        x1 = np.minimum(x0 + 1, x_size - 1)
+        y1 = np.minimum(y0 + 1, y_size - 1)
+        wx = np.clip(fx - x0, 0, 1)
+        wy = np.clip(fy - y0, 0, 1)
+        if arr.flags.c_contiguous:
+            # gathering from the flat array is much faster than 2d fancy indexing
+            flat = arr.reshape(-1)
+            top_left, bottom_left = y0 * x_size + x0, y1 * x_size + x0
+            dx = x1 - x0
+            corners = [flat[c].astype(np.float64) for c in (top_left, top_left + dx, bottom_left, bottom_left + dx)]
+        else:
+            corners = [arr[y, x].astype(np.float64) for y, x in ((y0, x0), (y0, x1), (y1, x0), (y1, x1))]
+        if ndv is not None:
+            for c in corners:
+                c[c == ndv] = np.nan
+        result = bilinear(*corners, wx, wy)
+    else:
+        x0 = np.floor(px).astype(np.int64)
+        y0 = np.floor(py).astype(np.int64)
+        valid = (x0 >= 0) & (x0 < x_size) & (y0 >= 0) & (y0 < y_size)
+        result = arr[np.clip(y0, 0, y_size - 1), np.clip(x0, 0, x_size - 1)].astype(np.float64)
+        if ndv is not None:
+            result[result == ndv] = np.nan
+    result[~valid] = np.nan
+    return result
+
+
+def write_values(filename, values: np.ndarray):
+    """
+    writes the values as raw little endian float64
+    """
+    values.astype('<f8').tofile(filename)
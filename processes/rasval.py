@@ -1,14 +1,12 @@
-import gdal
+import tempfile
 from pywps import FORMATS, UOM
 from pywps.app import Process
-from pywps.inout import LiteralOutput
+from pywps.inout import LiteralOutput, ComplexOutput
 from .process_defaults import process_defaults, LiteralInputD, ComplexInputD
 from pywps.app.Common import Metadata
 from pywps.response.execute import ExecuteResponse
-from gdalos.calc import get_pixel_from_raster
 from processes import process_helper
-
-import numpy as np
+from backend.formats import csv_format, float64_format
 
 # from pywps.inout.literaltypes import LITERAL_DATA_TYPES
 
@@ -21,14 +19,18 @@ class RasterValue(Process):
             ComplexInputD(defaults, 'r', 'input_raster', supported_formats=[FORMATS.GEOTIFF]),
             LiteralInputD(defaults, 'bi', 'band_index', data_type='positiveInteger', min_occurs=0, max_occurs=1, default=1),
 
-            LiteralInputD(defaults, 'x', 'x or longitude or pixel', data_type='float', min_occurs=1, uoms=[UOM('metre')]),
-            LiteralInputD(defaults, 'y', 'y or latitude or line', data_type='float', min_occurs=1, uoms=[UOM('metre')]),
+            LiteralInputD(defaults, 'x', 'x or longitude or pixel', data_type='float', min_occurs=0, uoms=[UOM('metre')]),
+            LiteralInputD(defaults, 'y', 'y or latitude or line', data_type='float', min_occurs=0, uoms=[UOM('metre')]),
+            ComplexInputD(defaults, 'points', 'bulk points file (csv x,y / geojson / raw float64 x,y pairs)',
+                          supported_formats=[csv_format, FORMATS.GEOJSON, float64_format], min_occurs=0, max_occurs=1),
 
             LiteralInputD(defaults, 'c', 'coordinate kind: ll/xy/pl', data_type='string', min_occurs=1, max_occurs=1, default='ll'),
             LiteralInputD(defaults, 'interpolate', 'interpolate ', data_type='boolean', min_occurs=1, max_occurs=1, default=True),
         ]
         outputs = [LiteralOutput('v', 'raster value at the requested coordinate as float', data_type='float'),
-                   LiteralOutput('output', 'raster value at the requested coordinate (as string)', data_type='string')]
+                   LiteralOutput('output', 'raster value at the requested coordinate (as string)', data_type='string'),
+                   ComplexOutput('values', 'raster values at the requested bulk points (raw float64, nan for nodata)',
+                                 supported_formats=[float64_format])]
 
         super().__init__(
             self._handler,
@@ -45,9 +47,16 @@ class RasterValue(Process):
         )
 
     def _handler(self, request, response: ExecuteResponse):
+        import gdal
+        import numpy as np
+        from gdalos.calc import get_pixel_from_raster
+        from processes import raster_sample
+        from processes.dtm_cache import dtm_cache
+
         raster_filename, ds = process_helper.open_ds_from_wps_input(request.inputs['r'][0])
 
-        band: gdal.Band = ds.GetRasterBand(request.inputs['bi'][0].data)
+        bi = request.inputs['bi'][0].data
+        band: gdal.Band = ds.GetRasterBand(bi)
         if band is None:
             raise Exception('band number out of range')
 
@@ -64,6 +73,23 @@ class RasterValue(Process):
             else:
                 raise Exception('Unknown xy format {}'.format(c))
 
+        if 'points' in request.inputs:
+            points_input = request.inputs['points'][0]
+            points = raster_sample.read_points(points_input.file, points_input.data_format.mime_type)
+            pixels = raster_sample.points_to_pixels(ds, points, srs)
+            interpolate = process_helper.get_request_data(request.inputs, 'interpolate')
+            array = dtm_cache.get_array(raster_filename, bi, (band.XSize, band.YSize))
+            values = raster_sample.sample_pixels(band, pixels, interpolate=interpolate, array=array)
+            values_filename = tempfile.mktemp(suffix=float64_format.extension)
+            raster_sample.write_values(values_filename, values)
+            response.outputs['values'].output_format = float64_format
+            response.outputs['values'].file = values_filename
+            del band
+            del ds
+            return response
+
+        if 'x' not in request.inputs or 'y' not in request.inputs:
+            raise Exception('no points, give x, y or points')
         x = process_helper.get_input_data_array(request.inputs['x'])
         y = process_helper.get_input_data_array(request.inputs['y'])
 
@@ -0,0 +1,133 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from processes import process_helper
+
+
+def file_content_hash(filename, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_input_identity(request_input):
+    """
+    returns a json-able identity of a single wps input.
+    local files given by path (i.e. the default rasters) are identified by path, mtime and size,
+    uploaded or referenced files are identified by their content.
+    """
+    if hasattr(request_input, 'supported_formats'):
+        # complex input
+        filename = process_helper.get_input_filename(request_input)
+        if request_input.prop == 'data' and filename == request_input.data:
+            st = os.stat(filename)
+            return ['path', os.path.abspath(filename), st.st_mtime_ns, st.st_size]
+        return ['content', file_content_hash(filename)]
+    data = request_input.data
+    if isinstance(data, (list, tuple)):
+        return [str(x) for x in data]
+    return str(data)
+
+
+class ResultCache:
+    """
+    a content addressed disk cache of process output files.
+    the key is a hash of the resolved request inputs (after process_defaults were applied),
+    entries are evicted by least recent use once the total size is over max_bytes.
+    """
+    def __init__(self, cache_dir='./workdir/result_cache', max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, process_id, inputs, exclude=()) -> str:
+        """
+        exclude the inputs that do not change the output file (i.e. unused ones).
+        the output format inputs (of, compress) do change it, and the fake rasters (fr) replace the result,
+        so they are part of the key
+        """
+        d = {k: [get_input_identity(x) for x in v] for k, v in inputs.items() if k not in exclude}
+        s = json.dumps([process_id, d], sort_keys=True)
+        return hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+    def _path(self, key, ext):
+        return os.path.join(self.cache_dir, key + ext)
+
+    def get(self, key, ext):
+        if key is None:
+            return None
+        path = self._path(key, ext)
+        with self._lock:
+            try:
+                # mtime is used as the last access time for the LRU eviction
+                os.utime(path)
+            except OSError:
+                # not cached, or evicted by another server process
+                self.misses += 1
+                return None
+            self.hits += 1
+            return path
+
+    def put(self, key, ext, filename):
+        if key is None or not filename or not os.path.isfile(filename):
+            return None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key, ext)
+        # copy to a temp name first so a concurrent reader would never see a partial file,
+        # the temp names are hidden, so a concurrent eviction would not remove them before they are renamed
+        fd, temp_path = tempfile.mkstemp(prefix='.', suffix=ext, dir=self.cache_dir)
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, temp_path)
+            os.replace(temp_path, path)
+        except OSError:
+            os.remove(temp_path)
+            raise
+        self.evict()
+        return path
+
+    def _entries(self):
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for e in os.scandir(self.cache_dir):
+                if e.name.startswith('.') or not e.is_file():
+                    continue
+                try:
+                    st = e.stat()
+                except OSError:
+                    # evicted by another server process
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
+
+    def evict(self):
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(e[1] for e in entries)
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    self.evictions += 1
+                except OSError:
+                    pass
+                total -= size
+
+    def stats(self):
+        with self._lock:
+            entries = self._entries()
+            return dict(entries=len(entries), size=sum(e[1] for e in entries), max_bytes=self.max_bytes,
+                        hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+result_cache = ResultCache()
@@ -0,0 +1,161 @@
+import os
+import json
+import tempfile
+
+from pywps import FORMATS, UOM
+from pywps.app import Process
+from pywps.inout import LiteralOutput, ComplexOutput
+from .process_defaults import process_defaults, LiteralInputD, ComplexInputD, BoundingBoxInputD
+from pywps.app.Common import Metadata
+from pywps.response.execute import ExecuteResponse
+from processes import process_helper
+from backend import metrics
+from backend.formats import czml_format
+from processes.viewshed_consts import atmospheric_refraction_coeff
+
+
+class SiteSelection(Process):
+    def __init__(self):
+        process_id = 'site_selection'
+
+        defaults = process_defaults(process_id)
+        mm = dict(min_occurs=1, max_occurs=1)
+        mmm = dict(data_type='float', uoms=[UOM('metre')], **mm)
+        mmm0 = dict(data_type='float', uoms=[UOM('metre')], min_occurs=0, max_occurs=4096)
+        inputs = [
+            LiteralInputD(defaults, 'of', 'output format (gtiff, cog, tiles)', data_type='string',
+                          min_occurs=0, max_occurs=1, default='gtiff'),
+            LiteralInputD(defaults, 'compress', 'cog compression (DEFLATE, ZSTD, LERC...)', data_type='string',
+                          min_occurs=0, max_occurs=1, default='DEFLATE'),
+
+            ComplexInputD(defaults, 'r', 'input raster', supported_formats=[FORMATS.GEOTIFF], min_occurs=1, max_occurs=1),
+            LiteralInputD(defaults, 'bi', 'band index', data_type='positiveInteger', default=1, min_occurs=0, max_occurs=1),
+
+            # candidates, as points in in_crs and/or as a grid over an EPSG:4326 extent with a step in in_crs units
+            LiteralInputD(defaults, 'in_crs', 'candidates input crs', data_type='string', default=None, min_occurs=0, max_occurs=1),
+            LiteralInputD(defaults, 'ox', 'candidate X/longitude', **mmm0),
+            LiteralInputD(defaults, 'oy', 'candidate Y/latitude', **mmm0),
+            BoundingBoxInputD(defaults, 'grid', 'extent of a regular grid of candidates',
+                              crss=['EPSG:4326', ], metadata=[Metadata('EPSG.io', 'http://epsg.io/'), ],
+                              min_occurs=0, max_occurs=1, default=None),
+            LiteralInputD(defaults, 'grid_step', 'distance between the grid candidates, in in_crs units', data_type='float',
+                          min_occurs=0, max_occurs=1, default=None),
+
+            # the same viewshed parameters for all the candidates
+            LiteralInputD(defaults, 'min_r', 'Minimum visibility range/radius/distance', default=0, **mmm),
+            LiteralInputD(defaults, 'max_r', 'Maximum visibility range/radius/distance', **mmm),
+            LiteralInputD(defaults, 'oz', 'observer height/altitude/elevation', **mmm),
+            LiteralInputD(defaults, 'tz', 'target height/altitude/elevation', **mmm),
+            LiteralInputD(defaults, 'refraction_coeff', 'atmospheric refraction correction coefficient',
+                          default=atmospheric_refraction_coeff, data_type='float', **mm),
+            LiteralInputD(defaults, 'mode', 'viewshed calc mode', default=2, data_type='integer', **mm),
+
+            LiteralInputD(defaults, 'k', 'number of observers to select', data_type='positiveInteger',
+                          default=5, **mm),
+            LiteralInputD(defaults, 'min_gain', 'stop once the best candidate adds fewer pixels than this',
+                          data_type='positiveInteger', default=1, min_occurs=0, max_occurs=1),
+        ]
+        outputs = [
+            LiteralOutput('r', 'input raster name', data_type='string'),
+            ComplexOutput('output', 'coverage raster of the selected observers', supported_formats=[FORMATS.GEOTIFF, czml_format]),
+            ComplexOutput('observers', 'the selected observers in selection order, with their marginal gain',
+                          supported_formats=[FORMATS.JSON]),
+        ]
+
+        super().__init__(
+            self._handler,
+            identifier=process_id,
+            version='1.0',
+            title='observers site selection',
+            abstract='greedily selects the k candidate observers that maximize the total visible area',
+            profile='',
+            metadata=[Metadata('raster')],
+            inputs=inputs,
+            outputs=outputs,
+            store_supported=True,
+            status_supported=True
+        )
+
+    def _handler(self, request, response: ExecuteResponse):
+        import osr
+        from gdalos import projdef
+        from processes import coverage, viewshed_batch, cog
+        from backend import tiles
+
+        of: str = process_helper.get_request_data(request.inputs, 'of') or 'gtiff'
+        is_tiles = of.lower() == 'tiles'
+        is_cog = cog.is_cog(of)
+
+        raster_filename, input_ds = process_helper.open_ds_from_wps_input(request.inputs['r'][0])
+        response.outputs['r'].data = raster_filename
+        bi = request.inputs['bi'][0].data
+
+        ox = process_helper.get_input_data_array(request.inputs['ox']) if 'ox' in request.inputs else []
+        oy = process_helper.get_input_data_array(request.inputs['oy']) if 'oy' in request.inputs else []
+        if len(ox) != len(oy):
+            raise Exception('length(ox)={} is different from length(oy)={}'.format(len(ox), len(oy)))
+        in_coords_crs_pj = process_helper.get_request_data(request.inputs, 'in_crs')
+        grid = process_helper.get_request_data(request.inputs, 'grid')
+        if grid is not None:
+            # the bbox is in format miny, minx, maxy, maxx, in EPSG:4326
+            grid = [float(x) for x in grid]
+            grid_step = process_helper.get_request_data(request.inputs, 'grid_step')
+            if not grid_step:
+                raise Exception('grid_step is required for a grid of candidates')
+            if in_coords_crs_pj is not None:
+                in_srs = osr.SpatialReference()
+                in_srs.ImportFromProj4(projdef.get_proj_string(in_coords_crs_pj))
+                in_wkt = in_srs.ExportToWkt()
+            else:
+                in_wkt = input_ds.GetProjection()
+            bounds = coverage.get_grid_bounds((grid[1], grid[0], grid[3], grid[2]), in_wkt)
+            gx, gy = coverage.get_grid_points(*bounds, grid_step)
+            ox, oy = ox + gx, oy + gy
+        if not ox:
+            raise Exception('no candidates, give ox, oy and/or grid')
+
+        params = ['min_r', 'max_r', 'oz', 'tz', 'refraction_coeff', 'mode']
+        arrays_dict = {k: process_helper.get_input_data_array(request.inputs[k]) for k in params if k in request.inputs}
+        arrays_dict.update(ox=ox, oy=oy)
+        # the single valued parameters are carried over to all the candidates
+        vp_array = viewshed_batch.get_vp_array(arrays_dict)
+
+        with metrics.phase('viewshed'):
+            candidates = coverage.get_candidates(input_ds, vp_array, bi=bi, in_coords_crs_pj=in_coords_crs_pj)
+        with metrics.phase('site_selection'):
+            k = request.inputs['k'][0].data
+            min_gain = process_helper.get_request_data(request.inputs, 'min_gain') or 1
+            selected, cover = coverage.select_observers(candidates, k, min_gain)
+
+        gt = input_ds.GetGeoTransform()
+        pixel_area = abs(gt[1] * gt[5])
+        features = []
+        covered = 0
+        for rank, c in enumerate(selected):
+            covered += c.gain
+            features.append(dict(
+                type='Feature',
+                geometry=dict(type='Point', coordinates=[ox[c.index], oy[c.index]]),
+                properties=dict(rank=rank, candidate=c.index, gain_pixels=c.gain, gain_area=c.gain * pixel_area,
+                                covered_pixels=covered, covered_area=covered * pixel_area)))
+        fd, observers_filename = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict(type='FeatureCollection', features=features), f)
+        response.outputs['observers'].output_format = FORMATS.JSON
+        response.outputs['observers'].file = observers_filename
+
+        fd, output_filename = tempfile.mkstemp(suffix=FORMATS.GEOTIFF.extension)
+        os.close(fd)
+        coverage.write_coverage(cover, input_ds, output_filename)
+        output_format = FORMATS.GEOTIFF
+        if is_tiles:
+            output_filename = tiles.make_tile_layer(self.uuid, output_filename, name='site_selection')
+            output_format = czml_format
+        elif is_cog:
+            compress = process_helper.get_request_data(request.inputs, 'compress')
+            fd, cog_filename = tempfile.mkstemp(suffix=FORMATS.GEOTIFF.extension)
+            os.close(fd)
+            output_filename = cog.make_cog_from_temp(output_filename, cog_filename, compress)
+        response.outputs['output'].output_format = output_format
+        response.outputs['output'].file = output_filename
+        return response
@@ -0,0 +1,217 @@
+import os
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import ogr
+import osr
+
+# features per batch, each batch is converted to a shapely array and processed with the vectorized functions
+batch_size = 1 << 16
+
+# of: (ogr driver, extension)
+vector_formats = {
+    'geojson': ('GeoJSON', '.geojson'),
+    'fgb': ('FlatGeobuf', '.fgb'),
+    'gpkg': ('GPKG', '.gpkg'),
+    'gml': ('GML', '.gml'),
+}
+
+
+def get_vector_format(of):
+    of = (of or 'geojson').lower()
+    if of not in vector_formats:
+        raise Exception('unsupported vector format {}, supported: {}'.format(of, list(vector_formats)))
+    return of, vector_formats[of][1]
+
+
+class Batch:
+    def __init__(self, fids, properties, geometries):
+        self.fids = fids
+        self.properties = properties
+        # a numpy array of shapely geometries (None for features without a geometry)
+        self.geometries = geometries
+
+    def __len__(self):
+        return len(self.fids)
+
+
+class VectorReader:
+    """
+    reads a layer of a vector file (gml, shp, geojson...) in-process with ogr,
+    the geometries are exported as wkb and converted to shapely arrays a batch at a time
+    """
+    def __init__(self, filename, layer=0, batch_size=batch_size):
+        self.batch_size = batch_size
+        self.ds = ogr.Open(str(filename))
+        if self.ds is None:
+            raise Exception('cannot open vector file {}'.format(filename))
+        self.layer: ogr.Layer = self.ds.GetLayer(layer)
+        if self.layer is None:
+            raise Exception('layer {} not found in {}'.format(layer, filename))
+        self.name = self.layer.GetName()
+        srs = self.layer.GetSpatialRef()
+        self.wkt = srs.ExportToWkt() if srs is not None else None
+        defn = self.layer.GetLayerDefn()
+        self.fields = [defn.GetFieldDefn(i) for i in range(defn.GetFieldCount())]
+
+    def get_feature_count(self):
+        return self.layer.GetFeatureCount()
+
+    def _batch(self, fids, properties, wkbs):
+        import numpy as np
+        import shapely
+        return Batch(fids, properties, shapely.from_wkb(np.array(wkbs, dtype=object)))
+
+    def __iter__(self):
+        names = [f.GetName() for f in self.fields]
+        fids, properties, wkbs = [], [], []
+        self.layer.ResetReading()
+        for feature in self.layer:
+            geom = feature.GetGeometryRef()
+            fids.append(feature.GetFID())
+            properties.append({name: feature.GetField(i) for i, name in enumerate(names)})
+            wkbs.append(bytes(geom.ExportToIsoWkb()) if geom is not None else None)
+            if len(fids) >= self.batch_size:
+                yield self._batch(fids, properties, wkbs)
+                fids, properties, wkbs = [], [], []
+        if fids:
+            yield self._batch(fids, properties, wkbs)
+
+    def close(self):
+        self.layer = self.ds = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def get_geojson_crs(wkt):
+    """
+    returns the legacy geojson crs member of the layer crs (as written by ogr), or None for lon/lat wgs84
+    """
+    if not wkt:
+        return None
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(wkt)
+    srs.AutoIdentifyEPSG()
+    name, code = srs.GetAuthorityName(None), srs.GetAuthorityCode(None)
+    if name is None or code is None or (name == 'EPSG' and code == '4326'):
+        return None
+    return dict(type='name', properties=dict(name='urn:ogc:def:crs:{}::{}'.format(name, code)))
+
+
+class GeoJsonWriter:
+    """
+    writes a geojson feature collection incrementally, a batch at a time,
+    the geometries are encoded by shapely.to_geojson in bulk and only the properties go through json
+    """
+    def __init__(self, filename, name=None, wkt=None):
+        self.filename = filename
+        self.count = 0
+        self._encode = json.JSONEncoder(default=str, separators=(',', ':')).encode
+        self._f = open(filename, 'w')
+        head = ['"type":"FeatureCollection"']
+        if name:
+            head.append('"name":' + self._encode(name))
+        crs = get_geojson_crs(wkt)
+        if crs:
+            head.append('"crs":' + self._encode(crs))
+        self._f.write('{' + ','.join(head) + ',"features":[\n')
+
+    def write(self, geometries, properties):
+        import shapely
+        encode = self._encode
+        features = ['{"type":"Feature","properties":' + encode(p) + ',"geometry":' + (g or 'null') + '}'
+                    for g, p in zip(shapely.to_geojson(geometries), properties)]
+        if features:
+            self._f.write((',\n' if self.count else '') + ',\n'.join(features))
+            self.count += len(features)
+
+    def close(self):
+        if self._f is not None:
+            self._f.write('\n]}\n')
+            self._f.close()
+            self._f = None
+        return self.filename
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class OgrWriter:
+    """
+    writes a layer with ogr (i.e. FlatGeobuf, GPKG), a batch per transaction
+    """
+    def __init__(self, filename, driver, name=None, wkt=None, fields=None, geom_type=ogr.wkbUnknown, options=None):
+        self.filename = filename
+        self.count = 0
+        srs = None
+        if wkt:
+            srs = osr.SpatialReference()
+            srs.ImportFromWkt(wkt)
+        self._ds = ogr.GetDriverByName(driver).CreateDataSource(str(filename), options or [])
+        if self._ds is None:
+            raise Exception('cannot create {}'.format(filename))
+        self._layer: ogr.Layer = self._ds.CreateLayer(name or 'layer', srs, geom_type)
+        for field in fields or []:
+            self._layer.CreateField(field)
+        self._defn = self._layer.GetLayerDefn()
+
+    def write(self, geometries, properties):
+        import shapely
+        layer = self._layer
+        layer.StartTransaction()
+        for wkb, p in zip(shapely.to_wkb(geometries), properties):
+            feature = ogr.Feature(self._defn)
+            for k, v in p.items():
+                if v is not None:
+                    feature.SetField(k, v)
+            if wkb is not None:
+                feature.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb))
+            layer.CreateFeature(feature)
+        layer.CommitTransaction()
+        self.count += len(properties)
+
+    def close(self):
+        self._layer = self._defn = self._ds = None
+        return self.filename
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_writer(filename, of='geojson', name=None, wkt=None, fields=None, geom_type=ogr.wkbUnknown, options=None):
+    of, _ = get_vector_format(of)
+    if of == 'geojson':
+        return GeoJsonWriter(filename, name=name, wkt=wkt)
+    return OgrWriter(filename, vector_formats[of][0], name=name, wkt=wkt, fields=fields, geom_type=geom_type,
+                     options=options)
+
+
+def map_batches(func, batches, max_workers=None):
+    """
+    yields (batch, func(batch.geometries)) in order, computed over a thread pool.
+    the vectorized shapely functions release the gil, so the batches run in parallel without pickling the geometries.
+    at most 2 batches per worker are read ahead of the consumer, so the memory use does not depend on the layer size.
+    """
+    max_workers = max_workers or os.cpu_count()
+    read_ahead = 2 * max_workers
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, executor.submit(func, batch.geometries)))
+            if len(pending) >= read_ahead:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
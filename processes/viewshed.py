@@ -7,13 +7,10 @@ from .process_defaults import process_defaults, LiteralInputD, ComplexInputD, Bo
 from pywps.app.Common import Metadata
 from pywps.response.execute import ExecuteResponse
 from processes import process_helper
-from gdalos.viewshed.viewshed_params import viewshed_defaults, atmospheric_refraction_coeff
+from processes.result_cache import result_cache
+from backend import metrics
+from processes.viewshed_consts import viewshed_defaults, atmospheric_refraction_coeff
 from backend.formats import czml_format
-from gdalos import GeoRectangle
-from gdalos import gdalos_util
-from gdalos.viewshed.viewshed_calc import viewshed_calc, CalcOperation
-from gdalos.viewshed.viewshed_params import ViewshedParams
-from gdalos.gdalos_color import ColorPalette
 from pywps.inout.literaltypes import LITERAL_DATA_TYPES
 
 
@@ -30,8 +27,10 @@ class ViewShed(Process):
         # 254 is the max possible values for unique function. for sum it's not really limited
         inputs = [
             LiteralInputD(defaults, 'out_crs', 'output raster crs', data_type='string', default=None, min_occurs=0, max_occurs=1),
-            LiteralInputD(defaults, 'of', 'output format (czml, gtiff)', data_type='string',
+            LiteralInputD(defaults, 'of', 'output format (czml, gtiff, cog, tiles)', data_type='string',
                           min_occurs=0, max_occurs=1, default='gtiff'),
+            LiteralInputD(defaults, 'compress', 'cog compression (DEFLATE, ZSTD, LERC...)', data_type='string',
+                          min_occurs=0, max_occurs=1, default='DEFLATE'),
 
             ComplexInputD(defaults, 'r', 'input raster', supported_formats=[FORMATS.GEOTIFF], min_occurs=1, max_occurs=1),
             LiteralInputD(defaults, 'bi', 'band index', data_type='positiveInteger', default=1, min_occurs=0, max_occurs=1),
@@ -78,6 +77,13 @@ class ViewShed(Process):
             LiteralInputD(defaults, 'refraction_coeff', 'atmospheric refraction correction coefficient',
                           default=atmospheric_refraction_coeff, data_type='float', **mm),  # was: 1-cc
             LiteralInputD(defaults, 'mode', 'viewshed calc mode', default=2, data_type='integer', **mm),
+            LiteralInputD(defaults, 'batch', 'compute all the observers in a single pass over a shared dtm window',
+                          default=False, data_type='boolean', min_occurs=0, max_occurs=1),
+            LiteralInputD(defaults, 'multires', 'use the dtm overviews in rings of growing distance from the observers '
+                                                '(r_ovr is ignored)',
+                          default=False, data_type='boolean', min_occurs=0, max_occurs=1),
+            LiteralInputD(defaults, 'multires_error', 'multires error bound: max ratio of a ring pixel size to its distance',
+                          default=0.005, data_type='float', min_occurs=0, max_occurs=1),
 
             # color
             ComplexInputD(defaults, 'color_palette', 'color palette', supported_formats=[FORMATS.TEXT],
@@ -123,9 +129,35 @@ class ViewShed(Process):
         )
 
     def _handler(self, request, response: ExecuteResponse):
+        from gdalos import GeoRectangle
+        from gdalos import gdalos_util
+        from gdalos.viewshed.viewshed_calc import viewshed_calc, CalcOperation
+        from gdalos.viewshed.viewshed_params import ViewshedParams
+        from gdalos.gdalos_color import ColorPalette
+        from processes import viewshed_batch, viewshed_multires, cog
+        from processes.cutline import cutline_cache
+        from backend import tiles
+
         of: str = process_helper.get_request_data(request.inputs, 'of')
+        is_tiles = of is not None and of.lower() == 'tiles'
+        is_cog = cog.is_cog(of)
+        if is_tiles or is_cog:
+            # the result is rendered as a tile layer / converted to cog from a GeoTIFF
+            of = 'GTiff'
         ext = gdalos_util.get_ext_by_of(of)
         is_czml = ext == '.czml'
+        output_format = czml_format if is_czml or is_tiles else FORMATS.GEOTIFF
+        output_ext = czml_format.extension if is_tiles else ext
+
+        # a tiles czml references the outputs/<job> dir of the request, which the cache does not own
+        cache_key = None if is_tiles else result_cache.make_key(self.identifier, request.inputs)
+        cached_filename = result_cache.get(cache_key, output_ext)
+        if cached_filename:
+            if 'r' in request.inputs:
+                response.outputs['r'].data = process_helper.get_input_filename(request.inputs['r'][0])
+            response.outputs['output'].output_format = output_format
+            response.outputs['output'].file = cached_filename
+            return response
 
         extent = process_helper.get_request_data(request.inputs, 'extent')
         if extent is not None:
@@ -195,14 +227,54 @@ class ViewShed(Process):
 
         vp_slice = process_helper.get_request_data(request.inputs, 'vps')
 
-        viewshed_calc(input_ds=input_ds, input_filename=raster_filename, bi=bi, backend=backend,
-                      output_filename=output_filename, co=co, of=of,
-                      vp_array=arrays_dict, extent=extent, cutline=cutline, operation=operation,
-                      in_coords_crs_pj=in_coords_crs_pj, out_crs=out_crs,
-                      color_palette=color_palette, discrete_mode=discrete_mode,
-                      files=files, vp_slice=vp_slice)
-
-        response.outputs['output'].output_format = czml_format if is_czml else FORMATS.GEOTIFF
+        multires = process_helper.get_request_data(request.inputs, 'multires') and arrays_dict is not None
+        if multires:
+            # a single viewshed keeps the given visible/invisible values
+            vp_array = viewshed_batch.get_vp_array(arrays_dict, vp_slice,
+                                                   restore_defaults=operation not in [None, CalcOperation.viewshed])
+            multires = viewshed_multires.is_multires_supported(operation, vp_array, backend=backend, extent=extent)
+            if multires and r_ovr >= 0:
+                # the rings pick their own overviews of the full resolution raster
+                _, input_ds = process_helper.open_ds_from_wps_input(request.inputs['r'][0])
+        batch = not multires and process_helper.get_request_data(request.inputs, 'batch') and arrays_dict is not None
+        if batch:
+            vp_array = viewshed_batch.get_vp_array(arrays_dict, vp_slice)
+            batch = viewshed_batch.is_batch_supported(operation, vp_array, backend=backend, extent=extent)
+        if not batch and not multires:
+            # the batch clips the cutline to the combined result, which is smaller than the input raster
+            cutline = cutline_cache.prepare(cutline, input_ds)
+        with metrics.phase('viewshed'):
+            if multires:
+                multires_error = process_helper.get_request_data(request.inputs, 'multires_error')
+                viewshed_multires.viewshed_multires_calc(input_ds=input_ds, bi=bi, output_filename=output_filename,
+                                                         co=co, of=of, vp_array=vp_array, extent=extent,
+                                                         cutline=cutline, operation=operation,
+                                                         in_coords_crs_pj=in_coords_crs_pj, out_crs=out_crs,
+                                                         color_palette=color_palette, error=multires_error)
+            elif batch:
+                viewshed_batch.viewshed_batch_calc(input_ds=input_ds, bi=bi, output_filename=output_filename, co=co, of=of,
+                                                   vp_array=vp_array, extent=extent, cutline=cutline, operation=operation,
+                                                   in_coords_crs_pj=in_coords_crs_pj, out_crs=out_crs,
+                                                   color_palette=color_palette)
+            else:
+                viewshed_calc(input_ds=input_ds, input_filename=raster_filename, bi=bi, backend=backend,
+                              output_filename=output_filename, co=co, of=of,
+                              vp_array=arrays_dict, extent=extent, cutline=cutline, operation=operation,
+                              in_coords_crs_pj=in_coords_crs_pj, out_crs=out_crs,
+                              color_palette=color_palette, discrete_mode=discrete_mode,
+                              files=files, vp_slice=vp_slice)
+
+        if is_tiles:
+            output_filename = tiles.make_tile_layer(self.uuid, output_filename, name='viewshed')
+        elif is_cog:
+            compress = process_helper.get_request_data(request.inputs, 'compress')
+            # a fake input raster might be the output itself
+            output_filename = cog.make_cog_from_temp(output_filename, tempfile.mktemp(suffix=ext), compress,
+                                                     remove_temp='fr' not in request.inputs)
+
+        result_cache.put(cache_key, output_ext, output_filename)
+
+        response.outputs['output'].output_format = output_format
         response.outputs['output'].file = output_filename
 
         return response
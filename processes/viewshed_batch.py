@@ -0,0 +1,371 @@
+import os
+import math
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+import gdal
+import osr
+import numpy as np
+
+from gdalos import projdef, gdalos_color, gdalos_trans
+from gdalos.calc import gdal_to_czml
+from gdalos.viewshed import viewshed_params
+from gdalos.viewshed.viewshed_params import ViewshedParams
+from gdalos.viewshed.viewshed_calc import CalcOperation, make_slice
+from processes.dtm_cache import dtm_cache
+from processes import bitset
+from processes.cutline import cutline_cache
+from backend import warmup
+
+batch_operations = [CalcOperation.max, CalcOperation.min,
+                    CalcOperation.count, CalcOperation.count_z, CalcOperation.unique]
+# the operations whose observer results are accumulated as packed bitsets
+packed_operations = [CalcOperation.count, CalcOperation.count_z, CalcOperation.unique]
+
+# below this number of observers the process pool costs more than it saves
+min_observers_for_pool = 4
+
+# the state of the current forked worker (i.e. the dtm window and the operation), set once per worker by _init_worker.
+# only the pool workers use it, the in-process path passes the state to the task function explicitly,
+# so concurrent requests in the threads of a server process never share it
+_worker_state = None
+
+
+class DtmWindow:
+    """
+    a window of the dtm, read once and shared by all the observers of a batch
+    """
+    def __init__(self, array, xoff, yoff, gt, wkt, ndv, data_type):
+        self.array = array
+        self.xoff = xoff
+        self.yoff = yoff
+        self.gt = gt
+        self.wkt = wkt
+        self.ndv = ndv
+        self.data_type = data_type
+
+    def sub_window_ds(self, win) -> gdal.Dataset:
+        """
+        returns a MEM dataset over the given (xoff, yoff, xsize, ysize) raster window,
+        the pixels are copied from the shared array, nothing is read from the disk
+        """
+        xoff, yoff, xsize, ysize = win
+        x0, y0 = xoff - self.xoff, yoff - self.yoff
+        arr = self.array[y0:y0 + ysize, x0:x0 + xsize]
+        ds: gdal.Dataset = gdal.GetDriverByName('MEM').Create('', xsize, ysize, 1, self.data_type)
+        gt = self.gt
+        ds.SetGeoTransform((gt[0] + xoff * gt[1], gt[1], gt[2], gt[3] + yoff * gt[5], gt[4], gt[5]))
+        ds.SetProjection(self.wkt)
+        bnd: gdal.Band = ds.GetRasterBand(1)
+        if self.ndv is not None:
+            bnd.SetNoDataValue(self.ndv)
+        bnd.WriteArray(arr)
+        return ds
+
+
+def _init_worker(*state):
+    global _worker_state
+    _worker_state = state
+
+
+def _call_in_worker(func, task):
+    return func(*_worker_state, task)
+
+
+def _calc_one(dtm: DtmWindow, task):
+    """
+    runs a single observer viewshed on its own window of the shared dtm, returns the result array of that window
+    """
+    index, win, inputs = task
+    ds = dtm.sub_window_ds(win)
+    vs_ds = gdal.ViewshedGenerate(ds.GetRasterBand(1), 'MEM', '', None, **inputs)
+    if not vs_ds:
+        raise Exception('Viewshed calculation failed for observer {}'.format(index))
+    arr = vs_ds.GetRasterBand(1).ReadAsArray()
+    return index, win, arr
+
+
+def _calc_packed(dtm: DtmWindow, operation, task):
+    """
+    runs a single observer viewshed and returns its result packed for the operation
+    """
+    index, win, arr = _calc_one(dtm, task)
+    return index, win, pack_result(arr, operation)
+
+
+def get_observer_window(vp: ViewshedParams, gt, raster_size):
+    """
+    returns the pixel window (xoff, yoff, xsize, ysize) covering the max_r circle of the observer,
+    clipped to the raster, or None if it is completely outside
+    """
+    return get_radius_window(vp.ox, vp.oy, vp.max_r, gt, raster_size)
+
+
+def get_radius_window(ox, oy, r, gt, raster_size):
+    x0 = int(math.floor((ox - r - gt[0]) / gt[1]))
+    x1 = int(math.ceil((ox + r - gt[0]) / gt[1]))
+    y0 = int(math.floor((oy + r - gt[3]) / gt[5]))
+    y1 = int(math.ceil((oy - r - gt[3]) / gt[5]))
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, raster_size[0]), min(y1, raster_size[1])
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def combine_windows(windows, extent):
+    if extent == 3:
+        x0 = max(w[0] for w in windows)
+        y0 = max(w[1] for w in windows)
+        x1 = min(w[0] + w[2] for w in windows)
+        y1 = min(w[1] + w[3] for w in windows)
+        if x1 <= x0 or y1 <= y0:
+            raise Exception('the observers ranges have no intersection')
+    else:
+        x0 = min(w[0] for w in windows)
+        y0 = min(w[1] for w in windows)
+        x1 = max(w[0] + w[2] for w in windows)
+        y1 = max(w[1] + w[3] for w in windows)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def is_batch_supported(operation, vp_array, backend=None, extent=None):
+    """
+    the batch engine only handles gdal backend, omni directional observers and the combine operations,
+    anything else should go through the regular viewshed_calc
+    """
+    if operation not in batch_operations:
+        return False
+    if backend not in [None, 'gdal']:
+        return False
+    if extent not in [2, 3]:
+        return False
+    return all(vp.is_omni_h() for vp in vp_array)
+
+
+def get_vp_array(arrays_dict, vp_slice=None, restore_defaults=True):
+    vp_array = ViewshedParams.get_list_from_lists_dict(arrays_dict)[make_slice(vp_slice)]
+    if restore_defaults:
+        # restore viewshed consts default values, same as viewshed_calc does for combine operations
+        for vp in vp_array:
+            vp.update(viewshed_params.viewshed_defaults)
+    return vp_array
+
+
+class Accumulator:
+    """
+    accumulates single observer viewshed results straight into the combined output array.
+    count, count_z and unique only need the visible (and for count_z the covered) bit of each pixel,
+    their observer results arrive as packed bitsets (see pack_result) on byte aligned windows
+    and are accumulated as packed bit planes, max and min keep the byte results.
+    """
+    def __init__(self, operation, shape, in_ndv, threshold=viewshed_params.viewshed_thresh, max_count=255):
+        self.operation = operation
+        self.threshold = threshold
+        self.in_ndv = in_ndv
+        self.ndv = viewshed_params.viewshed_comb_ndv
+        self.width = shape[1]
+        packed_shape = shape[0], bitset.packed_width(shape[1])
+        if operation in [CalcOperation.max, CalcOperation.min]:
+            self.ndv = in_ndv
+            self.result = np.full(shape, in_ndv, dtype=np.uint8)
+            self.covered = np.zeros(shape, dtype=bool)
+        elif operation == CalcOperation.count:
+            self.ndv = 0
+            self.count = bitset.BitCounter(packed_shape, max_count)
+        elif operation == CalcOperation.count_z:
+            self.count = bitset.BitCounter(packed_shape, max_count)
+            self.covered = np.zeros(packed_shape, dtype=np.uint8)
+        elif operation == CalcOperation.unique:
+            self.index = bitset.IndexPlanes(packed_shape)
+        else:
+            raise Exception('Unsupported batch operation: {}'.format(operation))
+
+    def add(self, index, xoff, yoff, arr):
+        op = self.operation
+        if op in [CalcOperation.max, CalcOperation.min]:
+            ysize, xsize = arr.shape
+            s = np.s_[yoff:yoff + ysize, xoff:xoff + xsize]
+            res = self.result[s]
+            covered = self.covered[s]
+            f = np.maximum if op == CalcOperation.max else np.minimum
+            self.result[s] = np.where(covered, f(res, arr), arr)
+            self.covered[s] = True
+            return
+        visible, covered = arr
+        s = bitset.packed_slice(xoff, yoff, visible)
+        if op == CalcOperation.count:
+            self.count.add(s, visible)
+        elif op == CalcOperation.count_z:
+            self.count.add(s, visible)
+            self.covered[s] |= covered
+        elif op == CalcOperation.unique:
+            self.index.add(s, visible, index)
+
+    def get_result(self):
+        op = self.operation
+        if op in [CalcOperation.max, CalcOperation.min]:
+            return self.result
+        if op == CalcOperation.unique:
+            return self.index.to_array(self.width, self.ndv, viewshed_params.viewshed_comb_multi_val)
+        # the counts saturate below the nodata value of count_z (255)
+        result = self.count.to_array(self.width, 255 if op == CalcOperation.count else self.ndv - 1)
+        if op == CalcOperation.count_z:
+            result[~bitset.unpack(self.covered, self.width).astype(bool)] = self.ndv
+        return result
+
+
+def pack_result(arr, operation, threshold=viewshed_params.viewshed_thresh, in_ndv=viewshed_params.viewshed_ndv):
+    """
+    returns the observer result as the Accumulator takes it: the byte array for max and min,
+    otherwise the packed (visible, covered) bitsets, covered only for count_z. the result is 8 times smaller
+    to send back from the worker and to keep until it is accumulated.
+    """
+    if operation not in packed_operations:
+        return arr
+    covered = bitset.pack(arr != in_ndv) if operation == CalcOperation.count_z else None
+    return bitset.pack(arr > threshold), covered
+
+
+def viewshed_batch_calc(input_ds: gdal.Dataset, output_filename, vp_array, operation: CalcOperation,
+                        bi=1, of='GTiff', co=None, extent=2, cutline=None,
+                        in_coords_crs_pj=None, out_crs=None, color_palette=None, max_workers=None):
+    """
+    computes a combined multi observer viewshed in a single pass:
+    the dtm window covering all the observers max_r is read once,
+    each observer is computed on its own window of it over a process pool,
+    and the results are accumulated into the combined output array without any intermediate rasters.
+    """
+    input_band: gdal.Band = input_ds.GetRasterBand(bi)
+    if input_band is None:
+        raise Exception('band number out of range')
+
+    if operation == CalcOperation.unique:
+        vp_array = vp_array[0:254]
+    gt = input_ds.GetGeoTransform()
+    if gt[2] or gt[4]:
+        raise Exception('rotated rasters are not supported in batch mode')
+    raster_size = input_ds.RasterXSize, input_ds.RasterYSize
+
+    transform_observers(input_ds, vp_array, in_coords_crs_pj)
+
+    packed = operation in packed_operations
+    tasks = []
+    windows = []
+    for i, vp in enumerate(vp_array):
+        win = get_observer_window(vp, gt, raster_size)
+        if win is None:
+            continue
+        windows.append(win)
+        inputs = vp.get_as_gdal_params()
+        # packed results are computed on windows that start on a whole byte, the extra columns are out of range
+        tasks.append((i, bitset.align_window(win, raster_size) if packed else win, inputs))
+    if not tasks:
+        raise Exception('all the observers are outside of the input raster')
+
+    out_win = combine_windows(windows, extent)
+    # the dtm is always read over the union of the observers windows, each observer needs all of its own window
+    read_win = combine_windows([t[1] for t in tasks], 2)
+    dtm = read_dtm_window(input_ds, bi, read_win)
+
+    acc = Accumulator(operation, (read_win[3], read_win[2]), in_ndv=viewshed_params.viewshed_ndv,
+                      max_count=len(tasks))
+    run_tasks(acc, _calc_packed, (dtm, operation), tasks, read_win, max_workers)
+    dtm = None
+
+    result = acc.get_result()
+    x0, y0 = out_win[0] - read_win[0], out_win[1] - read_win[1]
+    result = result[y0:y0 + out_win[3], x0:x0 + out_win[2]]
+    return write_result(result, acc.ndv, out_win, gt, input_ds.GetProjection(), output_filename, of=of, co=co,
+                        cutline=cutline, out_crs=out_crs, color_palette=color_palette)
+
+
+def write_result(result, ndv, out_win, gt, wkt, output_filename, of='GTiff', co=None, cutline=None,
+                 out_crs=None, color_palette=None):
+    """
+    writes a combined result array over the out_win window of the input raster grid,
+    warped to out_crs and/or to the cutline if needed, as a czml or as a raster of the given format
+    """
+    ds: gdal.Dataset = gdal.GetDriverByName('MEM').Create('', out_win[2], out_win[3], 1, gdal.GDT_Byte)
+    ds.SetGeoTransform((gt[0] + out_win[0] * gt[1], gt[1], 0, gt[3] + out_win[1] * gt[5], 0, gt[5]))
+    ds.SetProjection(wkt)
+    bnd: gdal.Band = ds.GetRasterBand(1)
+    if ndv is not None:
+        bnd.SetNoDataValue(ndv)
+    color_table = gdalos_color.get_color_table(color_palette)
+    if color_table:
+        bnd.SetRasterColorTable(color_table)
+        bnd.SetRasterColorInterpretation(gdal.GCI_PaletteIndex)
+    bnd.WriteArray(result)
+    bnd = None
+
+    of = of or 'GTiff'
+    is_czml = of.lower() == 'czml'
+    pjstr_src_srs = projdef.get_srs_pj_from_ds(ds)
+    pjstr_tgt_srs = projdef.get_proj_string(out_crs) if out_crs is not None and not is_czml else pjstr_src_srs
+    if cutline or not projdef.proj_is_equivalent(pjstr_src_srs, pjstr_tgt_srs):
+        cutline = cutline_cache.prepare(cutline, ds)
+        ds = gdalos_trans(ds, warp_CRS=pjstr_tgt_srs, cutline=cutline, of='MEM', return_ds=True, ovr_type=None)
+        if not ds:
+            raise Exception('Viewshed calculation failed to warp the combined result')
+
+    if is_czml:
+        gdal_to_czml.gdal_to_czml(ds, name=str(output_filename), out_filename=output_filename)
+    else:
+        ds = gdal.GetDriverByName(of).CreateCopy(str(output_filename), ds, options=co or [])
+    return ds
+
+
+def transform_observers(input_ds: gdal.Dataset, vp_array, in_coords_crs_pj=None):
+    """
+    transforms the observers coordinates from in_coords_crs_pj to the raster crs, in place
+    """
+    if in_coords_crs_pj is None:
+        return
+    in_raster_srs = osr.SpatialReference()
+    in_raster_srs.ImportFromWkt(input_ds.GetProjection())
+    transform = projdef.get_transform(projdef.get_proj_string(in_coords_crs_pj), in_raster_srs)
+    if transform:
+        for vp in vp_array:
+            vp.ox, vp.oy, _ = transform.TransformPoint(vp.ox, vp.oy)
+
+
+def read_dtm_window(input_ds: gdal.Dataset, bi, win, ovr=-1, gt=None) -> DtmWindow:
+    """
+    reads the (xoff, yoff, xsize, ysize) window of the band (or of its ovr overview, with its own geotransform gt)
+    from the dtm_cache sidecar or the shared warm up arrays if they cover it, otherwise from the raster
+    """
+    input_band: gdal.Band = input_ds.GetRasterBand(bi)
+    band = input_band if ovr < 0 else input_band.GetOverview(ovr)
+    filename = input_ds.GetDescription()
+    arr = dtm_cache.read_window(band, filename, bi, win)
+    if arr is None:
+        arr = warmup.read_window(band, filename, bi, win)
+    return DtmWindow(arr, win[0], win[1], gt or input_ds.GetGeoTransform(),
+                     input_ds.GetProjection(), input_band.GetNoDataValue(), input_band.DataType)
+
+
+def map_tasks(func, state, tasks, max_workers=None):
+    """
+    yields func(*state, task) of each task in order, over a process pool if there are enough tasks.
+    func should be a module level function, the state is sent once to each pool worker.
+    """
+    if len(tasks) < min_observers_for_pool:
+        yield from map(functools.partial(func, *state), tasks)
+        return
+    max_workers = max_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=state) as executor:
+        yield from executor.map(functools.partial(_call_in_worker, func), tasks,
+                                chunksize=max(1, len(tasks) // (4 * max_workers)))
+
+
+def run_tasks(acc: Accumulator, func, state, tasks, read_win, max_workers=None):
+    """
+    computes the observers tasks (see map_tasks) and accumulates the results
+    """
+    _add_results(acc, map_tasks(func, state, tasks, max_workers), read_win)
+
+
+def _add_results(acc: Accumulator, results, read_win):
+    for index, win, arr in results:
+        acc.add(index, win[0] - read_win[0], win[1] - read_win[1], arr)
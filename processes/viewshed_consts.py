@@ -0,0 +1,11 @@
+"""
+the viewshed output values and defaults of gdalos.viewshed.viewshed_params,
+which the process inputs need on startup, without importing gdal (viewshed_params imports it)
+"""
+st_seen = 5
+st_hidden = 2
+st_nodata = 0  # out of range value
+
+viewshed_defaults = dict(vv=st_seen, iv=st_hidden, ov=st_nodata, ndv=st_nodata)
+
+atmospheric_refraction_coeff = 1/7
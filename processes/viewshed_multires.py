@@ -0,0 +1,190 @@
+import math
+
+import gdal
+import numpy as np
+
+from gdalos.viewshed import viewshed_params
+from gdalos.viewshed.viewshed_calc import CalcOperation
+from processes import viewshed_batch, bitset
+from processes.viewshed_batch import Accumulator
+
+# the default error bound: the max ratio between the pixel size of a ring and the distance where it starts.
+# 0.005 (about 0.3 degrees) with a 30m dtm is 30m up to 12km, 60m up to 24km, 120m up to 48km...
+default_error = 0.005
+
+class Level:
+    """
+    a resolution of the dtm (the full resolution or an overview) and the ring of distances [start, end)
+    from the observers that it is used for
+    """
+    def __init__(self, ovr, gt, raster_size, start, end=math.inf):
+        self.ovr = ovr
+        self.gt = gt
+        self.raster_size = raster_size
+        self.start = start
+        self.end = end
+        # the dtm window of this level covering all the observers rings, see read_levels
+        self.dtm = None
+
+    def get_radius(self, max_r):
+        """
+        the viewshed range of this level, padded by a pixel diagonal,
+        so the pixels that contain the edge of the ring are computed even if their centers are beyond it
+        """
+        return min(self.end, max_r) + math.hypot(self.gt[1], self.gt[5])
+
+    def get_window(self, ox, oy, max_r):
+        return viewshed_batch.get_radius_window(ox, oy, self.get_radius(max_r), self.gt, self.raster_size)
+
+
+def get_levels(band: gdal.Band, gt, max_r, error=default_error):
+    """
+    picks the resolution of each ring of distances: an overview is used from the distance at which
+    its pixel size is error times the distance, the full resolution is used up to the first overview.
+    overviews that would only start beyond max_r are not used.
+    """
+    levels = [Level(-1, gt, (band.XSize, band.YSize), 0)]
+    if not error or error <= 0:
+        return levels
+    overviews = []
+    for i in range(band.GetOverviewCount()):
+        ovr: gdal.Band = band.GetOverview(i)
+        fx, fy = band.XSize / ovr.XSize, band.YSize / ovr.YSize
+        overviews.append((max(fx, fy), i, (gt[0], gt[1] * fx, 0, gt[3], 0, gt[5] * fy), (ovr.XSize, ovr.YSize)))
+    for _, i, ovr_gt, raster_size in sorted(overviews):
+        start = max(abs(ovr_gt[1]), abs(ovr_gt[5])) / error
+        if start >= max_r:
+            break
+        if start <= levels[-1].start:
+            continue
+        levels[-1].end = start
+        levels.append(Level(i, ovr_gt, raster_size, start))
+    return levels
+
+
+def read_levels(input_ds: gdal.Dataset, bi, levels, vp_array):
+    """
+    reads the window of each level that covers the ring of all the observers, once.
+    the far rings are read from the overviews (usually from the warm up shared arrays),
+    the full resolution only around the observers. returns the used levels.
+    """
+    result = []
+    for level in levels:
+        windows = [level.get_window(vp.ox, vp.oy, vp.max_r) for vp in vp_array if level.start < vp.max_r]
+        windows = [w for w in windows if w is not None]
+        if not windows:
+            continue
+        win = viewshed_batch.combine_windows(windows, 2)
+        level.dtm = viewshed_batch.read_dtm_window(input_ds, bi, win, ovr=level.ovr, gt=level.gt)
+        result.append(level)
+    return result
+
+
+def _calc_stitched(levels, gt, task):
+    """
+    runs the viewshed of each ring on its own level and stitches the rings on the full resolution observer window.
+    every level is computed from the observer up to the end of its ring, so the far rings also see the near terrain,
+    in the coarser resolution.
+    """
+    index, win, inputs = task
+    ox, oy, max_r = inputs['observerX'], inputs['observerY'], inputs['maxDistance']
+    # the full resolution pixel centers
+    xs = gt[0] + (np.arange(win[0], win[0] + win[2]) + 0.5) * gt[1]
+    ys = gt[3] + (np.arange(win[1], win[1] + win[3]) + 0.5) * gt[5]
+    dist = np.hypot(xs[np.newaxis, :] - ox, ys[:, np.newaxis] - oy)
+    result = np.full((win[3], win[2]), inputs['outOfRangeVal'], dtype=np.uint8)
+    for level in levels:
+        if level.start >= max_r:
+            break
+        level_win = level.get_window(ox, oy, max_r)
+        if level_win is None:
+            continue
+        ds = level.dtm.sub_window_ds(level_win)
+        vs_ds = gdal.ViewshedGenerate(ds.GetRasterBand(1), 'MEM', '', None,
+                                      **dict(inputs, maxDistance=level.get_radius(max_r)))
+        if not vs_ds:
+            raise Exception('Viewshed calculation failed for observer {} on overview {}'.format(index, level.ovr))
+        arr = vs_ds.GetRasterBand(1).ReadAsArray()
+        ds = vs_ds = None
+
+        lgt = level.gt
+        cols = np.floor((xs - lgt[0]) / lgt[1]).astype(np.int64) - level_win[0]
+        rows = np.floor((ys - lgt[3]) / lgt[5]).astype(np.int64) - level_win[1]
+        valid_cols = (cols >= 0) & (cols < level_win[2])
+        valid_rows = (rows >= 0) & (rows < level_win[3])
+        ring = (dist >= level.start) & (dist < level.end) & (dist <= max_r) & \
+            valid_rows[:, np.newaxis] & valid_cols[np.newaxis, :]
+        if not ring.any():
+            continue
+        result[ring] = arr[np.ix_(np.clip(rows, 0, level_win[3] - 1), np.clip(cols, 0, level_win[2] - 1))][ring]
+    return index, win, result
+
+
+def _calc_packed(levels, gt, operation, task):
+    index, win, arr = _calc_stitched(levels, gt, task)
+    return index, win, viewshed_batch.pack_result(arr, operation)
+
+
+def is_multires_supported(operation, vp_array, backend=None, extent=None):
+    """
+    the multi resolution viewshed runs on the batch engine, so it handles the same combine operations,
+    and also a single observer viewshed
+    """
+    if operation in [None, CalcOperation.viewshed]:
+        return len(vp_array) == 1 and backend in [None, 'gdal'] and vp_array[0].is_omni_h()
+    return viewshed_batch.is_batch_supported(operation, vp_array, backend=backend, extent=extent)
+
+
+def viewshed_multires_calc(input_ds: gdal.Dataset, output_filename, vp_array, operation: CalcOperation,
+                           bi=1, of='GTiff', co=None, extent=2, cutline=None,
+                           in_coords_crs_pj=None, out_crs=None, color_palette=None,
+                           error=default_error, max_workers=None):
+    """
+    computes a viewshed (or a combined multi observer viewshed) with the full resolution dtm near the observers
+    and coarser overviews in concentric rings as the distance grows towards max_r (see get_levels),
+    the rings are stitched into a single full resolution result.
+    input_ds should be the full resolution raster, the overviews are taken from it.
+    """
+    input_band: gdal.Band = input_ds.GetRasterBand(bi)
+    if input_band is None:
+        raise Exception('band number out of range')
+    gt = input_ds.GetGeoTransform()
+    if gt[2] or gt[4]:
+        raise Exception('rotated rasters are not supported in multi resolution mode')
+    raster_size = input_ds.RasterXSize, input_ds.RasterYSize
+
+    single = operation in [None, CalcOperation.viewshed]
+    if operation == CalcOperation.unique:
+        vp_array = vp_array[0:254]
+    viewshed_batch.transform_observers(input_ds, vp_array, in_coords_crs_pj)
+
+    acc_operation = CalcOperation.max if single else operation
+    packed = acc_operation in viewshed_batch.packed_operations
+    tasks = []
+    windows = []
+    for i, vp in enumerate(vp_array):
+        win = viewshed_batch.get_observer_window(vp, gt, raster_size)
+        if win is None:
+            continue
+        windows.append(win)
+        tasks.append((i, bitset.align_window(win, raster_size) if packed else win,
+                      vp.get_as_gdal_params()))
+    if not tasks:
+        raise Exception('all the observers are outside of the input raster')
+
+    out_win = viewshed_batch.combine_windows(windows, extent)
+    read_win = viewshed_batch.combine_windows([t[1] for t in tasks], 2)
+    levels = get_levels(input_band, gt, max(vp.max_r for vp in vp_array), error)
+    levels = read_levels(input_ds, bi, levels, [vp_array[t[0]] for t in tasks])
+
+    # a single observer viewshed keeps its own values, it is accumulated as the max of one observer
+    in_ndv = vp_array[0].ndv if single else viewshed_params.viewshed_ndv
+    acc = Accumulator(acc_operation, (read_win[3], read_win[2]), in_ndv=in_ndv, max_count=len(tasks))
+    viewshed_batch.run_tasks(acc, _calc_packed, (levels, gt, acc_operation), tasks, read_win, max_workers)
+    levels = None
+
+    result = acc.get_result()
+    x0, y0 = out_win[0] - read_win[0], out_win[1] - read_win[1]
+    result = result[y0:y0 + out_win[3], x0:x0 + out_win[2]]
+    return viewshed_batch.write_result(result, acc.ndv, out_win, gt, input_ds.GetProjection(), output_filename,
+                                       of=of, co=co, cutline=cutline, out_crs=out_crs, color_palette=color_palette)
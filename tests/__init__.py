@@ -6,6 +6,17 @@ from tests import test_describe
 from tests import test_execute
 from tests import test_requests
 from tests import test_log
+from tests import test_calc_expr
+from tests import test_viewshed_batch
+from tests import test_coverage
+from tests import test_calc_engine
+from tests import test_job_queue
+from tests import test_los_calc
+from tests import test_result_cache
+from tests import test_gml_reader
+from tests import test_ds_pool
+from tests import test_raster_sample
+from tests import test_block_process
 #from tests import test_exceptions
 
 def load_tests(loader=None, tests=None, pattern=None):
@@ -14,7 +25,18 @@ def load_tests(loader=None, tests=None, pattern=None):
         test_describe.load_tests(),
         test_execute.load_tests(),
         test_requests.load_tests(),
-        test_log.load_tests()
+        test_log.load_tests(),
+        test_calc_expr.load_tests(),
+        test_viewshed_batch.load_tests(),
+        test_coverage.load_tests(),
+        test_calc_engine.load_tests(),
+        test_job_queue.load_tests(),
+        test_los_calc.load_tests(),
+        test_result_cache.load_tests(),
+        test_gml_reader.load_tests(),
+        test_ds_pool.load_tests(),
+        test_raster_sample.load_tests(),
+        test_block_process.load_tests()
     ])
 
 if __name__ == "__main__":
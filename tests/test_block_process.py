@@ -0,0 +1,88 @@
+"""Test the block by block raster processing of the invert process
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    import gdal
+    from processes import block_process
+except ImportError:
+    # the blocks are read and written with gdal
+    block_process = None
+
+
+class Band:
+    """the block layout of a band, without its data"""
+
+    def __init__(self, size, block_size):
+        self.XSize, self.YSize = size
+        self.block_size = block_size
+
+    def GetBlockSize(self):
+        return self.block_size
+
+
+@unittest.skipUnless(block_process, 'requires gdal')
+class BlockProcessTest(unittest.TestCase):
+    """Test block_process.iter_windows and block_process.block_process with invert_func
+    """
+
+    ndv = -32768
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_windows(self):
+        """the windows cover the band exactly once, striped bands are read several rows at a time"""
+
+        for size, block_size in [((300, 600), (300, 1)), ((300, 600), (300, 8)), ((300, 600), (64, 64)),
+                                 ((1000, 10), (1000, 1)), ((7, 5), (256, 256))]:
+            with self.subTest(size=size, block_size=block_size):
+                covered = np.zeros(size[::-1], dtype=np.int64)
+                windows = list(block_process.iter_windows(Band(size, block_size)))
+                for xoff, yoff, xsize, ysize in windows:
+                    covered[yoff:yoff + ysize, xoff:xoff + xsize] += 1
+                    if block_size[0] == size[0]:
+                        self.assertTrue(ysize >= block_process.min_window_rows or yoff + ysize == size[1])
+                self.assertTrue((covered == 1).all())
+
+    def test_invert(self):
+        """the streamed invert is the same as inverting the whole array, nodata is kept"""
+
+        rng = np.random.default_rng(0)
+        arr = rng.integers(-100, 1000, (600, 300)).astype(np.int16)
+        arr[rng.random(arr.shape) < 0.1] = self.ndv
+        s_min, s_max = float(arr[arr != self.ndv].min()), float(arr[arr != self.ndv].max())
+        expected = (s_max + s_min - arr).astype(np.int16)
+        expected[arr == self.ndv] = self.ndv
+        for co in [[], ['TILED=YES', 'BLOCKXSIZE=64', 'BLOCKYSIZE=64']]:
+            with self.subTest(co=co):
+                s_path = os.path.join(self.dir, 's.tif')
+                ds = gdal.GetDriverByName('GTiff').Create(s_path, 300, 600, 1, gdal.GDT_Int16, options=co)
+                ds.GetRasterBand(1).SetNoDataValue(self.ndv)
+                ds.GetRasterBand(1).WriteArray(arr)
+                ds = None
+                s_ds = gdal.Open(s_path)
+                d_path = os.path.join(self.dir, 'd.tif')
+                block_process.block_process(s_ds, d_path, block_process.invert_func(s_min, s_max))
+                s_ds = None
+                d_ds = gdal.Open(d_path)
+                self.assertEqual(d_ds.GetRasterBand(1).GetNoDataValue(), self.ndv)
+                self.assertTrue(np.array_equal(d_ds.GetRasterBand(1).ReadAsArray(), expected))
+                d_ds = None
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(BlockProcessTest),
+    ]
+    return unittest.TestSuite(suite_list)
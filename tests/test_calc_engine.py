@@ -0,0 +1,74 @@
+"""Test the chunked calc engine against numpy on the same arrays
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    import gdal
+    from gdalos.calc import gdalos_combine
+    from processes import calc_engine
+except ImportError:
+    # the engine needs gdal and gdalos
+    calc_engine = None
+
+
+@unittest.skipUnless(calc_engine, 'requires gdal and gdalos')
+class CalcChunkedTest(unittest.TestCase):
+    """Test calc_engine.calc_chunked with the inputs of the calc process
+    """
+
+    shape = 37, 53
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.arrays = [rng.integers(0, 6, self.shape).astype(np.uint8) for _ in range(3)]
+        self.files = [self.make_raster(i, arr) for i, arr in enumerate(self.arrays)]
+
+    def tearDown(self):
+        self.files = None
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_raster(self, i, arr):
+        filename = os.path.join(self.dir, '{}.tif'.format(i))
+        ds = gdal.GetDriverByName('GTiff').Create(filename, arr.shape[1], arr.shape[0], 1, gdal.GDT_Byte)
+        ds.SetGeoTransform((35, 0.001, 0, 32, 0, -0.001))
+        ds.GetRasterBand(1).WriteArray(arr)
+        ds.FlushCache()
+        ds = None
+        return gdal.Open(filename)
+
+    def calc(self, calc, kwargs):
+        filenames = {id(ds): ds.GetDescription() for ds in self.files}
+        inputs = calc_engine.get_inputs(kwargs, filenames)
+        self.assertIsNotNone(inputs)
+        ds = calc_engine.calc_chunked(calc, inputs, '', of='MEM', data_type=gdal.GDT_Int32, max_workers=1)
+        self.assertIsNotNone(ds)
+        return ds.GetRasterBand(1).ReadAsArray()
+
+    def test_default_func(self):
+        """the default f/a inputs, sum(1*(x>3) for x in a) over the list input a"""
+
+        calc, kwargs = gdalos_combine.make_calc_with_func(self.files, '1*({}>3)', 'sum')
+        expected = np.sum([1 * (arr > 3) for arr in self.arrays], axis=0)
+        self.assertTrue(np.array_equal(self.calc(calc, kwargs), expected))
+
+    def test_operand(self):
+        """the o/a inputs, 1*(A>3)+1*(B>3)+1*(C>3)"""
+
+        calc, kwargs = gdalos_combine.make_calc_with_operand(self.files, '1*({}>3)', '+')
+        expected = np.sum([1 * (arr > 3) for arr in self.arrays], axis=0)
+        self.assertTrue(np.array_equal(self.calc(calc, kwargs), expected))
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(CalcChunkedTest),
+    ]
+    return unittest.TestSuite(suite_list)
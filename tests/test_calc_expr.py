@@ -0,0 +1,99 @@
+"""Test the compiled calc expressions against eval
+"""
+import unittest
+
+import numpy as np
+
+from processes.calc_expr import compile_expression
+
+
+class CalcExpressionTest(unittest.TestCase):
+    """Test that a compiled expression gives the same values and dtype as eval of the same text
+    """
+
+    expressions = [
+        'numpy.sum([1*(A>3),1*(B>3),1*(C>3)],axis=0)',
+        '1*(A>3)+1*(B>3)+1*(C>3)',
+        'A+B*2-C',
+        'numpy.max([A,B,C],axis=0)',
+        'numpy.mean([A,B],axis=0)',
+        'where(A>B, A, B)',
+        '(A>2)&(B<5)',
+        'A/2+B',
+        'numpy.any([A>8,B>8],axis=0)',
+        'A**2',
+        'numpy.sum([A,B])',
+        'abs(A-B)',
+        'numpy.min([A*1.5,B],axis=0)',
+        'numpy.prod([A,B,C],axis=0)',
+        '2**-1*A',
+    ]
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.layers = [
+            {k: rng.integers(0, 10, (5, 7)).astype(np.uint8) for k in 'ABCD'},
+            {k: rng.random((5, 7)).astype(np.float32) for k in 'ABCD'},
+        ]
+        self.namespace = dict(vars(np), numpy=np)
+
+    def test_same_as_eval(self):
+        """compiled expressions vs eval"""
+
+        for text in self.expressions:
+            for layers in self.layers:
+                with self.subTest(expression=text, dtype=layers['A'].dtype):
+                    expected = np.asarray(eval(text, self.namespace, dict(layers)))
+                    result = np.asarray(compile_expression(text).evaluate(dict(layers)))
+                    self.assertEqual(expected.dtype, result.dtype)
+                    self.assertTrue(np.array_equal(expected, result))
+
+    def test_comprehension(self):
+        """f(... for x in a) as gdalos builds it for the f/a inputs, vs f([... for x in a], axis=0)"""
+
+        for f in ['sum', 'max', 'min', 'mean', 'any']:
+            for layers in self.layers:
+                with self.subTest(function=f, dtype=layers['A'].dtype):
+                    env = dict(a=[layers[k] for k in 'ABC'])
+                    expected = np.asarray(eval('numpy.{}([1*(x>0.5) for x in a], axis=0)'.format(f),
+                                               self.namespace, dict(env)))
+                    result = compile_expression('{}(1*(x>0.5) for x in a)'.format(f)).evaluate(env)
+                    self.assertEqual(expected.dtype, result.dtype)
+                    self.assertTrue(np.array_equal(expected, result))
+
+    def test_inputs_intact(self):
+        """temporaries are reused, the input layers are never overwritten"""
+
+        layers = dict(self.layers[0])
+        a = layers['A'].copy()
+        compile_expression('A+B+C').evaluate(layers)
+        self.assertTrue(np.array_equal(a, layers['A']))
+
+    def test_rejected(self):
+        """anything but arithmetic on the layers and the allowed functions is rejected"""
+
+        for text in ['__import__("os")', 'A.__class__', 'open("x")', 'A[0]', 'lambda: 1', '"s"',
+                     'sum(A, dtype=1)', '(x for x in A)',
+                     'sum(x for x in a if x)', 'sum(x for x in a for y in a)', 'where(x for x in a)',
+                     'sum(x for x in a, axis=0)', 'sum(pi for pi in a)']:
+            with self.subTest(expression=text):
+                with self.assertRaises(Exception):
+                    compile_expression(text)
+
+    def test_constant_cap(self):
+        """constants are folded up to max_constant_bits, larger ones are rejected without computing them"""
+
+        self.assertEqual(compile_expression('2**100*A').evaluate(dict(A=np.ones(2)))[0], 2.0 ** 100)
+        for text in ['9**9**9*A', '2**129*A', '(2**100)*(2**100)*A', '10.0**400*A', str(2 ** 200) + '*A']:
+            with self.subTest(expression=text):
+                with self.assertRaises(Exception):
+                    compile_expression(text)
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(CalcExpressionTest),
+    ]
+    return unittest.TestSuite(suite_list)
@@ -0,0 +1,66 @@
+"""Test the site selection greedy coverage against a brute force greedy
+"""
+import unittest
+
+import numpy as np
+
+from processes.bitset import align_window
+from processes.coverage_select import Candidate, select_observers
+
+
+class SelectObserversTest(unittest.TestCase):
+    """Test coverage_select.select_observers
+    """
+
+    shape = 150, 203
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        height, width = self.shape
+        self.candidates = []
+        self.masks = []
+        for i in range(30):
+            win = int(rng.integers(0, 150)), int(rng.integers(0, 100)), \
+                int(rng.integers(10, 53)), int(rng.integers(10, 50))
+            win = align_window(win, (width, height))
+            visible = rng.random((win[3], win[2])) < 0.3
+            mask = np.zeros(self.shape, dtype=bool)
+            mask[win[1]:win[1] + win[3], win[0]:win[0] + win[2]] = visible
+            self.masks.append(mask)
+            self.candidates.append(Candidate(i, None, win, np.packbits(visible, axis=1)))
+
+    def brute_force(self, k):
+        covered = np.zeros(self.shape, dtype=bool)
+        chosen = []
+        for _ in range(k):
+            gains = [-1 if i in chosen else int((mask & ~covered).sum()) for i, mask in enumerate(self.masks)]
+            best = int(np.argmax(gains))
+            chosen.append(best)
+            covered |= self.masks[best]
+        return chosen, covered
+
+    def test_same_as_brute_force(self):
+        """lazy greedy vs greedy over all the candidates at every step"""
+
+        k = 5
+        selected, coverage = select_observers(self.candidates, k)
+        chosen, covered = self.brute_force(k)
+        self.assertEqual([c.index for c in selected], chosen)
+        self.assertEqual(coverage.pixels, covered.sum())
+        x0, y0, xsize, ysize = coverage.read_win
+        self.assertTrue(np.array_equal(coverage.to_array(), covered[y0:y0 + ysize, x0:x0 + xsize]))
+
+    def test_min_gain(self):
+        """no candidate is selected once the best gain is below min_gain"""
+
+        selected, _ = select_observers(self.candidates, len(self.candidates), min_gain=10 ** 6)
+        self.assertEqual(selected, [])
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(SelectObserversTest),
+    ]
+    return unittest.TestSuite(suite_list)
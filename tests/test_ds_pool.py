@@ -0,0 +1,90 @@
+"""Test the dataset pool leases and its least recently used eviction
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    import gdal
+    from gdalos import gdalos_util
+except ImportError:
+    # the pool opens the datasets with gdalos
+    gdalos_util = None
+
+from processes.ds_pool import DatasetPool
+
+
+@unittest.skipUnless(gdalos_util, 'requires gdal and gdalos')
+class DatasetPoolTest(unittest.TestCase):
+    """Test ds_pool.DatasetPool
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.files = []
+        for i in range(4):
+            filename = os.path.join(self.dir, '{}.tif'.format(i))
+            ds = gdal.GetDriverByName('GTiff').Create(filename, 8, 8, 1, gdal.GDT_Byte)
+            ds = None
+            self.files.append(filename)
+        self.pool = DatasetPool(max_size=2)
+
+    def tearDown(self):
+        self.pool.clear()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def open_in_thread(self, filename):
+        """opens the file in a new thread, its lease ends with the thread"""
+
+        result = []
+
+        def run():
+            with self.pool.lease():
+                result.append(self.pool.open_ds(filename))
+
+        t = threading.Thread(target=run)
+        t.start()
+        t.join()
+        return result[0]
+
+    def test_lease(self):
+        """a leased handle is reused by its thread, other threads get their own until it is released"""
+
+        with self.pool.lease():
+            ds = self.pool.open_ds(self.files[0])
+            self.assertIs(self.pool.open_ds(self.files[0]), ds)
+            with self.pool.lease():
+                # nested leases end with the outermost one
+                self.assertIs(self.pool.open_ds(self.files[0]), ds)
+            self.assertEqual(self.pool.stats()['size'], 0)
+            self.assertIsNot(self.open_in_thread(self.files[0]), ds)
+        self.assertIs(self.open_in_thread(self.files[0]), ds)
+        stats = self.pool.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (3, 2))
+
+    def test_evict(self):
+        """the least recently released idle handles are dropped once the pool is over max_size"""
+
+        handles = [self.open_in_thread(f) for f in self.files[:3]]
+        stats = self.pool.stats()
+        self.assertEqual((stats['size'], stats['evictions']), (2, 1))
+        self.assertIsNot(self.open_in_thread(self.files[0]), handles[0])
+        self.assertIs(self.open_in_thread(self.files[2]), handles[2])
+
+    def test_replaced_file(self):
+        """a file that was replaced on disk gets a fresh handle"""
+
+        ds = self.open_in_thread(self.files[0])
+        os.utime(self.files[0], ns=(0, 0))
+        self.assertIsNot(self.open_in_thread(self.files[0]), ds)
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(DatasetPoolTest),
+    ]
+    return unittest.TestSuite(suite_list)
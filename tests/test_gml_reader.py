@@ -0,0 +1,75 @@
+"""Test the streaming gml feature count
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from processes import gml_reader
+except ImportError:
+    # the reader parses with lxml
+    gml_reader = None
+
+
+@unittest.skipUnless(gml_reader, 'requires lxml')
+class CountFeaturesTest(unittest.TestCase):
+    """Test gml_reader.count_features
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_gml(self, members, members_features, gml='http://www.opengis.net/gml'):
+        """a feature collection with the given number of featureMember elements and of features in featureMembers"""
+
+        feature = '<ogr:f gml:id="f{0}"><ogr:geometryProperty><gml:Point><gml:pos>{0} 1</gml:pos></gml:Point>' \
+                  '</ogr:geometryProperty><ogr:name>a {0}</ogr:name></ogr:f>'
+        filename = os.path.join(self.dir, 'layer.gml')
+        with open(filename, 'w') as f:
+            f.write('<?xml version="1.0" encoding="utf-8" ?>\n'
+                    '<ogr:FeatureCollection xmlns:ogr="http://ogr.maptools.org/" xmlns:gml="{}">\n'.format(gml))
+            f.write('<gml:boundedBy><gml:Envelope><gml:lowerCorner>0 0</gml:lowerCorner></gml:Envelope>'
+                    '</gml:boundedBy>\n')
+            for i in range(members):
+                f.write('<gml:featureMember>{}</gml:featureMember>\n'.format(feature.format(i)))
+            if members_features:
+                f.write('<gml:featureMembers>')
+                for i in range(members_features):
+                    f.write(feature.format(members + i))
+                f.write('</gml:featureMembers>\n')
+            f.write('</ogr:FeatureCollection>\n')
+        return filename
+
+    def test_count(self):
+        """the features of featureMember and featureMembers are counted, their child elements are not"""
+
+        for gml in gml_reader.gml_namespaces:
+            with self.subTest(namespace=gml):
+                self.assertEqual(gml_reader.count_features(self.make_gml(7, 5, gml)).count, 12)
+        self.assertEqual(gml_reader.count_features(self.make_gml(0, 0)).count, 0)
+
+    def test_progress(self):
+        """progress is called every progress_every features with the count so far"""
+
+        calls = []
+        progress_every = gml_reader.progress_every
+        gml_reader.progress_every = 10
+        try:
+            throughput = gml_reader.count_features(self.make_gml(25, 10), calls.append)
+        finally:
+            gml_reader.progress_every = progress_every
+        self.assertEqual(throughput.count, 35)
+        self.assertEqual(calls, [10, 20, 30])
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(CountFeaturesTest),
+    ]
+    return unittest.TestSuite(suite_list)
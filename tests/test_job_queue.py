@@ -0,0 +1,72 @@
+"""Test the job queue bookkeeping of dead server workers and failed submissions
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+try:
+    from backend.job_queue import JobQueue
+except ImportError:
+    # the queue runs the jobs through pywps
+    JobQueue = None
+
+
+@unittest.skipUnless(JobQueue, 'requires pywps')
+class JobQueueTest(unittest.TestCase):
+    """Test backend.job_queue.JobQueue
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.queue = JobQueue(db_filename=os.path.join(self.dir, 'jobs.sqlite3'), workers=2, reserved=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def add_job(self, uuid, state, pid=None):
+        with self.queue._connect() as conn:
+            conn.execute('INSERT INTO jobs (uuid, identifier, priority, state, request, pid, created) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)', (uuid, 'ras_val', 0, state, '{}', pid, time.time()))
+
+    def get_states(self):
+        with self.queue._connect() as conn:
+            return dict(conn.execute('SELECT uuid, state FROM jobs').fetchall())
+
+    def test_reap(self):
+        """running jobs of a server worker that is gone are failed, the ones of a live worker are kept"""
+
+        dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+        dead.wait()
+        self.add_job('dead', 'running', dead.pid)
+        self.add_job('alive', 'running', os.getpid())
+        self.add_job('queued', 'queued')
+        with self.queue._connect() as conn:
+            reaped = self.queue._reap(conn)
+        self.assertEqual(reaped, ['dead'])
+        self.assertEqual(self.get_states(), dict(dead='failed', alive='running', queued='queued'))
+
+    def test_requeue(self):
+        """jobs that could not be submitted to the pool go back to the queue"""
+
+        def submit(uuid):
+            raise RuntimeError('the pool is gone')
+
+        self.queue._submit = submit
+        self.add_job('a', 'queued')
+        self.add_job('b', 'queued')
+        with self.assertRaises(RuntimeError):
+            self.queue.dispatch()
+        self.assertEqual(self.get_states(), dict(a='queued', b='queued'))
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(JobQueueTest),
+    ]
+    return unittest.TestSuite(suite_list)
@@ -0,0 +1,80 @@
+"""Test the vectorized line of sight on a synthetic dtm
+"""
+import unittest
+
+import numpy as np
+
+try:
+    import gdal
+    import osr
+    from processes import los_calc
+except ImportError:
+    # los_calc needs gdal and gdalos
+    los_calc = None
+
+
+@unittest.skipUnless(los_calc, 'requires gdal and gdalos')
+class LosCalcTest(unittest.TestCase):
+    """Test los_calc.los_calc over a flat dtm with a wall across it
+    """
+
+    size = 200
+    gt = (500000, 30, 0, 3600000, 0, -30)
+    wall = 100, 102
+
+    def setUp(self):
+        arr = np.zeros((self.size, self.size), dtype=np.float32)
+        arr[:, self.wall[0]:self.wall[1]] = 100
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(32636)
+        self.ds = gdal.GetDriverByName('MEM').Create('', self.size, self.size, 1, gdal.GDT_Float32)
+        self.ds.SetGeoTransform(self.gt)
+        self.ds.SetProjection(srs.ExportToWkt())
+        self.ds.GetRasterBand(1).WriteArray(arr)
+        rng = np.random.default_rng(0)
+        # pixel coordinates inside the dtm, then to the raster crs
+        px = rng.uniform(1, self.size - 1, (300, 4))
+        self.pairs = np.stack((self.gt[0] + px[:, 0] * self.gt[1], self.gt[3] + px[:, 1] * self.gt[5],
+                               self.gt[0] + px[:, 2] * self.gt[1], self.gt[3] + px[:, 3] * self.gt[5]), axis=1)
+        self.px = px
+
+    def tearDown(self):
+        self.ds = None
+
+    def test_wall(self):
+        """pairs on the same side of the wall see each other, pairs across it are blocked at the wall"""
+
+        result = los_calc.los_calc(self.ds, self.pairs, oz=[2], tz=[2])
+        x0, x1 = self.wall
+        left = np.minimum(self.px[:, 0], self.px[:, 2])
+        right = np.maximum(self.px[:, 0], self.px[:, 2])
+        across = (left < x0 - 1) & (right > x1 + 1)
+        same_side = (right < x0 - 1) | (left > x1 + 1)
+        self.assertTrue(across.any() and same_side.any())
+        self.assertFalse(result.visible[across].any())
+        self.assertTrue(result.visible[same_side].all())
+        obstruction_px = (result.obstruction[across, 0] - self.gt[0]) / self.gt[1]
+        self.assertTrue(((obstruction_px > x0 - 1) & (obstruction_px < x1 + 1)).all())
+        self.assertTrue(np.isnan(result.obstruction[same_side]).all())
+
+    def test_split_windows(self):
+        """splitting the dtm reads into small windows gives the same result as reading the dtm once"""
+
+        expected = los_calc.los_calc(self.ds, self.pairs, oz=[2], tz=[2])
+        max_window_pixels = los_calc.max_window_pixels
+        los_calc.max_window_pixels = 64
+        try:
+            result = los_calc.los_calc(self.ds, self.pairs, oz=[2], tz=[2])
+        finally:
+            los_calc.max_window_pixels = max_window_pixels
+        self.assertTrue(np.array_equal(expected.visible, result.visible))
+        self.assertTrue(np.array_equal(expected.obstruction, result.obstruction, equal_nan=True))
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(LosCalcTest),
+    ]
+    return unittest.TestSuite(suite_list)
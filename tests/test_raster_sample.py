@@ -0,0 +1,72 @@
+"""Test the raster sampling next to nodata
+"""
+import unittest
+
+import numpy as np
+
+try:
+    import gdal
+    from processes import raster_sample
+except ImportError:
+    # the sampling reads the bands with gdal
+    raster_sample = None
+
+
+@unittest.skipUnless(raster_sample, 'requires gdal')
+class SampleTest(unittest.TestCase):
+    """Test raster_sample.sample_pixels and raster_sample.sample_array
+    """
+
+    ndv = -9
+
+    def setUp(self):
+        self.arr = np.array([[1, 2, 3],
+                             [4, -9, 6],
+                             [7, 8, 9]], dtype=np.float32)
+        self.ds = gdal.GetDriverByName('MEM').Create('', 3, 3, 1, gdal.GDT_Float32)
+        band = self.ds.GetRasterBand(1)
+        band.SetNoDataValue(self.ndv)
+        band.WriteArray(self.arr)
+
+    def tearDown(self):
+        self.ds = None
+
+    def sample(self, pixels, interpolate=True):
+        pixels = np.asarray(pixels, dtype=np.float64)
+        result = raster_sample.sample_pixels(self.ds.GetRasterBand(1), pixels, interpolate)
+        self.assertTrue(np.array_equal(
+            result, raster_sample.sample_array(self.arr, pixels, interpolate, self.ndv), equal_nan=True))
+        return result
+
+    def test_bilinear(self):
+        """a nodata corner only makes the result nodata if its weight is not zero"""
+
+        result = self.sample([[0.5, 0.5], [1, 0.5], [0.5, 1], [1, 1], [1.5, 1.5], [1.2, 1.2], [2.5, 2.5]])
+        expected = [1, 1.5, 2.5, np.nan, np.nan, np.nan, 9]
+        self.assertTrue(np.allclose(result, expected, equal_nan=True))
+
+    def test_nearest(self):
+        """without interpolation the containing pixel is sampled, outside of the raster is nodata"""
+
+        result = self.sample([[0.2, 0.9], [1.5, 1.5], [2.9, 2.1], [3.1, 1], [-0.1, 1]], interpolate=False)
+        expected = [1, np.nan, 9, np.nan, np.nan]
+        self.assertTrue(np.array_equal(result, expected, equal_nan=True))
+
+    def test_random(self):
+        """sample_array gives the same values as sample_pixels, inside and next to the nodata pixel"""
+
+        rng = np.random.default_rng(0)
+        pixels = rng.uniform(-0.5, 3.5, (500, 2))
+        for interpolate in [True, False]:
+            with self.subTest(interpolate=interpolate):
+                result = self.sample(pixels, interpolate)
+                self.assertTrue(np.isnan(result).any() and not np.isnan(result).all())
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(SampleTest),
+    ]
+    return unittest.TestSuite(suite_list)
@@ -0,0 +1,90 @@
+"""Test the result cache keys and its least recently used eviction
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+try:
+    from processes.result_cache import ResultCache
+except ImportError:
+    # the process helpers import pywps
+    ResultCache = None
+
+
+class LiteralInput:
+    def __init__(self, data):
+        self.data = data
+
+
+@unittest.skipUnless(ResultCache, 'requires pywps')
+class ResultCacheTest(unittest.TestCase):
+    """Test result_cache.ResultCache
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = ResultCache(cache_dir=os.path.join(self.dir, 'cache'), max_bytes=250)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def make_file(self, name, size=100):
+        filename = os.path.join(self.dir, name)
+        with open(filename, 'wb') as f:
+            f.write(os.urandom(size))
+        return filename
+
+    def make_key(self, exclude=(), **inputs):
+        return self.cache.make_key('calc', {k: [LiteralInput(v)] for k, v in inputs.items()}, exclude)
+
+    def test_key(self):
+        """the key depends on the process and on the values of the inputs that were not excluded"""
+
+        key = self.make_key(a='1*({}>3)', f='sum')
+        self.assertEqual(key, self.make_key(f='sum', a='1*({}>3)'))
+        self.assertNotEqual(key, self.make_key(a='1*({}>3)', f='max'))
+        self.assertNotEqual(key, self.cache.make_key('viewshed', dict(a=[LiteralInput('1*({}>3)')],
+                                                                      f=[LiteralInput('sum')])))
+        self.assertEqual(key, self.make_key(a='1*({}>3)', f='sum', output_czml=True, exclude=('output_czml',)))
+
+    def test_get_put(self):
+        """a put entry is a hit, with the content of the put file, a missing one is a miss"""
+
+        key = self.make_key(f='sum')
+        self.assertIsNone(self.cache.get(key, '.tif'))
+        filename = self.make_file('a.tif')
+        path = self.cache.put(key, '.tif', filename)
+        self.assertEqual(self.cache.get(key, '.tif'), path)
+        with open(filename, 'rb') as f1, open(path, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        os.remove(path)
+        self.assertIsNone(self.cache.get(key, '.tif'))
+
+    def test_evict(self):
+        """the least recently used entries are evicted once the cache is over max_bytes"""
+
+        keys = [self.make_key(f=str(i)) for i in range(3)]
+        for i, key in enumerate(keys[:2]):
+            self.cache.put(key, '.tif', self.make_file('{}.tif'.format(i)))
+            # mtime is the access time of the entries
+            os.utime(self.cache.get(key, '.tif'), (time.time() - 100 + i, time.time() - 100 + i))
+        # the first entry is used again, the second one is now the least recently used
+        self.cache.get(keys[0], '.tif')
+        self.cache.put(keys[2], '.tif', self.make_file('2.tif'))
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIsNotNone(self.cache.get(keys[0], '.tif'))
+        self.assertIsNone(self.cache.get(keys[1], '.tif'))
+        self.assertIsNotNone(self.cache.get(keys[2], '.tif'))
+        self.assertEqual(self.cache.stats()['size'], 200)
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(ResultCacheTest),
+    ]
+    return unittest.TestSuite(suite_list)
@@ -0,0 +1,122 @@
+"""Test the packed viewshed accumulation against the plain uint8 one
+"""
+import unittest
+
+import numpy as np
+
+from processes import bitset
+
+try:
+    from gdalos.viewshed import viewshed_params
+    from gdalos.viewshed.viewshed_calc import CalcOperation
+    from processes import viewshed_batch
+except ImportError:
+    # the batch engine needs gdal and gdalos
+    viewshed_batch = None
+
+
+class Uint8Accumulator:
+    """the byte per pixel accumulation the packed Accumulator replaced, as a reference
+    """
+
+    def __init__(self, operation, shape, in_ndv):
+        self.operation = operation
+        self.threshold = viewshed_params.viewshed_thresh
+        self.in_ndv = in_ndv
+        self.ndv = 0 if operation == CalcOperation.count else viewshed_params.viewshed_comb_ndv
+        if operation == CalcOperation.max:
+            self.ndv = in_ndv
+            self.result = np.full(shape, in_ndv, dtype=np.uint8)
+        elif operation == CalcOperation.unique:
+            self.result = np.full(shape, self.ndv, dtype=np.uint8)
+        else:
+            self.result = np.zeros(shape, dtype=np.uint8)
+        self.count = np.zeros(shape, dtype=np.uint8)
+        self.covered = np.zeros(shape, dtype=bool)
+
+    def add(self, index, xoff, yoff, arr):
+        ysize, xsize = arr.shape
+        s = np.s_[yoff:yoff + ysize, xoff:xoff + xsize]
+        visible = arr > self.threshold
+        if self.operation == CalcOperation.max:
+            self.result[s] = np.where(self.covered[s], np.maximum(self.result[s], arr), arr)
+            self.covered[s] = True
+        elif self.operation == CalcOperation.unique:
+            self.count[s] += visible
+            res = self.result[s]
+            res[visible] = index
+            self.result[s] = res
+        else:
+            self.result[s] += visible
+            self.covered[s] |= arr != self.in_ndv
+
+    def get_result(self):
+        if self.operation == CalcOperation.count_z:
+            self.result[~self.covered] = self.ndv
+        elif self.operation == CalcOperation.unique:
+            self.result[self.count > 1] = viewshed_params.viewshed_comb_multi_val
+            self.result[self.count == 0] = self.ndv
+        return self.result
+
+
+@unittest.skipUnless(viewshed_batch, 'requires gdal and gdalos')
+class AccumulatorTest(unittest.TestCase):
+    """Test viewshed_batch.Accumulator
+    """
+
+    shape = 120, 203
+
+    def setUp(self):
+        self.in_ndv = viewshed_params.viewshed_ndv
+
+    def get_results(self, rng, n):
+        """random observer results on byte aligned windows, out of range outside of their own window"""
+
+        height, width = self.shape
+        for i in range(n):
+            x0, y0 = int(rng.integers(0, 150)), int(rng.integers(0, 100))
+            win = x0, y0, min(int(rng.integers(5, 53)), width - x0), int(rng.integers(5, 20))
+            aligned = bitset.align_window(win, (width, height))
+            arr = rng.integers(0, 6, (aligned[3], aligned[2])).astype(np.uint8)
+            inside = np.zeros_like(arr, dtype=bool)
+            inside[:, win[0] - aligned[0]:win[0] - aligned[0] + win[2]] = True
+            arr[~inside] = self.in_ndv
+            yield i, aligned, arr
+
+    def test_same_as_uint8(self):
+        """packed accumulation vs uint8 accumulation"""
+
+        rng = np.random.default_rng(0)
+        for operation in [CalcOperation.count, CalcOperation.count_z, CalcOperation.unique, CalcOperation.max]:
+            for n in [3, 20, 254]:
+                with self.subTest(operation=operation.name, n=n):
+                    expected = Uint8Accumulator(operation, self.shape, self.in_ndv)
+                    acc = viewshed_batch.Accumulator(operation, self.shape, self.in_ndv, max_count=n)
+                    for i, win, arr in self.get_results(rng, n):
+                        expected.add(i, win[0], win[1], arr)
+                        acc.add(i, win[0], win[1], viewshed_batch.pack_result(arr, operation))
+                    self.assertEqual(expected.ndv, acc.ndv)
+                    self.assertTrue(np.array_equal(expected.get_result(), acc.get_result()))
+
+    def test_count_saturates(self):
+        """counts of more than 255 observers saturate instead of wrapping, below the count_z nodata"""
+
+        arr = np.full((2, 16), viewshed_params.viewshed_thresh + 1, dtype=np.uint8)
+        arr[1] = self.in_ndv
+        for operation, limit in [(CalcOperation.count, 255), (CalcOperation.count_z, 254)]:
+            with self.subTest(operation=operation.name):
+                acc = viewshed_batch.Accumulator(operation, arr.shape, self.in_ndv, max_count=300)
+                for i in range(300):
+                    acc.add(i, 0, 0, viewshed_batch.pack_result(arr, operation))
+                result = acc.get_result()
+                self.assertTrue((result[0] == limit).all())
+                self.assertTrue((result[1] == acc.ndv).all())
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(AccumulatorTest),
+    ]
+    return unittest.TestSuite(suite_list)